@@ -1,5 +1,6 @@
 import json
 import os
+import sys
 from dotenv import load_dotenv
 from googleapiclient.discovery import build
 from google.oauth2.service_account import Credentials
@@ -13,6 +14,11 @@ from selenium.webdriver.common.keys import Keys
 import time
 from webdriver_manager.chrome import ChromeDriverManager
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import session_cache
+import cec_dom
+import llm_cache
+
 # Load .env và config
 load_dotenv()
 with open("config.json", "r") as f:
@@ -46,6 +52,8 @@ options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrom
 options.add_argument("--disable-autofill")
 driver = webdriver.Chrome(service=webdriver.chrome.service.Service(ChromeDriverManager().install()), options=options)
 
+GEMINI_MODEL = "gemini-1.5-pro"
+
 # Prompt cho Gemini
 PROMPT = """
 Extract structured data from the provided text (from a Google Docs lesson plan). Ignore the "Comments" section entirely to avoid storing personal student information. Output a JSON object with the following fields:
@@ -75,6 +83,9 @@ def log_message(message):
         f.write(f"[{timestamp}] {message}\n")
 
 def login_cec(driver):
+    if session_cache.restore_driver_session(driver, cec_username):
+        log_message("Dùng lại session CEC đã lưu")
+        return
     driver.get("https://apps.cec.com.vn/login")
     try:
         username_field = WebDriverWait(driver, 30).until(
@@ -96,6 +107,7 @@ def login_cec(driver):
             log_message("Lỗi đăng nhập: Vẫn ở trang login")
             raise Exception("Login failed")
         log_message("Đăng nhập thành công vào CEC")
+        session_cache.save_driver_session(driver, cec_username)
     except Exception as e:
         log_message(f"Lỗi đăng nhập CEC: {str(e)}")
         raise
@@ -133,10 +145,15 @@ def process_doc_to_json(doc_id, class_name, lesson_number):
     text, links = extract_text_from_doc(doc_id)
     if not text:
         return None
-    model = genai.GenerativeModel("gemini-1.5-pro")
-    response = model.generate_content([PROMPT, text])
+    # Same lesson text and prompt as an earlier run: reuse its answer instead of calling the model
+    json_data = llm_cache.lookup(GEMINI_MODEL, PROMPT, text)
+    if json_data is None:
+        model = genai.GenerativeModel(GEMINI_MODEL)
+        response = model.generate_content([PROMPT, text])
     try:
-        json_data = json.loads(response.text)
+        if json_data is None:
+            json_data = json.loads(response.text)
+            llm_cache.store(GEMINI_MODEL, PROMPT, text, json_data)
         json_data["lesson_number"] = lesson_number
         json_data["class_name"] = class_name
         if "links_all" not in json_data:
@@ -158,6 +175,7 @@ def process_class(class_info):
     
     # Selenium: Lấy report_link, homework_content và class_name
     driver.get(f"https://apps.cec.com.vn/student-calendar/class-detail?classID={class_id}")
+    cec_dom.install_window_open_shim(driver)
     log_message(f"Processing Class ID {class_id}")
     time.sleep(5)
     driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
@@ -168,9 +186,7 @@ def process_class(class_info):
         )
         class_name = class_code_element.text.strip()
         
-        lesson_rows = WebDriverWait(driver, 20).until(
-            EC.presence_of_all_elements_located((By.XPATH, "//tbody/tr"))
-        )
+        lesson_rows = cec_dom.snapshot_lesson_table(driver)
         
         class_data = {
             "class_name": class_name,
@@ -180,29 +196,24 @@ def process_class(class_info):
         
         for lesson_index, row in enumerate(lesson_rows):
             try:
-                lesson_number = row.find_element(By.XPATH, "./td[4]").text.strip()
+                lesson_number = row["lesson_number"]
                 report_link = "No report available"
                 doc_id = None
                 try:
-                    report_button = row.find_element(By.XPATH, ".//i[@data-v-50ef298c and contains(@class, 'isax-card-edit')]")
-                    driver.execute_script("arguments[0].scrollIntoView(true);", report_button)
-                    original_window = driver.current_window_handle
-                    driver.execute_script("arguments[0].click();", report_button)
-                    WebDriverWait(driver, 10).until(EC.number_of_windows_to_be(2))
-                    new_window = [window for window in driver.window_handles if window != original_window][0]
-                    driver.switch_to.window(new_window)
-                    report_link = driver.current_url
+                    if not row["has_report"]:
+                        raise Exception("No report icon")
+                    opened_url = cec_dom.capture_opened_url(driver, lambda: cec_dom.click_row_icon(driver, row, cec_dom.REPORT_ICON))
+                    if not opened_url:
+                        raise Exception("Report icon did not open a link")
+                    report_link = opened_url
                     doc_id = parse_doc_id(report_link)
-                    driver.close()
-                    driver.switch_to.window(original_window)
                 except:
                     log_message(f"No report link for lesson {lesson_number} in Class ID {class_id}")
                 
                 homework_content = "No homework available"
                 try:
-                    homework_button = row.find_element(By.XPATH, ".//i[@data-v-50ef298c and contains(@class, 'isax-book-square')]")
-                    driver.execute_script("arguments[0].scrollIntoView(true);", homework_button)
-                    driver.execute_script("arguments[0].click();", homework_button)
+                    if not row["has_homework"] or not cec_dom.click_row_icon(driver, row, cec_dom.HOMEWORK_ICON):
+                        raise Exception("No homework icon")
                     popup = WebDriverWait(driver, 30).until(EC.visibility_of_element_located((By.CSS_SELECTOR, ".v-dialog--active")))
                     header = popup.find_element(By.CSS_SELECTOR, ".v-toolbar__title").text.strip()
                     text_actions = [elem.text.strip() for elem in popup.find_elements(By.CSS_SELECTOR, ".text-action")]
@@ -244,6 +255,7 @@ def process_class(class_info):
         return None
 
 def main():
+    llm_cache.register_prompt("Class/extract_lessons", PROMPT)
     try:
         login_cec(driver)
         all_classes = []
@@ -259,6 +271,7 @@ def main():
         log_message(f"Saved all classes to {all_classes_path}")
     
     finally:
+        log_message(llm_cache.summary())
         driver.quit()
 
 if __name__ == "__main__":
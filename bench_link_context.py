@@ -0,0 +1,67 @@
+import sys
+import time
+import pdfplumber
+from pdf_extract import WordIndex, LINK_TOLERANCE
+from pdf_fetch import download_pdf
+
+# Micro-benchmark for link-context lookup: the old per-link extract_words + full scan against WordIndex.
+# Usage: python bench_link_context.py [pdf paths or report URLs...]  (default: every report in link.txt,
+# downloaded through the export cache so repeated runs measure parsing, not the network)
+LINK_FILE = "link.txt"
+
+# Previous approach: a full layout pass and a linear scan for every link annotation
+def scan_label(page, annot):
+    for word in page.extract_words(x_tolerance=5, y_tolerance=5):
+        if (abs(word['x0'] - annot['x0']) < LINK_TOLERANCE and abs(word['top'] - annot['top']) < LINK_TOLERANCE) or \
+           (abs(word['x1'] - annot['x1']) < LINK_TOLERANCE and abs(word['bottom'] - annot['bottom']) < LINK_TOLERANCE):
+            return word['text']
+    return None
+
+def index_labels(page, annots):
+    words = WordIndex.from_page(page)
+    return [words.label(annot['x0'], annot['top'], annot['x1'], annot['bottom']) for annot in annots]
+
+def open_source(source):
+    if source.startswith("http"):
+        from extract_lessons import clean_google_docs_url
+        return download_pdf(clean_google_docs_url(source) or source)
+    return open(source, 'rb')
+
+def bench(source):
+    with open_source(source) as pdf_file, pdfplumber.open(pdf_file) as pdf:
+        pages = [(page, [annot for annot in (page.annots or []) if 'uri' in annot]) for page in pdf.pages]
+        pages = [(page, annots) for page, annots in pages if annots]
+        started = time.perf_counter()
+        scanned = [[scan_label(page, annot) for annot in annots] for page, annots in pages]
+        scan_time = time.perf_counter() - started
+        for page, _ in pages:
+            page.flush_cache()
+        started = time.perf_counter()
+        indexed = [index_labels(page, annots) for page, annots in pages]
+        index_time = time.perf_counter() - started
+    links = sum(len(annots) for _, annots in pages)
+    return links, scan_time, index_time, scanned == indexed
+
+def main():
+    sources = sys.argv[1:]
+    if not sources:
+        with open(LINK_FILE, 'r', encoding='utf-8') as f:
+            sources = [line.strip() for line in f if line.strip()]
+    total_links = total_scan = total_index = 0
+    for source in sources:
+        try:
+            links, scan_time, index_time, same = bench(source)
+        except Exception as e:
+            print(f"{source}: skipped ({str(e)})")
+            continue
+        total_links += links
+        total_scan += scan_time
+        total_index += index_time
+        print(f"{source}: {links} links, scan {scan_time * 1000:.1f} ms, index {index_time * 1000:.1f} ms"
+              f"{'' if same else ' (labels differ)'}")
+    if total_index:
+        print(f"Total: {total_links} links, scan {total_scan:.2f}s, index {total_index:.2f}s "
+              f"({total_scan / total_index:.1f}x faster)")
+
+if __name__ == "__main__":
+    main()
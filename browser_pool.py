@@ -0,0 +1,79 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Pool of worker threads, each owning at most one logged-in WebDriver that is started on first use
+class BrowserPool:
+    def __init__(self, size, start_driver, log=print):
+        self.size = max(1, int(size))
+        self.start_driver = start_driver
+        self.log = log
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._drivers = []
+        self._timings = {}
+
+    # Driver for the calling worker, started (and logged in) the first time it is needed
+    def get_driver(self):
+        driver = getattr(self._local, "driver", None)
+        if driver is None:
+            started = time.monotonic()
+            driver = self.start_driver()
+            self._local.driver = driver
+            with self._lock:
+                self._drivers.append(driver)
+                self._stats()["startup"] += time.monotonic() - started
+            self.log(f"[{threading.current_thread().name}] Started WebDriver in {time.monotonic() - started:.1f}s")
+        return driver
+
+    # Drop a broken driver so the worker starts a fresh one on the next task
+    def discard_driver(self):
+        driver = getattr(self._local, "driver", None)
+        if driver is None:
+            return
+        self._local.driver = None
+        with self._lock:
+            if driver in self._drivers:
+                self._drivers.remove(driver)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def _stats(self):
+        name = threading.current_thread().name
+        return self._timings.setdefault(name, {"tasks": 0, "busy": 0.0, "startup": 0.0})
+
+    def _run(self, fn, item):
+        started = time.monotonic()
+        try:
+            return fn(self, item)
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                stats = self._stats()
+                stats["tasks"] += 1
+                stats["busy"] += elapsed
+            self.log(f"[{threading.current_thread().name}] Finished {item} in {elapsed:.1f}s")
+
+    # Run fn(pool, item) for every item concurrently, yielding (item, result or exception) as they complete
+    def map(self, fn, items):
+        with ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="worker") as executor:
+            futures = {executor.submit(self._run, fn, item): item for item in items}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception as e:
+                    yield futures[future], e
+
+    def close(self):
+        with self._lock:
+            drivers, self._drivers = self._drivers, []
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        for name, stats in sorted(self._timings.items()):
+            average = stats["busy"] / stats["tasks"] if stats["tasks"] else 0.0
+            self.log(f"[{name}] {stats['tasks']} tasks, busy {stats['busy']:.1f}s (avg {average:.1f}s/task), driver startup {stats['startup']:.1f}s")
@@ -0,0 +1,196 @@
+import os
+import requests
+
+# Configuration
+CEC_BASE_URL = "https://apps.cec.com.vn"
+CEC_API_URL = os.getenv("CEC_API_URL", f"{CEC_BASE_URL}/api")
+LOGIN_ENDPOINT = "/auth/login"
+CLASS_DETAIL_ENDPOINT = "/student-calendar/class-detail"
+LESSONS_ENDPOINT = "/student-calendar/class-lessons"
+HOMEWORK_ENDPOINT = "/student-calendar/lesson-homework"
+PROFILE_ENDPOINT = "/auth/me"
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0.0.0"
+REQUEST_TIMEOUT = 20
+
+# Raised when the portal JSON endpoints cannot be used and the caller should fall back to Selenium
+class CecApiError(Exception):
+    pass
+
+# Create a requests session that looks like the portal's own XHR calls
+def create_session():
+    session = requests.Session()
+    session.headers.update({
+        "User-Agent": USER_AGENT,
+        "Accept": "application/json, text/plain, */*",
+        "Origin": CEC_BASE_URL,
+        "Referer": f"{CEC_BASE_URL}/"
+    })
+    return session
+
+# Return the first non-empty value among the given keys
+def pick(data, *keys, default=None):
+    if not isinstance(data, dict):
+        return default
+    for key in keys:
+        value = data.get(key)
+        if value not in (None, ""):
+            return value
+    return default
+
+# Value of the first given key present in data, even if empty; CecApiError naming the keys it did get otherwise
+def require(data, *keys, what):
+    if isinstance(data, dict):
+        for key in keys:
+            if key in data:
+                return data[key]
+    found = sorted(data) if isinstance(data, dict) else type(data).__name__
+    raise CecApiError(f"Unexpected response shape: no {what} field among {list(keys)} (got {found})")
+
+# Strip the {"data": ...} envelope the portal wraps around responses
+def unwrap(payload):
+    while isinstance(payload, dict) and "data" in payload and len(payload) <= 4:
+        payload = payload["data"]
+    return payload
+
+# GET a JSON endpoint, raising CecApiError on anything the fallback should handle
+def api_get(session, endpoint, params=None):
+    url = f"{CEC_API_URL}{endpoint}"
+    try:
+        response = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        raise CecApiError(f"GET {endpoint} failed: {str(e)}")
+    if response.status_code in (401, 403):
+        raise CecApiError(f"GET {endpoint} unauthorized (HTTP {response.status_code})")
+    if response.status_code != 200:
+        raise CecApiError(f"GET {endpoint} returned HTTP {response.status_code}")
+    try:
+        return unwrap(response.json())
+    except ValueError:
+        raise CecApiError(f"GET {endpoint} did not return JSON")
+
+def set_token(session, token):
+    session.headers["Authorization"] = f"Bearer {token}"
+
+def get_token(session):
+    header = session.headers.get("Authorization", "")
+    return header[len("Bearer "):] if header.startswith("Bearer ") else None
+
+# Log in once and attach the bearer token to the session
+def login_session(session, username, password):
+    url = f"{CEC_API_URL}{LOGIN_ENDPOINT}"
+    try:
+        response = session.post(url, json={"username": username, "password": password}, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        raise CecApiError(f"Login request failed: {str(e)}")
+    if response.status_code != 200:
+        raise CecApiError(f"Login returned HTTP {response.status_code}")
+    try:
+        payload = unwrap(response.json())
+    except ValueError:
+        raise CecApiError("Login did not return JSON")
+    token = pick(payload, "access_token", "accessToken", "token")
+    if token:
+        set_token(session, token)
+    elif not session.cookies:
+        raise CecApiError("Login response had neither a token nor a session cookie")
+    return session
+
+# One cheap authenticated request: True if the session is logged in, False if rejected, None if it cannot tell
+def check_session(session):
+    try:
+        response = session.get(f"{CEC_API_URL}{PROFILE_ENDPOINT}", timeout=REQUEST_TIMEOUT)
+    except requests.RequestException:
+        return None
+    if response.status_code == 200:
+        return True
+    if response.status_code in (401, 403):
+        return False
+    return None
+
+# Class code and course name as shown in the class-detail header
+def get_class_detail(session, class_id):
+    detail = api_get(session, CLASS_DETAIL_ENDPOINT, {"classID": class_id})
+    if not isinstance(detail, dict):
+        raise CecApiError(f"Unexpected class detail payload for Class ID {class_id}")
+    class_code = pick(detail, "classCode", "class_code", "code", "className", "name")
+    course_name = pick(detail, "courseName", "course_name")
+    if course_name is None and isinstance(detail.get("course"), dict):
+        course_name = pick(detail["course"], "name", "courseName")
+    if not class_code or not course_name:
+        raise CecApiError(f"Class detail for Class ID {class_id} is missing class code or course name")
+    return str(class_code).strip(), str(course_name).strip()
+
+# Lesson table rows in display order: number, report link and homework reference
+def get_lessons(session, class_id):
+    payload = api_get(session, LESSONS_ENDPOINT, {"classID": class_id})
+    lessons = parse_lessons_payload(payload)
+    if lessons is None:
+        raise CecApiError(f"Unexpected lesson list payload for Class ID {class_id}")
+    return lessons
+
+# Normalise a lesson list JSON body; None if it is not a list, CecApiError if its items are not the lessons we expect
+def parse_lessons_payload(payload):
+    payload = unwrap(payload)
+    if isinstance(payload, dict):
+        payload = pick(payload, "lessons", "items", "rows")
+    if not isinstance(payload, list):
+        return None
+    lessons = []
+    for index, item in enumerate(payload):
+        if not isinstance(item, dict):
+            raise CecApiError(f"Unexpected lesson item at position {index}: {type(item).__name__}")
+        lesson_id = require(item, "lessonID", "lessonId", "id", what="lesson id")
+        lesson_number = require(item, "lessonNumber", "sessionNumber", "lesson", "no", what="lesson number")
+        if lesson_id in (None, "") or lesson_number in (None, ""):
+            raise CecApiError(f"Lesson at position {index} has an empty lesson id or number")
+        require(item, "homework", "homeWork", "hasHomework", "homeworkID", "homeworkId", what="homework")
+        lessons.append({
+            "index": index,
+            "lesson_id": lesson_id,
+            "lesson_number": str(lesson_number).strip(),
+            "date": pick(item, "date", "lessonDate", "startDate"),
+            "report_link": require(item, "reportLink", "reportUrl", "report_url", "linkReport", what="report link"),
+            "homework": pick(item, "homework", "homeWork"),
+            "has_homework": bool(pick(item, "homework", "homeWork", "hasHomework", "homeworkID", "homeworkId"))
+        })
+    return lessons
+
+# Homework dialog contents: header, text actions and (label, href) link actions
+def get_homework(session, class_id, lesson):
+    payload = lesson.get("homework")
+    if not isinstance(payload, (dict, list)):
+        if lesson.get("lesson_id") in (None, ""):
+            raise CecApiError(f"Cannot request homework for lesson {lesson.get('lesson_number')} without a lesson id")
+        payload = api_get(session, HOMEWORK_ENDPOINT, {"classID": class_id, "lessonID": lesson["lesson_id"]})
+    return parse_homework_payload(payload)
+
+# Normalise a homework JSON body into the fields the popup shows
+def parse_homework_payload(payload):
+    if isinstance(payload, list):
+        header, actions = "", payload
+    elif isinstance(payload, dict):
+        header = require(payload, "title", "name", "header", what="homework header")
+        actions = require(payload, "actions", "items", "contents", what="homework actions")
+    else:
+        raise CecApiError(f"Unexpected homework payload: {type(payload).__name__}")
+    if not isinstance(actions, list):
+        raise CecApiError(f"Unexpected homework actions: {type(actions).__name__}")
+    text_actions = []
+    link_actions = []
+    for action in actions:
+        if not isinstance(action, dict):
+            raise CecApiError(f"Unexpected homework action: {type(action).__name__}")
+        label = str(pick(action, "title", "name", "text", "content", default="")).strip()
+        href = pick(action, "link", "url", "href")
+        if href:
+            link_actions.append((label, href))
+        elif label:
+            text_actions.append(label)
+        else:
+            raise CecApiError(f"Homework action has neither a label nor a link (got {sorted(action)})")
+    return str(header or "").strip(), text_actions, link_actions
+
+# Same text the Selenium scraper builds from the homework popup
+def format_homework_content(header, text_actions, link_actions):
+    homework_links = [f"{label}: {href}" for label, href in link_actions]
+    return f"Homework Header: {header}\n" + ("Text:\n" + "\n".join(text_actions) + "\n" if text_actions else "") + ("Links:\n" + "\n".join(homework_links) if homework_links else "")
@@ -0,0 +1,153 @@
+import time
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+
+REPORT_ICON = "isax-card-edit"
+HOMEWORK_ICON = "isax-book-square"
+
+# One round-trip: every lesson row with its number, date and which icons it has
+LESSON_TABLE_SCRIPT = """
+const rows = Array.from(document.querySelectorAll('tbody > tr'));
+const datePattern = /\\d{1,4}[\\/\\-.]\\d{1,2}[\\/\\-.]\\d{1,4}/;
+return rows.map((row, index) => {
+    const cells = Array.from(row.querySelectorAll(':scope > td')).map(td => td.innerText.trim());
+    const dateCell = cells.find(text => datePattern.test(text));
+    return {
+        index: index,
+        lesson_number: cells.length >= 4 ? cells[3] : '',
+        date: dateCell ? dateCell.match(datePattern)[0] : '',
+        cells: cells,
+        has_report: !!row.querySelector('i[data-v-50ef298c].isax-card-edit'),
+        has_homework: !!row.querySelector('i[data-v-50ef298c].isax-book-square')
+    };
+});
+"""
+
+# Find the row by its lesson number (falling back to its index) and click one of its icons
+CLICK_ROW_ICON_SCRIPT = """
+const [lessonNumber, index, iconClass] = arguments;
+const rows = Array.from(document.querySelectorAll('tbody > tr'));
+let row = rows.find(r => {
+    const cell = r.querySelectorAll(':scope > td')[3];
+    return cell && cell.innerText.trim() === lessonNumber;
+});
+if (!row) row = rows[index];
+if (!row) return false;
+const icon = row.querySelector('i[data-v-50ef298c].' + iconClass);
+if (!icon) return false;
+icon.scrollIntoView(true);
+icon.click();
+return true;
+"""
+
+EVENT_LIST_SCRIPT = """
+return Array.from(document.querySelectorAll('div.v-event[data-date]')).map((el, index) => ({
+    index: index,
+    date: el.getAttribute('data-date'),
+    text: el.innerText.trim()
+}));
+"""
+
+# Click an event by index, or by its date if the calendar re-rendered in a different order
+CLICK_EVENT_SCRIPT = """
+const [index, date] = arguments;
+const events = Array.from(document.querySelectorAll('div.v-event[data-date]'));
+let el = events[index];
+if (!el || el.getAttribute('data-date') !== date) el = events.find(e => e.getAttribute('data-date') === date);
+if (!el) return false;
+el.click();
+return true;
+"""
+
+# Wait for the lesson table to render, then snapshot it in a single execute_script call
+def snapshot_lesson_table(driver, timeout=20):
+    WebDriverWait(driver, timeout).until(EC.presence_of_all_elements_located((By.XPATH, "//tbody/tr")))
+    return driver.execute_script(LESSON_TABLE_SCRIPT) or []
+
+# Click the report/homework icon of a snapshotted row; False if the row or icon is gone
+def click_row_icon(driver, row, icon_class):
+    return bool(driver.execute_script(CLICK_ROW_ICON_SCRIPT, row['lesson_number'], row['index'], icon_class))
+
+# Calendar events with their data-date, read in one round-trip
+def snapshot_events(driver, timeout=30):
+    WebDriverWait(driver, timeout).until(EC.presence_of_all_elements_located((By.XPATH, "//div[contains(@class, 'v-event') and @data-date]")))
+    return driver.execute_script(EVENT_LIST_SCRIPT) or []
+
+def click_event(driver, event):
+    return bool(driver.execute_script(CLICK_EVENT_SCRIPT, event['index'], event['date']))
+
+# Record the URL a click would open in a new tab instead of opening it
+WINDOW_OPEN_SHIM = """
+(function () {
+    if (window.__cecOpenShim) return;
+    window.__cecOpenShim = true;
+    window.__cecOpened = [];
+    const record = (url) => {
+        if (url) window.__cecOpened.push(new URL(String(url), window.location.href).href);
+    };
+    window.open = function (url) {
+        record(url);
+        const target = { assign: record, replace: record };
+        Object.defineProperty(target, 'href', { set: record, get: () => '' });
+        const fake = { closed: false, opener: window, focus() {}, blur() {}, close() { this.closed = true; }, document: { write() {}, close() {} } };
+        Object.defineProperty(fake, 'location', { get: () => target, set: record });
+        return fake;
+    };
+    document.addEventListener('click', (event) => {
+        const anchor = event.target.closest && event.target.closest('a[target="_blank"]');
+        if (anchor && anchor.href) {
+            event.preventDefault();
+            record(anchor.href);
+        }
+    }, true);
+})();
+"""
+
+# Install the shim on the current page and on every page loaded afterwards
+def install_window_open_shim(driver):
+    try:
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": WINDOW_OPEN_SHIM})
+    except Exception:
+        pass
+    driver.execute_script(WINDOW_OPEN_SHIM)
+
+# URL a click would open, without creating a tab; falls back to switching windows if the page bypassed the shim
+def capture_opened_url(driver, click, timeout=10):
+    driver.execute_script(WINDOW_OPEN_SHIM + "window.__cecOpened = [];")
+    original_window = driver.current_window_handle
+    handles_before = set(driver.window_handles)
+    if click() is False:
+        return None
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        opened = driver.execute_script("return window.__cecOpened || [];")
+        if opened:
+            return opened[-1]
+        new_windows = [h for h in driver.window_handles if h not in handles_before]
+        if new_windows:
+            driver.switch_to.window(new_windows[0])
+            try:
+                WebDriverWait(driver, timeout).until(lambda d: d.current_url not in ("", "about:blank"))
+                return driver.current_url
+            finally:
+                driver.close()
+                driver.switch_to.window(original_window)
+        time.sleep(0.2)
+    return None
+
+# Follow a portal redirect link in a new tab of the logged-in driver, so the portal sees its session cookies;
+# returns where it lands once the URL contains expected, or None if it gets nowhere (e.g. the login page)
+def resolve_redirect(driver, url, expected, timeout=30):
+    original_window = driver.current_window_handle
+    driver.switch_to.new_window('tab')
+    try:
+        driver.get(url)
+        WebDriverWait(driver, timeout).until(lambda d: expected in d.current_url)
+        return driver.current_url
+    except TimeoutException:
+        return None
+    finally:
+        driver.close()
+        driver.switch_to.window(original_window)
@@ -0,0 +1,80 @@
+import json
+from urllib.parse import urlparse, parse_qs
+import cec_api
+
+# Turn on Chrome performance logging so the XHR traffic of the Vue app can be read back
+def enable_network_capture(options):
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    return options
+
+# Discard whatever the performance log has buffered so far (get_log drains it)
+def reset_capture(driver):
+    try:
+        driver.get_log("performance")
+    except Exception:
+        pass
+
+# JSON bodies of the API responses received since the last drain, as (url, payload) pairs
+def drain_json_responses(driver, url_fragment="/api/"):
+    try:
+        entries = driver.get_log("performance")
+    except Exception:
+        return []
+    responses = []
+    for entry in entries:
+        try:
+            message = json.loads(entry["message"])["message"]
+        except (KeyError, ValueError):
+            continue
+        if message.get("method") != "Network.responseReceived":
+            continue
+        params = message.get("params", {})
+        response = params.get("response", {})
+        url = response.get("url", "")
+        if url_fragment not in url or "json" not in response.get("mimeType", ""):
+            continue
+        try:
+            body = driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": params["requestId"]})
+            responses.append((url, json.loads(body.get("body", ""))))
+        except Exception:
+            continue
+    return responses
+
+# API lessons keyed by the lesson number the DOM table shows (td[4]): by position when the counts agree, else by number
+def match_lesson_rows(lessons, lesson_rows):
+    if len(lessons) == len(lesson_rows):
+        return {row["lesson_number"]: lesson for row, lesson in zip(lesson_rows, lessons)}
+    by_number = {lesson["lesson_number"]: lesson for lesson in lessons}
+    return {row["lesson_number"]: by_number[row["lesson_number"]] for row in lesson_rows if row["lesson_number"] in by_number}
+
+# Homework found in the captured traffic, keyed by DOM lesson number, plus the matched API lessons: (homework, lessons)
+def homework_from_responses(responses, lesson_rows):
+    lessons = []
+    homework_by_lesson_id = {}
+    for url, payload in responses:
+        path = urlparse(url).path
+        if path.endswith(cec_api.HOMEWORK_ENDPOINT):
+            lesson_id = parse_qs(urlparse(url).query).get("lessonID", [None])[0]
+            if lesson_id is not None:
+                homework_by_lesson_id[str(lesson_id)] = cec_api.unwrap(payload)
+            continue
+        try:
+            parsed = cec_api.parse_lessons_payload(payload)
+        except cec_api.CecApiError:
+            continue  # Some other list endpoint of the app
+        if parsed and any(lesson["lesson_id"] is not None for lesson in parsed):
+            lessons = parsed
+    matched = match_lesson_rows(lessons, lesson_rows)
+    homework = {}
+    for lesson_number, lesson in matched.items():
+        payload = lesson["homework"] if isinstance(lesson["homework"], (dict, list)) else homework_by_lesson_id.get(str(lesson["lesson_id"]))
+        if payload is None:
+            continue
+        try:
+            homework[lesson_number] = cec_api.parse_homework_payload(payload)
+        except cec_api.CecApiError:
+            continue
+    return homework, matched
+
+def capture_homework(driver, lesson_rows):
+    return homework_from_responses(drain_json_responses(driver), lesson_rows)
@@ -0,0 +1,131 @@
+import codecs
+import os
+import re
+from html.parser import HTMLParser
+from urllib.parse import urlparse, parse_qs
+from pdf_extract import section_context
+from pdf_fetch import download_export, CHUNK_SIZE
+
+# Export format used for docs.google.com reports: html (text, headings, tables and anchors), txt (text and
+# bare URLs) or pdf to keep going through pdfplumber. Viewer links to plain PDFs always use the PDF path.
+DOC_EXPORT_FORMAT = os.getenv("DOC_EXPORT_FORMAT", "html")
+DOC_URL_PATTERN = re.compile(r"https://docs\.google\.com/document/d/([a-zA-Z0-9_-]+)")
+URL_PATTERN = re.compile(r"https?://[^\s<>\"']+")
+CONTENT_TYPES = {'html': 'text/html', 'txt': 'text/plain'}
+BLOCK_TAGS = {'p', 'div', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'title', 'table'}
+CELL_TAGS = {'td', 'th'}
+SKIPPED_TAGS = {'style', 'script', 'head'}
+
+# Export URL for a Google Docs report in the configured format, or None when the PDF path should be used
+def doc_export_url(url, export_format=DOC_EXPORT_FORMAT):
+    match = DOC_URL_PATTERN.match(url or '')
+    if not match or export_format not in CONTENT_TYPES:
+        return None
+    return f"https://docs.google.com/document/d/{match.group(1)}/export?format={export_format}"
+
+def link_type(url):
+    return "youtube" if "youtube.com" in url else "quizlet" if "quizlet.com" in url else "other"
+
+# Docs wraps every hyperlink in https://www.google.com/url?q=<target>&sa=...
+def unwrap_link(href):
+    parsed = urlparse(href)
+    if parsed.netloc.endswith("google.com") and parsed.path == "/url":
+        return parse_qs(parsed.query).get('q', [href])[0]
+    return href
+
+# Context for a link: the section its anchor text names, else the section of the closest heading above it,
+# else the anchor text itself
+def link_context(anchor_text, section, default="Doc link"):
+    return section_context(anchor_text) or section or anchor_text or default
+
+# Incremental parser for the Docs HTML export: feed() it chunks as they arrive. Blocks (paragraphs, headings,
+# list items, table rows) become lines, table cells are tab-separated, and <a href> anchors become links
+# shaped like extract_lessons.extract_text_and_links output.
+class DocHTMLParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self.links = []
+        self._line = []
+        self._skip = 0
+        self._anchor = None  # [url, text parts] while inside <a href>
+        self._line_anchors = []  # (url, text) of anchors closed on the current line
+        self._section = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skip += 1
+        elif tag in BLOCK_TAGS or tag == 'br':
+            self._end_line()
+        elif tag in CELL_TAGS and self._line:
+            self._line.append('\t')
+        elif tag == 'a':
+            href = dict(attrs).get('href')
+            if href and not href.startswith('#'):
+                self._anchor = [unwrap_link(href), []]
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in BLOCK_TAGS:
+            self._end_line()
+        elif tag == 'a' and self._anchor:
+            url, parts = self._anchor
+            self._anchor = None
+            self._line_anchors.append((url, ' '.join(''.join(parts).split())))
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        self._line.append(data)
+        if self._anchor:
+            self._anchor[1].append(data)
+
+    # Finish the current line; a line naming a section becomes the heading for its own links and those after it
+    def _end_line(self):
+        cells = (' '.join(cell.split()) for cell in ''.join(self._line).split('\t'))
+        line = '\t'.join(cell for cell in cells if cell)
+        self._line = []
+        if line:
+            self.lines.append(line)
+            self._section = section_context(line) or self._section
+        for url, anchor_text in self._line_anchors:
+            self.links.append({"context": link_context(anchor_text, self._section), "url": url, "type": link_type(url)})
+        self._line_anchors = []
+
+    def close(self):
+        super().close()
+        self._end_line()
+
+    @property
+    def text(self):
+        return ''.join(line + '\n' for line in self.lines)
+
+# Plain-text export: no anchors, so links are the bare URLs in the text with their section as context
+def parse_txt(text):
+    links = []
+    section = None
+    for line in text.splitlines():
+        section = section_context(line) or section
+        for url in URL_PATTERN.findall(line):
+            links.append({"context": link_context('', section), "url": url, "type": link_type(url)})
+    return text, links
+
+# Parse a downloaded export (file object) into (text, links); HTML is fed to the parser chunk by chunk
+def parse_export(export_file, export_format=DOC_EXPORT_FORMAT):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    if export_format == 'txt':
+        return parse_txt(decoder.decode(export_file.read(), final=True).lstrip('\ufeff'))
+    parser = DocHTMLParser()
+    while True:
+        chunk = export_file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        parser.feed(decoder.decode(chunk))
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    return parser.text, parser.links
+
+# Download the export of a Docs report; raises requests.RequestException or pdf_fetch.UnexpectedContentError
+def download_doc_export(url, export_format=DOC_EXPORT_FORMAT):
+    return download_export(doc_export_url(url, export_format), CONTENT_TYPES[export_format])
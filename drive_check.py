@@ -0,0 +1,61 @@
+import threading
+from urllib.parse import urlparse
+import httplib2
+from googleapiclient.discovery import build
+from oauth2client.service_account import ServiceAccountCredentials
+
+DRIVE_SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
+METADATA_FIELDS = "id,mimeType,trashed"
+BATCH_SIZE = 100  # Drive accepts at most 100 calls per batch request
+DOC_MIME_TYPE = "application/vnd.google-apps.document"
+
+_local = threading.local()  # httplib2.Http is not thread-safe, so every thread builds its own service
+
+def doc_id_from_url(url):
+    try:
+        return urlparse(url).path.split('/d/')[1].split('/')[0]
+    except IndexError:
+        return None
+
+# Drive client for the calling thread, built on its first lookup and reused by that thread afterwards
+def drive_service(credentials_file):
+    services = _local.__dict__.setdefault('services', {})
+    if credentials_file not in services:
+        creds = ServiceAccountCredentials.from_json_keyfile_name(credentials_file, DRIVE_SCOPES)
+        services[credentials_file] = build("drive", "v3", http=creds.authorize(httplib2.Http(timeout=10)), cache_discovery=False)
+    return services[credentials_file]
+
+# Look up Google Doc URLs with files.get in batches; returns {url: (is_accessible, export_url_or_error)}
+# Only definitive answers are returned; URLs the service account cannot see (403/404) or whose lookup failed
+# for any other reason (rate limits, server errors) are left out so the caller can HEAD them
+def check_docs(urls, credentials_file):
+    by_id = {}
+    for url in urls:
+        doc_id = doc_id_from_url(url)
+        if doc_id:
+            by_id.setdefault(doc_id, []).append(url)
+    if not by_id:
+        return {}
+    service = drive_service(credentials_file)
+    results = {}
+
+    def handle(request_id, response, exception):
+        if exception is not None:
+            # 403/404 (not shared with the service account), 429 and 5xx alike say nothing about the link itself
+            return
+        if response.get("trashed"):
+            outcome = (False, "Document is in the trash")
+        elif response.get("mimeType") != DOC_MIME_TYPE:
+            outcome = (False, f"Not a Google Doc ({response.get('mimeType')})")
+        else:
+            outcome = (True, f"https://docs.google.com/document/d/{request_id}/export?format=pdf")
+        for url in by_id[request_id]:
+            results[url] = outcome
+
+    doc_ids = list(by_id)
+    for start in range(0, len(doc_ids), BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=handle)
+        for doc_id in doc_ids[start:start + BATCH_SIZE]:
+            batch.add(service.files().get(fileId=doc_id, fields=METADATA_FIELDS, supportsAllDrives=True), request_id=doc_id)
+        batch.execute()
+    return results
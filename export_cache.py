@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse, parse_qs, unquote
+
+EXPORT_CACHE_DIR = os.getenv("EXPORT_CACHE_DIR", ".export_cache")  # Empty disables the cache
+EXPORT_CACHE_MAX_BYTES = int(os.getenv("EXPORT_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+EXPORT_CACHE_OFFLINE = os.getenv("EXPORT_CACHE_OFFLINE", "0") == "1"  # Serve cached exports without asking the server
+DOC_ID_PATTERN = re.compile(r"/document/d/([a-zA-Z0-9_-]+)")
+
+# Export format requested by a URL (its ?format= parameter), PDF when it names none
+def export_format(url):
+    return parse_qs(urlparse(url).query).get('format', ['pdf'])[0]
+
+# Google Doc ID for export, edit and viewer (?url=...) links, plus the export format unless it is PDF;
+# other URLs are their own key
+def cache_key(url):
+    query = parse_qs(urlparse(url).query)
+    match = DOC_ID_PATTERN.search(url)
+    if not match:
+        inner = query.get('url', [None])[0]
+        match = DOC_ID_PATTERN.search(unquote(inner)) if inner else None
+    if not match:
+        return url
+    fmt = export_format(url)
+    return f"doc:{match.group(1)}" if fmt == 'pdf' else f"doc:{match.group(1)}:{fmt}"
+
+# Content-addressed store of downloaded exports: blobs/<sha256>.<format> plus an index of
+# doc key -> validators (ETag/Last-Modified), hash, size and last use, evicted least-recently-used by total size
+class ExportCache:
+    def __init__(self, directory=EXPORT_CACHE_DIR, max_bytes=EXPORT_CACHE_MAX_BYTES, offline=EXPORT_CACHE_OFFLINE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.index_path = os.path.join(directory, "index.json")
+        self.stats = {'hits': 0, 'revalidated': 0, 'stale': 0, 'misses': 0, 'evicted': 0}
+        self._lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    # Entries written before the format was recorded are all PDFs
+    def _blob_path(self, digest, fmt='pdf'):
+        return os.path.join(self.blob_dir, f"{digest}.{fmt}")
+
+    def _entry_path(self, entry):
+        return self._blob_path(entry['sha256'], entry.get('format', 'pdf'))
+
+    # If-None-Match / If-Modified-Since for a cached export, empty if there is nothing to revalidate
+    def conditional_headers(self, url):
+        with self._lock:
+            entry = self.index.get(cache_key(url))
+        if not entry or not os.path.exists(self._entry_path(entry)):
+            return {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    # Open the cached export for reading; outcome is 'hits' (offline), 'revalidated' (304) or 'stale' (network failed)
+    def open_cached(self, url, outcome='hits'):
+        key = cache_key(url)
+        with self._lock:
+            entry = self.index.get(key)
+            if not entry:
+                return None
+            try:
+                pdf = open(self._entry_path(entry), 'rb')
+            except OSError:
+                del self.index[key]
+                return None
+            entry['last_used'] = time.time()
+            self.stats[outcome] += 1
+            self._save_index()
+        return pdf
+
+    # Write a fresh download into the store and return it opened for reading
+    def store(self, url, headers, chunks):
+        key = cache_key(url)
+        fmt = export_format(url)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+            size = os.path.getsize(tmp_path)
+            blob_path = self._blob_path(digest.hexdigest(), fmt)
+            os.replace(tmp_path, blob_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            self.index[key] = {
+                'url': url,
+                'sha256': digest.hexdigest(),
+                'format': fmt,
+                'size': size,
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'fetched_at': time.time(),
+                'last_used': time.time()
+            }
+            self.stats['misses'] += 1
+            self._evict(keep=key)
+            self._save_index()
+            return open(blob_path, 'rb')
+
+    # Drop least-recently-used entries until the blobs fit in max_bytes; blobs shared by several docs count once.
+    # The entry just stored (keep) is never dropped, even when it alone is larger than max_bytes.
+    def _evict(self, keep=None):
+        sizes = {entry['sha256']: entry['size'] for entry in self.index.values()}
+        total = sum(sizes.values())
+        for key, entry in sorted(self.index.items(), key=lambda item: item[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            del self.index[key]
+            self.stats['evicted'] += 1
+            if any(other['sha256'] == entry['sha256'] for other in self.index.values()):
+                continue
+            total -= entry['size']
+            try:
+                os.remove(self._entry_path(entry))
+            except OSError:
+                pass
+
+    def summary(self):
+        stats = self.stats
+        served = stats['hits'] + stats['revalidated'] + stats['stale']
+        total = served + stats['misses']
+        rate = served / total if total else 0.0
+        return (f"Export cache: {served} served from cache ({stats['hits']} offline, {stats['revalidated']} not modified, "
+                f"{stats['stale']} stale), {stats['misses']} downloaded, {stats['evicted']} evicted ({rate:.0%} hit rate)")
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# Process-wide cache, or None when EXPORT_CACHE_DIR is empty
+def get_cache():
+    global _cache
+    if not EXPORT_CACHE_DIR:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ExportCache()
+        return _cache
+
+def summary():
+    cache = get_cache()
+    return cache.summary() if cache is not None else "Export cache disabled"
@@ -1,14 +1,19 @@
 import json
 import os
 import requests
-import pdfplumber
 import google.generativeai as genai
 import re
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import logging
-import time
-import random
+from pdf_fetch import download_pdf, pdf_size, NotPdfError, UnexpectedContentError
+from doc_export import DOC_EXPORT_FORMAT, doc_export_url, download_doc_export, parse_export
+import export_cache
+import llm_cache
+from gemini_models import get_catalog
+from gemini_quota import is_quota_error, QUOTA_RETRIES
+from pdf_extract import extract_pages, WordIndex, MAX_PAGES
+from pipeline import run_report_pipeline
 
 # Configuration
 LOG_FILE = "class_info_log3.txt"
@@ -16,21 +21,24 @@ HOMEWORK_FILE = "homework2.json"
 LINK_FILE = "link.txt"
 API_KEY = os.getenv("GEMINI_API_KEY")
 TODAY = datetime.now(tz=ZoneInfo("Asia/Ho_Chi_Minh")).strftime("%Y-%m-%d")
-MAX_PAGES = 10  # Limit PDF processing to 10 pages
-
-# Logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] %(levelname)s: %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+
 logger = logging.getLogger(__name__)
 
-# Suppress verbose pdfplumber logs
-logging.getLogger('pdfplumber').setLevel(logging.ERROR)
+# Model preference, best first; the catalog reorders it by each model's recent health
+MODEL_PRIORITY = ['gemini-2.5-flash', 'gemini-2.0-flash-lite', 'gemini-2.5-pro', 'gemini-pro']
+
+# Logging setup; run from __main__ only, because the PDF worker processes import this module for extract_page
+def setup_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='[%(asctime)s] %(levelname)s: %(message)s',
+        handlers=[
+            logging.FileHandler(LOG_FILE, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+    # Suppress verbose pdfplumber logs
+    logging.getLogger('pdfplumber').setLevel(logging.ERROR)
 
 # Updated system prompt for Gemini API
 SYSTEM_PROMPT = """
@@ -54,65 +62,33 @@ Extract structured data from the provided text (from a Google Docs lesson plan).
 For hyperlinks embedded in the text (e.g., in phonics, new_vocabulary, or homework sections), assign them to the appropriate field (e.g., phonics.link, new_vocabulary.link) based on their section context. For example, a Quizlet URL in the "Phonics" section should go to phonics.link, and URLs in "Homework" should be included in the homework array. Include all hyperlinks in links_all with specific context (e.g., "Phonics link", "Homework link") rather than generic "PDF link". If a section's text contains a hyperlink, include both the text and URL in the relevant field. Ensure all text, including Vietnamese translations, is preserved accurately. Return only the JSON output, no additional text.
 """
 
-# Clean and validate JSON response
+# Clean and validate JSON response; raises ValueError so the caller retries instead of keeping a placeholder
 def clean_json_response(response_data):
     logger.info("Processing API response")
     if isinstance(response_data, dict):
         logger.info("Response is already a dictionary")
         return response_data
-    if isinstance(response_data, str):
-        text = response_data.strip()
-        if text.startswith('```json') and text.endswith('```'):
-            text = text[7:-3].strip()
-        elif text.startswith('```') and text.endswith('```'):
-            text = text[3:-3].strip()
-        try:
-            parsed_json = json.loads(text)
-            logger.info("Parsed JSON string response")
-            return parsed_json
-        except json.JSONDecodeError as e:
-            logger.error(f"Invalid JSON string response: {str(e)}")
-    else:
-        logger.error(f"Unexpected response type: {type(response_data)}")
-    return {
-        "class_name": "cannot find info",
-        "lesson_unit": "cannot find info",
-        "lesson_date": TODAY,
-        "learning_objectives": {
-            "vocabulary_review": {"theme": "", "words": [], "count": 0},
-            "vocabulary_new": {"theme": "", "words": [], "count": 0},
-            "pronunciation": {"sound": "", "words": [], "count": 0},
-            "phonics": ""
-        },
-        "warm_up": {"description": "", "videos": []},
-        "homework_check": "cannot find info",
-        "running_content": {"theme": "", "review_vocabulary": {"link": "", "words": [], "structure": "", "examples": [], "activities": ""}},
-        "new_vocabulary": {"theme": "", "words": [], "link": "", "activities": ""},
-        "phonics": {"letter": "", "words": [], "link": "", "activities": "", "videos": []},
-        "homework": [],
-        "links_all": []
-    }
-
-# Get available Gemini model
-def get_gemini_model(attempt=0):
+    if not isinstance(response_data, str):
+        raise ValueError(f"Unexpected response type: {type(response_data)}")
+    text = response_data.strip()
+    if text.startswith('```json') and text.endswith('```'):
+        text = text[7:-3].strip()
+    elif text.startswith('```') and text.endswith('```'):
+        text = text[3:-3].strip()
     try:
-        models = genai.list_models()
-        available_models = [model.name for model in models if 'generateContent' in model.supported_generation_methods]
-        model_priority = [
-            'gemini-2.5-flash',
-            'gemini-2.0-flash-lite',
-            'gemini-2.5-pro',
-            'gemini-pro'
-        ]
-        for priority in model_priority[attempt:]:
-            for model in available_models:
-                if priority in model:
-                    logger.info(f"Selected model: {model}")
-                    return model
-        return available_models[0] if available_models else None
-    except Exception as e:
-        logger.error(f"Failed to list models: {str(e)}")
-        return None
+        parsed_json = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON string response: {str(e)}")
+    logger.info("Parsed JSON string response")
+    return parsed_json
+
+# Available Gemini model not yet tried for this document that has quota budget soonest, healthiest first
+# (catalog fetched once per TTL)
+def get_gemini_model(tried=(), content=None):
+    model_name = get_catalog(log=logger.info).choose(MODEL_PRIORITY, tried, content)
+    if model_name:
+        logger.info(f"Selected model: {model_name}")
+    return model_name
 
 # Clean Google Docs URL and convert to PDF export URL
 def clean_google_docs_url(url):
@@ -136,149 +112,198 @@ def deduplicate_links(links):
             unique_links.append(link)
     return unique_links
 
-# Extract text and links with context from PDF
+# Text, links with context and link error (if any) for one page; runs in the PDF worker processes.
+# Text is taken first so a failure while matching links does not lose it.
+def extract_page(page):
+    text = page.extract_text() or ''
+    page_links = []
+    try:
+        # Extract words with hyperlinks; words are indexed once per page and shared by all its links
+        link_annots = [annot for annot in (page.annots or []) if 'uri' in annot]
+        words = WordIndex.from_page(page) if link_annots else None
+        for annot in link_annots:
+            page_links.append({
+                "context": words.link_context(annot),
+                "url": annot['uri'],
+                "type": "youtube" if "youtube.com" in annot['uri'] else
+                        "quizlet" if "quizlet.com" in annot['uri'] else "other"
+            })
+    except Exception as e:
+        return text, page_links, str(e)
+    return text, page_links, None
+
+# Extract text and links with context from PDF (a path or a file object), pages spread over worker processes
 def extract_text_and_links(pdf_path):
     logger.info("Extracting text and links from PDF")
-    pdf_text = ''
-    pdf_links = []
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for i, page in enumerate(pdf.pages[:MAX_PAGES]):
-                try:
-                    # Extract text
-                    text = page.extract_text()
-                    if text:
-                        pdf_text += text + '\n'
-                    # Extract words with hyperlinks
-                    if page.annots:
-                        for annot in page.annots:
-                            if 'uri' in annot:
-                                # Get the text block near the annotation
-                                x0, y0, x1, y1 = annot['x0'], annot['y0'], annot['x1'], annot['y1']
-                                nearby_words = page.extract_words(x_tolerance=5, y_tolerance=5)
-                                context = "PDF link"  # Default context
-                                for word in nearby_words:
-                                    if (abs(word['x0'] - x0) < 10 and abs(word['y0'] - y0) < 10) or \
-                                       (abs(word['x1'] - x1) < 10 and abs(word['y1'] - y1) < 10):
-                                        context = word['text']
-                                        break
-                                # Assign section-based context
-                                if 'phonics' in context.lower() or 'letter' in context.lower():
-                                    context = "Phonics link"
-                                elif 'homework' in context.lower():
-                                    context = "Homework link"
-                                elif 'vocabulary' in context.lower():
-                                    context = "Vocabulary link"
-                                pdf_links.append({
-                                    "context": context,
-                                    "url": annot['uri'],
-                                    "type": "youtube" if "youtube.com" in annot['uri'] else
-                                            "quizlet" if "quizlet.com" in annot['uri'] else "other"
-                                })
-                except Exception as e:
-                    logger.error(f"Failed to process page {i + 1}: {str(e)}")
-                    continue
-        logger.info(f"Extracted {len(pdf_text)} characters and {len(pdf_links)} links from PDF")
-        return pdf_text, pdf_links
+        pages, errors, total_pages = extract_pages(pdf_path, extract_page, max_pages=MAX_PAGES)
     except Exception as e:
         logger.error(f"Failed to process PDF: {str(e)}")
         return '', []
+    for number, error in errors:
+        logger.error(f"Failed to process page {number + 1}: {error}")
+    for number, page in enumerate(pages):
+        if page and page[2]:
+            logger.error(f"Failed to process page {number + 1}: {page[2]}")
+    if total_pages > len(pages):
+        logger.warning(f"PDF has {total_pages} pages, processed the first {len(pages)} (MAX_PAGES={MAX_PAGES})")
+    pdf_text = ''.join(text + '\n' for text, _, _ in filter(None, pages) if text)
+    pdf_links = [link for _, page_links, _ in filter(None, pages) for link in page_links]
+    logger.info(f"Extracted {len(pdf_text)} characters and {len(pdf_links)} links from PDF")
+    return pdf_text, pdf_links
 
-# Process a single report link
-def process_report_link(report_url):
+# Pipeline stage: download the HTML/text export of a report, or its PDF
+def fetch_report(job):
+    report_url = job['report_url']
     logger.info(f"Processing report: {report_url}")
-    
+
     # Clean and convert URL to PDF export
     direct_pdf_url = clean_google_docs_url(report_url)
     if not direct_pdf_url:
         logger.error("Failed to generate PDF URL, skipping")
         return None
 
-    # Download PDF from direct URL
-    pdf_path = 'temp_report.pdf'
-    logger.info(f"Downloading PDF to {pdf_path}")
+    # Google Docs reports: read the native export and skip PDF rendering; fall back to the PDF on failure
+    if doc_export_url(report_url):
+        try:
+            job['export'] = download_doc_export(report_url)
+            job['pdf_export_url'] = direct_pdf_url
+            logger.info(f"Downloaded {DOC_EXPORT_FORMAT} export ({pdf_size(job['export'])} bytes)")
+            return job
+        except (requests.RequestException, UnexpectedContentError) as e:
+            logger.warning(f"Failed to download {DOC_EXPORT_FORMAT} export, falling back to PDF: {str(e)}")
+
+    pdf = fetch_pdf(direct_pdf_url)
+    if pdf is None:
+        return None
+    job['pdf_export_url'] = direct_pdf_url
+    job['pdf'] = pdf
+    return job
+
+# Stream the PDF into memory (or a per-task temp file when large) over the shared session; None on failure
+def fetch_pdf(direct_pdf_url):
+    logger.info(f"Downloading PDF from {direct_pdf_url}")
     try:
-        response = requests.get(direct_pdf_url, timeout=10)
-        response.raise_for_status()
-        content_type = response.headers.get('content-type', '')
-        if 'application/pdf' not in content_type:
-            logger.error(f"Downloaded file is not a PDF (Content-Type: {content_type})")
-            return None
-        with open(pdf_path, 'wb') as f:
-            f.write(response.content)
-        logger.info(f"Downloaded PDF to {pdf_path}")
+        pdf = download_pdf(direct_pdf_url)
+    except NotPdfError as e:
+        logger.error(str(e))
+        return None
     except requests.RequestException as e:
         logger.error(f"Failed to download PDF: {str(e)}")
         return None
+    logger.info(f"Downloaded PDF ({pdf_size(pdf)} bytes)")
+    return pdf
 
-    # Extract text and links from PDF
-    pdf_text, pdf_links = extract_text_and_links(pdf_path)
-    if os.path.exists(pdf_path):
+# Pipeline stage: extract text and links from the downloaded export or PDF; an export that cannot be
+# parsed or has no text falls back to the PDF, as a failed export download does
+def parse_report(job):
+    pdf_text = ''
+    if 'export' in job:
+        export_file = job.pop('export')
         try:
-            os.remove(pdf_path)
-            logger.info(f"Deleted PDF file: {pdf_path}")
+            pdf_text, pdf_links = parse_export(export_file)
+            logger.info(f"Extracted {len(pdf_text)} characters and {len(pdf_links)} links from {DOC_EXPORT_FORMAT} export")
         except Exception as e:
-            logger.error(f"Failed to delete PDF file: {str(e)}")
+            logger.warning(f"Failed to parse {DOC_EXPORT_FORMAT} export, falling back to PDF: {str(e)}")
+        finally:
+            export_file.close()
+        if not pdf_text:
+            job['pdf'] = fetch_pdf(job['pdf_export_url'])
+            if job['pdf'] is None:
+                return None
+    if 'pdf' in job:
+        pdf = job.pop('pdf')
+        try:
+            pdf_text, pdf_links = extract_text_and_links(pdf)
+        finally:
+            pdf.close()
 
     if not pdf_text:
         logger.error("No text extracted from PDF")
         return None
+    job['pdf_text'] = pdf_text
+    job['pdf_links'] = pdf_links
+    return job
+
+# Pipeline stage: structure the extracted text with Gemini
+def extract_report_data(job):
+    report_url = job['report_url']
+    direct_pdf_url = job['pdf_export_url']
+    pdf_text = job.pop('pdf_text')
+    pdf_links = job.pop('pdf_links')
 
-    # Call Gemini API with retry on quota errors
+    # Pass both text and links to the model for better context
+    input_content = f"Text:\n{pdf_text}\n\nHyperlinks:\n{json.dumps(pdf_links, indent=2)}"
+
+    # Call Gemini API, rerouting to another model on quota errors; only other failures use up an attempt
     max_attempts = 3
     extracted_data = None
-    for attempt in range(max_attempts):
+    tried = []
+    attempt = 0
+    throttled = 0
+    # Checked before any model is chosen, so a re-run is free whichever model would be picked now
+    cached = llm_cache.lookup_any(MODEL_PRIORITY, SYSTEM_PROMPT, input_content)
+    while attempt < max_attempts:
         logger.info(f"Gemini API attempt {attempt + 1}/{max_attempts}")
-        model_name = get_gemini_model(attempt)
+        model_name = cached[0] if cached else get_gemini_model(tried, input_content)
         if not model_name:
             logger.error("No suitable model found")
+            attempt += 1
             continue
+        tried.append(model_name)
         try:
-            model = genai.GenerativeModel(model_name, system_instruction=SYSTEM_PROMPT)
-            # Pass both text and links to the model for better context
-            input_content = f"Text:\n{pdf_text}\n\nHyperlinks:\n{json.dumps(pdf_links, indent=2)}"
-            response = model.generate_content(input_content)
-            extracted_data = clean_json_response(response.text)
+            if cached:
+                extracted_data = cached[1]
+                cached = None
+                logger.info(f"Gemini response of {model_name} served from cache")
+            else:
+                extracted_data = get_catalog(log=logger.info).generate_json(model_name, SYSTEM_PROMPT, input_content, clean_json_response)
+                llm_cache.store(model_name, SYSTEM_PROMPT, input_content, extracted_data)
             extracted_data['links_all'] = deduplicate_links(extracted_data.get('links_all', []) + pdf_links)
             extracted_data['report_url'] = report_url
             extracted_data['pdf_export_url'] = direct_pdf_url
             logger.info(f"API attempt {attempt + 1} successful")
             break
         except Exception as e:
-            if '429' in str(e):
-                if attempt < max_attempts - 1:
-                    logger.warning(f"Quota exceeded for {model_name}, trying next model")
-                    continue
-                retry_delay = 60 + random.uniform(0, 5)
-                logger.warning(f"Quota exceeded, retrying in {retry_delay:.2f} seconds")
-                time.sleep(retry_delay)
-            else:
-                logger.error(f"API attempt {attempt + 1} failed: {str(e)}")
-            if attempt == max_attempts - 1:
-                logger.error("All API attempts failed, using default response")
-                extracted_data = {
-                    "class_name": "cannot find info",
-                    "lesson_unit": "cannot find info",
-                    "lesson_date": TODAY,
-                    "learning_objectives": {
-                        "vocabulary_review": {"theme": "", "words": [], "count": 0},
-                        "vocabulary_new": {"theme": "", "words": [], "count": 0},
-                        "pronunciation": {"sound": "", "words": [], "count": 0},
-                        "phonics": ""
-                    },
-                    "warm_up": {"description": "", "videos": []},
-                    "homework_check": "cannot find info",
-                    "running_content": {"theme": "", "review_vocabulary": {"link": "", "words": [], "structure": "", "examples": [], "activities": ""}},
-                    "new_vocabulary": {"theme": "", "words": [], "link": "", "activities": ""},
-                    "phonics": {"letter": "", "words": [], "link": "", "activities": "", "videos": []},
-                    "homework": [],
-                    "links_all": deduplicate_links(pdf_links),
-                    "report_url": report_url,
-                    "pdf_export_url": direct_pdf_url
-                }
+            if is_quota_error(e):
+                # No sleeping here: the scheduler holds the model until its retry-after has passed,
+                # so the next attempt goes to whichever model has budget and other documents keep flowing
+                tried.remove(model_name)
+                throttled += 1
+                if throttled >= QUOTA_RETRIES:
+                    # Left out of homework data, so the next run picks it up again instead of keeping a placeholder
+                    logger.warning(f"Out of Gemini quota after {throttled} tries, leaving {report_url} for the next run")
+                    return None
+                logger.warning(f"Quota exceeded for {model_name}, rerouting: {str(e)}")
+                continue
+            logger.error(f"API attempt {attempt + 1} failed: {str(e)}")
+            attempt += 1
+    else:
+        logger.error("All API attempts failed, using default response")
+        extracted_data = {
+            "class_name": "cannot find info",
+            "lesson_unit": "cannot find info",
+            "lesson_date": TODAY,
+            "learning_objectives": {
+                "vocabulary_review": {"theme": "", "words": [], "count": 0},
+                "vocabulary_new": {"theme": "", "words": [], "count": 0},
+                "pronunciation": {"sound": "", "words": [], "count": 0},
+                "phonics": ""
+            },
+            "warm_up": {"description": "", "videos": []},
+            "homework_check": "cannot find info",
+            "running_content": {"theme": "", "review_vocabulary": {"link": "", "words": [], "structure": "", "examples": [], "activities": ""}},
+            "new_vocabulary": {"theme": "", "words": [], "link": "", "activities": ""},
+            "phonics": {"letter": "", "words": [], "link": "", "activities": "", "videos": []},
+            "homework": [],
+            "links_all": deduplicate_links(pdf_links),
+            "report_url": report_url,
+            "pdf_export_url": direct_pdf_url
+        }
 
     logger.info(f"Completed processing for {report_url}")
-    return extracted_data
+    job['data'] = extracted_data
+    return job
 
 # Main function
 def main():
@@ -288,6 +313,7 @@ def main():
         return
 
     genai.configure(api_key=API_KEY)
+    llm_cache.register_prompt("extract_lessons", SYSTEM_PROMPT)
     logger.info("Configured Gemini API")
 
     # Read links from link.txt
@@ -308,19 +334,29 @@ def main():
         except Exception as e:
             logger.error(f"Error reading {HOMEWORK_FILE}: {str(e)}")
 
-    # Process each report URL
+    # Process new report URLs: downloads and parsing of later links overlap with Gemini calls for earlier ones
     processed_urls = {entry.get('report_url') for entry in homework_data}
+    jobs = []
     for report_url in report_urls:
         if report_url in processed_urls:
             logger.info(f"Skipping processed URL: {report_url}")
             continue
-        logger.info(f"Processing URL: {report_url}")
-        data = process_report_link(report_url)
-        if data:
-            homework_data.append(data)
-            logger.info(f"Processed report: {report_url}")
-        else:
-            logger.warning(f"Failed to process report: {report_url}, continuing")
+        jobs.append({'report_url': report_url})
+
+    def store_report(job):
+        homework_data.append(job['data'])
+        logger.info(f"Processed report: {job['report_url']}")
+        return job
+
+    done = run_report_pipeline(jobs, fetch_report, parse_report, extract_report_data, store_report, log=logger.info)
+    if len(done) < len(jobs):
+        logger.warning(f"Failed to process {len(jobs) - len(done)} of {len(jobs)} reports, continuing")
+
+    logger.info(export_cache.summary())
+    logger.info(llm_cache.summary())
+    models = get_catalog(log=logger.info)
+    logger.info(models.summary())
+    models.save()
 
     # Save to homework.json
     try:
@@ -333,6 +369,7 @@ def main():
         logger.error(f"Error saving {HOMEWORK_FILE}: {str(e)}")
 
 if __name__ == "__main__":
+    setup_logging()
     logger.info("Initializing script")
     main()
     logger.info("Script terminated")
@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+import google.generativeai as genai
+from gemini_quota import QuotaScheduler, estimate_tokens, is_quota_error, OUTPUT_TOKEN_ESTIMATE
+
+GEMINI_CATALOG_FILE = os.getenv("GEMINI_CATALOG_FILE", "gemini_models.json")  # Empty keeps the catalog in memory only
+CATALOG_TTL = int(os.getenv("GEMINI_CATALOG_TTL_HOURS", "24")) * 3600
+HEALTH_WINDOW = 20  # Recent calls per model that make up its health record
+HEALTH_MAX_AGE = 24 * 3600  # Outcomes older than this are dropped when the catalog is loaded
+THROTTLE_COOLDOWN = 60  # Seconds after a 429 during which the model is only used if nothing else is left
+# Score = position in the caller's priority list + these penalties; the lowest score is picked
+THROTTLE_WEIGHT = 4
+ERROR_WEIGHT = 2
+PARSE_FAILURE_WEIGHT = 2
+LATENCY_SCALE = 30  # Seconds of mean latency that cost one priority position
+COOLDOWN_PENALTY = 100
+
+# Models that support generateContent, fetched once and kept for CATALOG_TTL, with a rolling health
+# record per model (latency, 429s, other errors, JSON-parse failures) and one reusable client per model/prompt
+class ModelCatalog:
+    def __init__(self, path=GEMINI_CATALOG_FILE, ttl=CATALOG_TTL, log=print, scheduler=None):
+        self.path = path
+        self.ttl = ttl
+        self.log = log
+        self.scheduler = scheduler or QuotaScheduler(os.getenv("GEMINI_API_KEY"), log=log)
+        self.models = []
+        self.fetched_at = 0
+        self.health = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.models = saved.get('models', [])
+        self.fetched_at = saved.get('fetched_at', 0)
+        cutoff = time.time() - HEALTH_MAX_AGE
+        for model, outcomes in saved.get('health', {}).items():
+            self.health[model] = deque((o for o in outcomes if o['at'] >= cutoff), maxlen=HEALTH_WINDOW)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            saved = {'models': self.models, 'fetched_at': self.fetched_at,
+                     'health': {model: list(outcomes) for model, outcomes in self.health.items()}}
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(saved, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.log(f"Failed to save model catalog: {str(e)}")
+
+    # Model names that support generateContent; refreshed from the API once the TTL has passed,
+    # keeping the previous list if the refresh fails
+    def available(self):
+        with self._lock:
+            if self.models and time.time() - self.fetched_at < self.ttl:
+                return self.models
+            try:
+                self.models = [model.name for model in genai.list_models()
+                               if 'generateContent' in model.supported_generation_methods]
+                self.fetched_at = time.time()
+                self.log(f"Available models: {self.models}")
+            except Exception as e:
+                self.log(f"Failed to list models: {str(e)}")
+            return self.models
+
+    def record(self, model, latency, throttled=False, error=False, parsed=None):
+        with self._lock:
+            outcomes = self.health.setdefault(model, deque(maxlen=HEALTH_WINDOW))
+            outcomes.append({'at': time.time(), 'latency': round(latency, 2), 'throttled': throttled,
+                             'error': error, 'parsed': parsed})
+
+    # Rates over the model's recent calls; parse rate only counts calls that returned a response
+    def stats(self, model):
+        with self._lock:
+            outcomes = list(self.health.get(model, ()))
+        if not outcomes:
+            return None
+        answered = [o for o in outcomes if o['parsed'] is not None]
+        last_throttle = max((o['at'] for o in outcomes if o['throttled']), default=0)
+        return {
+            'calls': len(outcomes),
+            'answered': len(answered),
+            'throttle_rate': sum(o['throttled'] for o in outcomes) / len(outcomes),
+            'error_rate': sum(o['error'] for o in outcomes) / len(outcomes),
+            'parse_rate': sum(o['parsed'] for o in answered) / len(answered) if answered else 1.0,
+            'latency': sum(o['latency'] for o in answered) / len(answered) if answered else 0.0,
+            'cooling_down': time.time() - last_throttle < THROTTLE_COOLDOWN
+        }
+
+    def score(self, model, rank):
+        stats = self.stats(model)
+        if stats is None:
+            return rank
+        return (rank + THROTTLE_WEIGHT * stats['throttle_rate'] + ERROR_WEIGHT * stats['error_rate']
+                + PARSE_FAILURE_WEIGHT * (1 - stats['parse_rate']) + stats['latency'] / LATENCY_SCALE
+                + (COOLDOWN_PENALTY if stats['cooling_down'] else 0))
+
+    # Model among the caller's priorities (name substrings, best first) that can start this request soonest
+    # under its RPM/TPM budget, the healthiest one when several can start now; models already tried for the
+    # current document are skipped, and any available model is the fallback, as the old selection did
+    def choose(self, priority, tried=(), content=None):
+        available = [model for model in self.available() if model not in tried]
+        candidates = []
+        for pattern in priority:
+            match = next((model for model in available if pattern in model and model not in candidates), None)
+            if match:
+                candidates.append(match)
+        if not candidates:
+            return available[0] if available else None
+        tokens = estimate_tokens(content) if content is not None else OUTPUT_TOKEN_ESTIMATE
+        waits = {model: self.scheduler.wait_time(model, tokens) for model in candidates}
+        return min(candidates, key=lambda model: (waits[model] > 0, waits[model],
+                                                  self.score(model, candidates.index(model))))
+
+    # One GenerativeModel per model and system prompt, reused across documents and attempts
+    def client(self, model, system_instruction=None):
+        key = (model, system_instruction)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = genai.GenerativeModel(model, system_instruction=system_instruction)
+            return self._clients[key]
+
+    # Wait for the model's quota budget, call it and parse its answer, recording latency, 429s,
+    # other errors and parse failures. Raises gemini_quota.QuotaExceededError if the budget stays exhausted.
+    def generate_json(self, model, system_instruction, content, parse):
+        tokens = estimate_tokens(content)
+        self.scheduler.acquire(model, tokens)
+        started = time.monotonic()
+        try:
+            response = self.client(model, system_instruction).generate_content(content)
+            text = response.text
+        except Exception as e:
+            throttled = is_quota_error(e)
+            self.record(model, time.monotonic() - started, throttled=throttled, error=not throttled)
+            if throttled:
+                self.scheduler.throttled(model, e)
+            raise
+        latency = time.monotonic() - started
+        usage = getattr(response, 'usage_metadata', None)
+        self.scheduler.settle(model, tokens, getattr(usage, 'total_token_count', 0))
+        try:
+            data = parse(text)
+        except Exception:
+            self.record(model, latency, parsed=False)
+            raise
+        self.record(model, latency, parsed=True)
+        return data
+
+    def summary(self):
+        lines = []
+        for model in sorted(self.health):
+            stats = self.stats(model)
+            if stats:
+                lines.append(f"{model}: {stats['calls']} calls, {stats['latency']:.1f}s avg, "
+                             f"{stats['throttle_rate']:.0%} throttled, {stats['error_rate']:.0%} errors, "
+                             f"{stats['parse_rate']:.0%} of {stats['answered']} answers valid JSON")
+        return ("Gemini models: " + ("; ".join(lines) if lines else "no calls recorded")
+                + f". {self.scheduler.summary()}")
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+# Process-wide catalog; log is only used when it is first created
+def get_catalog(log=print):
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ModelCatalog(log=log)
+        return _catalog
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from google.api_core.exceptions import TooManyRequests
+
+# Requests and tokens per minute per model (longest matching name substring wins); override with
+# GEMINI_LIMITS='{"gemini-2.5-flash": [10, 250000]}'. Defaults follow the free tier.
+DEFAULT_LIMITS = {
+    'gemini-2.5-pro': (5, 250000),
+    'gemini-2.5-flash-lite': (15, 250000),
+    'gemini-2.5-flash': (10, 250000),
+    'gemini-2.0-flash-lite': (30, 1000000),
+    'gemini-2.0-flash': (15, 1000000),
+}
+FALLBACK_LIMITS = (10, 250000)
+LIMITS = {**DEFAULT_LIMITS, **{name: tuple(limits) for name, limits in json.loads(os.getenv("GEMINI_LIMITS", "{}")).items()}}
+OUTPUT_TOKEN_ESTIMATE = 2048  # Budgeted per request on top of the input, corrected once usage is known
+DEFAULT_RETRY_AFTER = 60  # When a 429 does not say how long to back off
+MAX_QUEUE_WAIT = int(os.getenv("GEMINI_MAX_QUEUE_WAIT", "180"))  # Longer waits are reported as quota errors
+# Quota errors one document may hit before it is left unprocessed for the next run; they never use up its attempts
+QUOTA_RETRIES = int(os.getenv("GEMINI_QUOTA_RETRIES", "6"))
+QUOTA_MESSAGE_PATTERN = re.compile(r"quota|RESOURCE_EXHAUSTED", re.IGNORECASE)  # For errors re-raised as plain exceptions
+RETRY_AFTER_PATTERNS = [
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)"),
+    re.compile(r"retry-after:?\s*(\d+(?:\.\d+)?)", re.IGNORECASE),
+    re.compile(r"retry in (\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+]
+
+# The local budget for a model stays exhausted longer than the caller is willing to wait
+class QuotaExceededError(Exception):
+    pass
+
+# A 429 from the API or a local budget that will not free up in time; judged by exception type and status
+# code, since a bare "429" in a message may just be a token count or a request id
+def is_quota_error(error):
+    if isinstance(error, (QuotaExceededError, TooManyRequests)):  # ResourceExhausted is a TooManyRequests
+        return True
+    if 429 in (getattr(error, 'code', None), getattr(error, 'status_code', None)):
+        return True
+    return bool(QUOTA_MESSAGE_PATTERN.search(str(error)))
+
+def model_limits(model):
+    matches = [name for name in LIMITS if name in model]
+    return LIMITS[max(matches, key=len)] if matches else FALLBACK_LIMITS
+
+# Rough token count for generate_content input (about 4 characters per token)
+def estimate_tokens(content):
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    return len(content) // 4 + OUTPUT_TOKEN_ESTIMATE
+
+# Back-off the server asked for in a 429, in seconds
+def retry_after(error):
+    for pattern in RETRY_AFTER_PATTERNS:
+        match = pattern.search(str(error))
+        if match:
+            return float(match.group(1))
+    return DEFAULT_RETRY_AFTER
+
+# Bucket of capacity units refilled continuously over a minute; the level may go negative when a
+# request turns out to cost more than was reserved, which delays the next one accordingly
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until `amount` is available (amounts above capacity only need a full bucket)
+    def wait_time(self, amount):
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+# RPM and TPM token buckets per (API key, model), plus the retry-after window of the last 429.
+# Callers reserve capacity before each request; the catalog routes to whichever model can start soonest.
+class QuotaScheduler:
+    def __init__(self, api_key=None, log=print):
+        # Buckets are keyed by a fingerprint so the key itself never ends up in logs or state
+        self.key_id = hashlib.sha256((api_key or "").encode('utf-8')).hexdigest()[:8]
+        self.log = log
+        self._buckets = {}
+        self._blocked_until = {}
+        self._waiting = {}  # Requests blocked in acquire() per model, which a new request would queue behind
+        self._condition = threading.Condition()
+        self.stats = {'waited': 0.0, 'throttled': 0}
+
+    def _bucket_pair(self, model):
+        key = (self.key_id, model)
+        if key not in self._buckets:
+            rpm, tpm = model_limits(model)
+            self._buckets[key] = (TokenBucket(rpm), TokenBucket(tpm))
+        return self._buckets[key]
+
+    def _wait_time(self, model, tokens, queued=0):
+        requests_bucket, tokens_bucket = self._bucket_pair(model)
+        blocked = self._blocked_until.get((self.key_id, model), 0) - time.monotonic()
+        return max(blocked, requests_bucket.wait_time(1 + queued), tokens_bucket.wait_time(tokens * (1 + queued)), 0.0)
+
+    # Seconds before a request of this size could start on the model, behind the requests already waiting for it
+    def wait_time(self, model, tokens):
+        with self._condition:
+            return self._wait_time(model, tokens, self._waiting.get(model, 0))
+
+    # Block until the model has budget for one request of `tokens`, then reserve it
+    def acquire(self, model, tokens):
+        deadline = time.monotonic() + MAX_QUEUE_WAIT
+        started = time.monotonic()
+        with self._condition:
+            self._waiting[model] = self._waiting.get(model, 0) + 1
+            try:
+                while True:
+                    wait = self._wait_time(model, tokens)
+                    if wait <= 0:
+                        break
+                    if time.monotonic() + wait > deadline:
+                        raise QuotaExceededError(f"No {model} quota for the next {wait:.0f}s")
+                    self._condition.wait(wait)
+            finally:
+                self._waiting[model] -= 1
+            requests_bucket, tokens_bucket = self._bucket_pair(model)
+            requests_bucket.take(1)
+            tokens_bucket.take(tokens)
+            self.stats['waited'] += time.monotonic() - started
+
+    # Correct the token reservation once the response reports its real usage
+    def settle(self, model, reserved, used):
+        if not used:
+            return
+        with self._condition:
+            self._bucket_pair(model)[1].take(used - reserved)
+            self._condition.notify_all()
+
+    # The server refused: stop sending to this model until its retry-after passes and empty its buckets
+    def throttled(self, model, error):
+        delay = retry_after(error)
+        with self._condition:
+            self._blocked_until[(self.key_id, model)] = time.monotonic() + delay
+            for bucket in self._bucket_pair(model):
+                bucket.take(max(bucket.level, 0))
+            self.stats['throttled'] += 1
+            self._condition.notify_all()
+        self.log(f"Quota exceeded for {model}, holding it for {delay:.0f}s")
+
+    def summary(self):
+        return f"Quota scheduler: {self.stats['throttled']} throttled responses, {self.stats['waited']:.0f}s spent waiting for budget"
@@ -0,0 +1,199 @@
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import time
+import threading
+
+GIT_SYNC_INTERVAL = int(os.getenv("GIT_SYNC_MINUTES", "15")) * 60
+# Machine-written state goes to this orphan branch, checked out as a worktree; empty means commit to the current branch
+STATE_BRANCH = os.getenv("STATE_BRANCH", "state")
+STATE_WORKTREE = os.getenv("STATE_WORKTREE", ".state")
+STATE_FETCH_DEPTH = 50  # Enough history to rebase onto commits pushed by a concurrent run
+PUSH_RETRIES = 3
+MAX_LISTED_ITEMS = 50  # Longer lists are summarised in the commit body
+
+def is_git_repository():
+    try:
+        subprocess.run(["git", "rev-parse", "--is-inside-work-tree"], check=True, capture_output=True, text=True)
+        return True
+    except Exception:
+        return False
+
+# Collects the state files a run changes and commits/pushes them once at the end, or as a checkpoint every N minutes
+class GitSync:
+    def __init__(self, paths, title, interval=GIT_SYNC_INTERVAL, before_commit=None, branch=STATE_BRANCH,
+                 worktree=STATE_WORKTREE, log=print):
+        self.paths = paths  # File names or glob patterns, e.g. "Report/*"
+        self.title = title
+        self.interval = interval
+        self.before_commit = before_commit  # Called before staging, e.g. to export state to JSON
+        self.branch = branch
+        self.worktree = worktree if branch else None
+        self.log = log
+        self.enabled = is_git_repository()
+        self._lock = threading.Lock()
+        self._items = []
+        self._last_sync = time.monotonic()
+        self._configured = False
+        self._unpushed = False
+        self._prepared = False
+
+    # Check out the state branch (shallow, that branch only) and, with restore, copy its files into the working directory
+    def prepare(self, restore=True):
+        if not self.enabled or not self.worktree or self._prepared:
+            return
+        with self._lock:
+            try:
+                self._setup_worktree()
+                self._prepared = True
+                if restore:
+                    restored = self._copy_files(self.worktree, ".")
+                    self.log(f"Git sync: restored {len(restored)} files from branch '{self.branch}'")
+            except Exception as e:
+                self.log(f"Git sync: could not prepare branch '{self.branch}': {str(e)}")
+
+    def _setup_worktree(self):
+        fetched = self._git("fetch", "--depth", "1", "origin",
+                            f"+refs/heads/{self.branch}:refs/remotes/origin/{self.branch}", check=False).returncode == 0
+        if os.path.exists(os.path.join(self.worktree, ".git")):
+            if fetched:
+                self._git("reset", "--hard", f"origin/{self.branch}", cwd=self.worktree)
+            return
+        if fetched:
+            self._git("worktree", "add", "-B", self.branch, self.worktree, f"origin/{self.branch}")
+            return
+        # First run: start the branch with no history and no files
+        self._git("worktree", "add", "--detach", self.worktree)
+        self._git("checkout", "--orphan", self.branch, cwd=self.worktree)
+        self._git("rm", "-rf", "--quiet", ".", cwd=self.worktree, check=False)
+
+    # Copy files matching self.paths from one tree to the other, keeping relative paths
+    def _copy_files(self, source, target):
+        copied = []
+        for pattern in self.paths:
+            for path in glob.glob(os.path.join(source, pattern)):
+                if not os.path.isfile(path):
+                    continue
+                relative = os.path.relpath(path, source)
+                destination = os.path.join(target, relative)
+                os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+                shutil.copy2(path, destination)
+                copied.append(relative)
+        return copied
+
+    # Files tracked on the state branch that the run deleted locally (e.g. a drained pending-rows file)
+    def _removed_files(self):
+        removed = []
+        for pattern in self.paths:
+            for path in glob.glob(os.path.join(self.worktree, pattern)):
+                relative = os.path.relpath(path, self.worktree)
+                if os.path.isfile(path) and not os.path.exists(relative):
+                    removed.append(relative)
+        return removed
+
+    # Remember something this run produced so the next commit can list it
+    def note(self, item):
+        with self._lock:
+            if item not in self._items:
+                self._items.append(item)
+
+    def due(self):
+        return time.monotonic() - self._last_sync >= self.interval
+
+    # Checkpoint commit if the interval has passed since the last one
+    def maybe_sync(self):
+        if self.due():
+            return self.sync(checkpoint=True)
+        return False
+
+    def sync(self, checkpoint=False):
+        if not self.enabled:
+            return False
+        self.prepare(restore=False)
+        if self.worktree and not self._prepared:
+            self.log(f"Git sync: branch '{self.branch}' is not checked out, skipping commit")
+            return False
+        with self._lock:
+            self._last_sync = time.monotonic()
+            try:
+                if self.before_commit:
+                    self.before_commit()
+                self._configure()
+                removed = []
+                if self.worktree:
+                    removed = self._removed_files()
+                    if removed:
+                        self._git("rm", "--quiet", "--ignore-unmatch", "--", *removed, cwd=self.worktree)
+                    files = self._copy_files(".", self.worktree)
+                else:
+                    files = [path for pattern in self.paths for path in glob.glob(pattern)]
+                if not files and not removed and not self._unpushed:
+                    return False
+                if files:
+                    self._git("add", "--", *files, cwd=self.worktree)
+                if self._git("diff", "--cached", "--quiet", cwd=self.worktree, check=False).returncode == 0:
+                    if self._unpushed:
+                        self._push()
+                        return True
+                    self.log("Git sync: no changes to commit")
+                    return False
+                self._git("commit", "-m", self._message(checkpoint), cwd=self.worktree)
+                covered = len(self._items)
+                self._items = []
+                self._unpushed = True
+                self._push()
+                self.log(f"Git sync: pushed {len(files)} files covering {covered} items")
+                return True
+            except Exception as e:
+                self.log(f"Git sync failed: {str(e)}")
+                return False
+
+    def _message(self, checkpoint):
+        subject = f"{self.title}{' (checkpoint)' if checkpoint else ''}: {len(self._items)} items"
+        listed = self._items[:MAX_LISTED_ITEMS]
+        body = "\n".join(f"- {item}" for item in listed)
+        if len(self._items) > len(listed):
+            body += f"\n- ... and {len(self._items) - len(listed)} more"
+        return f"{subject}\n\n{body}" if body else subject
+
+    # Push, rebasing onto the remote and retrying when another run pushed first
+    def _push(self):
+        for attempt in range(PUSH_RETRIES):
+            push = ["push", "origin", f"HEAD:refs/heads/{self.branch}"] if self.worktree else ["push"]
+            if self._git(*push, cwd=self.worktree, check=False).returncode == 0:
+                self._unpushed = False
+                return
+            self.log(f"Git push attempt {attempt + 1}/{PUSH_RETRIES} rejected, rebasing onto remote")
+            if self.worktree:
+                # State files are machine-written: on conflicting hunks this run's version wins
+                self._git("fetch", "--depth", str(STATE_FETCH_DEPTH), "origin",
+                          f"+refs/heads/{self.branch}:refs/remotes/origin/{self.branch}", check=False)
+                rebased = self._git("rebase", "-X", "theirs", f"origin/{self.branch}", cwd=self.worktree, check=False)
+            else:
+                rebased = self._git("pull", "--rebase", "--autostash", check=False)
+            if rebased.returncode != 0:
+                self._git("rebase", "--abort", cwd=self.worktree, check=False)
+            time.sleep(2 * (attempt + 1))
+        raise RuntimeError(f"push failed after {PUSH_RETRIES} attempts")
+
+    def _configure(self):
+        if self._configured:
+            return
+        self._git("config", "user.name", "GitHub Action")
+        self._git("config", "user.email", "action@github.com")
+        self._configured = True
+
+    def _git(self, *args, cwd=None, check=True):
+        return subprocess.run(["git", *args], cwd=cwd, check=check, capture_output=True, text=True)
+
+# For workflow steps: python git_sync.py restore <paths...> | python git_sync.py push <title> <paths...>
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "restore":
+        GitSync(sys.argv[2:], "").prepare()
+    elif len(sys.argv) >= 4 and sys.argv[1] == "push":
+        GitSync(sys.argv[3:], sys.argv[2]).sync()
+    else:
+        print("Usage: python git_sync.py restore <paths...> | python git_sync.py push <title> <paths...>")
+        sys.exit(1)
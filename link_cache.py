@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import time
+import threading
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+
+LINK_CACHE_FILE = os.getenv("LINK_CACHE_FILE", "link_cache.sqlite")
+# Seconds a successful check stays valid, per link type; override with LINK_CACHE_TTL_<TYPE>
+LINK_TTLS = {
+    "doc": 6 * 3600,
+    "folder": 24 * 3600,
+    "quizlet": 7 * 86400,
+    "youtube": 7 * 86400,
+    "other": 24 * 3600
+}
+FAILURE_TTL = int(os.getenv("LINK_CACHE_FAILURE_TTL", str(3600)))
+# Sharing/tracking params that do not change what a link points at
+IGNORED_PARAMS = {"usp", "ouid", "rtpof", "sd", "pli", "authuser", "fbclid", "si", "feature"}
+
+def link_ttl(kind):
+    return int(os.getenv(f"LINK_CACHE_TTL_{kind.upper()}", str(LINK_TTLS.get(kind, LINK_TTLS["other"]))))
+
+def link_type(url):
+    host = (urlparse(url).hostname or "").lower()
+    if "docs.google.com/document" in url:
+        return "doc"
+    if "drive.google.com/drive/folders" in url:
+        return "folder"
+    if host.endswith("quizlet.com"):
+        return "quizlet"
+    if host.endswith("youtube.com") or host == "youtu.be":
+        return "youtube"
+    return "other"
+
+# Same key for links that differ only in sharing params, fragment, host case or a trailing /edit
+def canonical_url(url):
+    parsed = urlparse(url.strip())
+    host = (parsed.hostname or "").lower()
+    if parsed.port:
+        host = f"{host}:{parsed.port}"
+    path = parsed.path or "/"
+    if host == "docs.google.com" and "/d/" in path:
+        doc_id = path.split('/d/')[1].split('/')[0]
+        path = f"{path.split('/d/')[0]}/d/{doc_id}"
+    elif path != "/":
+        path = path.rstrip('/')
+    params = sorted((key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+                    if key.lower() not in IGNORED_PARAMS and not key.lower().startswith("utm_"))
+    return urlunparse((parsed.scheme.lower() or "https", host, path, "", urlencode(params), ""))
+
+# SQLite cache of link checks: canonical URL -> (ok, final URL or error, checked_at)
+class LinkCache:
+    def __init__(self, path=LINK_CACHE_FILE):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS link_checks ("
+            "url TEXT PRIMARY KEY, ok INTEGER NOT NULL, result TEXT, checked_at REAL NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    # Cached (ok, result) for a URL, or None if it was never checked or the entry expired
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT ok, result FROM link_checks WHERE url = ? AND expires_at > ?", (canonical_url(url), time.time())
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return bool(row[0]), row[1]
+
+    def put(self, url, ok, result):
+        now = time.time()
+        ttl = link_ttl(link_type(url)) if ok else FAILURE_TTL
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO link_checks (url, ok, result, checked_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (canonical_url(url), int(ok), result, now, now + ttl)
+            )
+            self._conn.commit()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self):
+        return f"Link cache: {self.hits} hits, {self.misses} misses ({self.hit_rate():.0%} hit rate)"
+
+    # Drop expired rows so the file does not grow without bound, then close
+    def close(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM link_checks WHERE expires_at <= ?", (time.time(),))
+            self._conn.commit()
+            self._conn.close()
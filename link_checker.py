@@ -0,0 +1,92 @@
+import asyncio
+from urllib.parse import urlparse
+import httpx
+import drive_check
+
+# Configuration
+REQUEST_TIMEOUT = 10
+MAX_CONCURRENCY = 16
+DEFAULT_HOST_LIMIT = 4
+HOST_LIMITS = {
+    "docs.google.com": 4,
+    "drive.google.com": 4,
+    "quizlet.com": 2,
+    "youtube.com": 4,
+    "youtu.be": 4
+}
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0.0.0"
+
+def host_key(url):
+    host = (urlparse(url).hostname or "").lower()
+    for known in HOST_LIMITS:
+        if host == known or host.endswith(f".{known}"):
+            return known
+    return host
+
+# URL to HEAD for a link and whether it is checkable at all, mirroring main.check_doc_accessibility
+def probe_url(url):
+    if "docs.google.com/document" in url:
+        try:
+            doc_id = urlparse(url).path.split('/d/')[1].split('/')[0]
+        except IndexError:
+            return None, "Not a supported Google URL"
+        return f"https://docs.google.com/document/d/{doc_id}/export?format=pdf", None
+    if "drive.google.com/drive/folders" in url:
+        return url, None
+    if "docs.google.com" in url or "drive.google.com" in url:
+        return None, "Not a supported Google URL"
+    return url, None
+
+async def _check(client, url, global_limit, host_limits):
+    target, error = probe_url(url)
+    if target is None:
+        return url, (False, error)
+    host = host_key(target)
+    if host not in host_limits:
+        host_limits[host] = asyncio.Semaphore(HOST_LIMITS.get(host, DEFAULT_HOST_LIMIT))
+    async with global_limit, host_limits[host]:
+        try:
+            response = await client.head(target)
+        except Exception as e:
+            return url, (False, str(e))
+    if response.status_code == 200:
+        return url, (True, target)
+    return url, (False, f"HTTP {response.status_code}")
+
+async def check_links_async(urls):
+    unique = list(dict.fromkeys(u for u in urls if u))
+    global_limit = asyncio.Semaphore(MAX_CONCURRENCY)
+    host_limits = {}
+    async with httpx.AsyncClient(follow_redirects=True, timeout=REQUEST_TIMEOUT, headers={"User-Agent": USER_AGENT}) as client:
+        results = await asyncio.gather(*(_check(client, url, global_limit, host_limits) for url in unique))
+    return dict(results)
+
+# Check every URL concurrently; returns {url: (is_accessible, final_url_or_error)}
+# With a LinkCache, fresh cached results are reused and new results are stored
+# With service account credentials, Google Docs are checked by Drive metadata first and HEAD only as a fallback
+def check_links(urls, cache=None, credentials_file=None):
+    urls = list(dict.fromkeys(u for u in urls if u))
+    if not urls:
+        return {}
+    results = {}
+    if cache is not None:
+        for url in urls:
+            cached = cache.get(url)
+            if cached is not None:
+                results[url] = cached
+    to_check = [url for url in urls if url not in results]
+    checked = {}
+    docs = [url for url in to_check if "docs.google.com/document" in url]
+    if credentials_file and docs:
+        try:
+            checked.update(drive_check.check_docs(docs, credentials_file))
+        except Exception:
+            pass
+    to_check = [url for url in to_check if url not in checked]
+    if to_check:
+        checked.update(asyncio.run(check_links_async(to_check)))
+    if cache is not None:
+        for url, (ok, result) in checked.items():
+            cache.put(url, ok, result)
+    results.update(checked)
+    return results
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+LLM_CACHE_FILE = os.getenv("LLM_CACHE_FILE", "llm_cache.sqlite")  # Empty disables the cache
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Stable hash of a prompt or of generate_content input (a string or a list of parts)
+def content_hash(content):
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+# SQLite cache of parsed Gemini responses keyed by (model, system prompt hash, input hash), evicted
+# least-recently-used by total size. A prompt edit changes the key, so old answers are never served;
+# register_prompt also deletes them so they stop taking space.
+class LLMCache:
+    def __init__(self, path=LLM_CACHE_FILE, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'evicted': 0, 'invalidated': 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "model TEXT NOT NULL, prompt_hash TEXT NOT NULL, input_hash TEXT NOT NULL, data TEXT NOT NULL, "
+            "size INTEGER NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (model, prompt_hash, input_hash));"
+            "CREATE INDEX IF NOT EXISTS responses_by_input ON responses (prompt_hash, input_hash);"
+            "CREATE TABLE IF NOT EXISTS prompts (name TEXT PRIMARY KEY, prompt_hash TEXT NOT NULL, updated_at REAL NOT NULL);"
+        )
+        self._conn.commit()
+
+    # Record the current prompt of a caller (e.g. the script name); answers cached under its previous
+    # version are deleted unless another caller still uses that prompt
+    def register_prompt(self, name, prompt):
+        prompt_hash = content_hash(prompt)
+        with self._lock:
+            row = self._conn.execute("SELECT prompt_hash FROM prompts WHERE name = ?", (name,)).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO prompts (name, prompt_hash, updated_at) VALUES (?, ?, ?)",
+                               (name, prompt_hash, time.time()))
+            if row and row[0] != prompt_hash and not self._conn.execute(
+                    "SELECT 1 FROM prompts WHERE prompt_hash = ?", (row[0],)).fetchone():
+                deleted = self._conn.execute("DELETE FROM responses WHERE prompt_hash = ?", (row[0],)).rowcount
+                self.stats['invalidated'] += deleted
+            self._conn.commit()
+
+    # Parsed response of this model for this input; None on a miss. For callers pinned to one model;
+    # callers that choose among several use get_any.
+    def get(self, model, prompt, content):
+        key = (model, content_hash(prompt), content_hash(content))
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM responses WHERE model = ? AND prompt_hash = ? AND input_hash = ?", key
+            ).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE model = ? AND prompt_hash = ? AND input_hash = ?",
+                               (time.time(), *key))
+            self._conn.commit()
+            self.stats['hits'] += 1
+            return json.loads(row[0])
+
+    # Parsed response of any model for this input, as (model, data), preferring the caller's priorities (name
+    # substrings, best first); None on a miss. Only parsed answers are stored, so whichever model wrote one,
+    # a re-run is served without a call no matter which model the quota and health state would pick now.
+    def get_any(self, priority, prompt, content):
+        prompt_hash, input_hash = content_hash(prompt), content_hash(content)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT model, data FROM responses WHERE prompt_hash = ? AND input_hash = ? ORDER BY last_used DESC",
+                (prompt_hash, input_hash)
+            ).fetchall()
+            if not rows:
+                self.stats['misses'] += 1
+                return None
+            ranks = [next((rank for rank, pattern in enumerate(priority) if pattern in model), len(priority)) for model, _ in rows]
+            model, data = rows[ranks.index(min(ranks))]
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE model = ? AND prompt_hash = ? AND input_hash = ?",
+                               (time.time(), model, prompt_hash, input_hash))
+            self._conn.commit()
+            self.stats['hits'] += 1
+            return model, json.loads(data)
+
+    # Store a successfully parsed response
+    def put(self, model, prompt, content, data):
+        payload = json.dumps(data, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (model, prompt_hash, input_hash, data, size, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (model, content_hash(prompt), content_hash(content), payload, len(payload.encode('utf-8')), now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    # Drop least-recently-used answers until the total fits in max_bytes
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT rowid, size FROM responses ORDER BY last_used").fetchall()
+        for rowid, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE rowid = ?", (rowid,))
+            total -= size
+            self.stats['evicted'] += 1
+
+    def summary(self):
+        stats = self.stats
+        total = stats['hits'] + stats['misses']
+        rate = stats['hits'] / total if total else 0.0
+        return (f"LLM cache: {stats['hits']} hits, {stats['misses']} misses ({rate:.0%} hit rate), "
+                f"{stats['evicted']} evicted, {stats['invalidated']} invalidated by prompt changes")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# Process-wide cache, or None when LLM_CACHE_FILE is empty
+def get_cache():
+    global _cache
+    if not LLM_CACHE_FILE:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
+
+def summary():
+    cache = get_cache()
+    return cache.summary() if cache is not None else "LLM cache disabled"
+
+# Module-level helpers for call sites; they do nothing when the cache is disabled
+def lookup(model, prompt, content):
+    cache = get_cache()
+    return cache.get(model, prompt, content) if cache is not None else None
+
+def lookup_any(priority, prompt, content):
+    cache = get_cache()
+    return cache.get_any(priority, prompt, content) if cache is not None else None
+
+def store(model, prompt, content, data):
+    cache = get_cache()
+    if cache is not None:
+        cache.put(model, prompt, content, data)
+
+def register_prompt(name, prompt):
+    cache = get_cache()
+    if cache is not None:
+        cache.register_prompt(name, prompt)
@@ -1,6 +1,5 @@
 import pandas as pd
 import json
-import subprocess
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
@@ -9,11 +8,20 @@ from selenium.common.exceptions import StaleElementReferenceException, NoSuchEle
 from selenium.webdriver.common.keys import Keys
 import time
 import os
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import requests
-from urllib.parse import urlparse
+import threading
 from webdriver_manager.chrome import ChromeDriverManager
+import cec_api
+from cec_api import format_homework_content
+import link_checker
+from link_cache import LinkCache
+from state_store import StateStore
+from git_sync import GitSync
+from browser_pool import BrowserPool
+import session_cache
+import cec_dom
+import cec_network
+from sheets_sink import SheetsSink
+from sheet_index import SheetKeyIndex, row_key
 
 # Configuration
 CSV_FILE = "id.csv"
@@ -22,31 +30,53 @@ CREDENTIALS_FILE = "credentials.json"
 SHEET_ID = "1-MMsbAGlg7MNbBPAzioqARu6QLfry5mCrWJ-Q_aqmIM"
 SHEET_NAME = "Trang tính3"
 SCOPES = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+MAX_WORKERS = int(os.getenv("CEC_WORKERS", "4"))
+MAX_CLASSES_PER_RUN = int(os.getenv("MAX_CLASSES_PER_RUN", "50"))
+HOMEWORK_CAPTURE = os.getenv("HOMEWORK_CAPTURE", "1") == "1"  # Read homework from captured XHRs instead of opening each dialog
+
+# Guards the shared processed dict and the Sheet duplicate check; network and database I/O happen outside it
+STATE_LOCK = threading.RLock()
+REFRESH_LOCK = threading.Lock()  # One Sheet index refresh at a time
+LOG_LOCK = threading.Lock()
 
 def log_message(message):
     timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-    print(f"[{timestamp}] {message}")
-    with open("class_info_log.txt", "a", encoding="utf-8") as f:
-        f.write(f"[{timestamp}] {message}\n")
+    with LOG_LOCK:
+        print(f"[{timestamp}] {message}")
+        with open("class_info_log.txt", "a", encoding="utf-8") as f:
+            f.write(f"[{timestamp}] {message}\n")
 
-def check_doc_accessibility(url):
-    try:
-        if "docs.google.com/document" in url:
-            doc_id = urlparse(url).path.split('/d/')[1].split('/')[0]
-            export_url = f"https://docs.google.com/document/d/{doc_id}/export?format=pdf"
-            response = requests.head(export_url, allow_redirects=True, timeout=10)
-            return response.status_code == 200, export_url if response.status_code == 200 else f"HTTP {response.status_code}"
-        elif "drive.google.com/drive/folders" in url:
-            response = requests.head(url, allow_redirects=True, timeout=10)
-            return response.status_code == 200, url if response.status_code == 200 else f"HTTP {response.status_code}"
-        return False, "Not a supported Google URL"
-    except Exception as e:
-        return False, str(e)
+# Services shared by the workers for one run; built in main() once the state branch has been restored
+class Run:
+    def __init__(self, state, sheets, sheet_index, link_cache, git_sync):
+        self.state = state
+        self.sheets = sheets
+        self.sheet_index = sheet_index
+        self.link_cache = link_cache
+        self.git_sync = git_sync
+
+# Pull the state files from the state branch first, then open everything that reads them
+def start_run():
+    state = None
+    git_sync = GitSync([PROCESSED_FILE, "class_info_log.txt", "sheet_index.json", "sheet_pending.json"], "Update processed.json",
+                       before_commit=lambda: state.export_processed_json(PROCESSED_FILE), log=log_message)
+    git_sync.prepare()
+    state = StateStore()
+    sheet_index = SheetKeyIndex("sheet_index.json")
+    # Flushed rows only add their keys: where they landed is unknown, so row_count is left to refresh(),
+    # which may already have read them if it ran right after the flush
+    sheets = SheetsSink(CREDENTIALS_FILE, SHEET_ID, SCOPES, pending_file="sheet_pending.json",
+                        on_flush=lambda name, rows: sheet_index.add_rows(rows, rows_are_new=False) if name == SHEET_NAME else None,
+                        log=log_message)
+    return Run(state, sheets, sheet_index, LinkCache(), git_sync)
 
 def login(driver):
-    driver.get("https://apps.cec.com.vn/login")
     current_id = os.getenv("CEC_USERNAME", "40183HN")
     password = os.getenv("CEC_PASSWORD", "1234567")
+    if session_cache.restore_driver_session(driver, current_id):
+        log_message("Đăng nhập bằng session đã lưu")
+        return
+    driver.get("https://apps.cec.com.vn/login")
     try:
         username_field = WebDriverWait(driver, 30).until(
             EC.visibility_of_element_located((By.ID, "input-14"))
@@ -67,68 +97,111 @@ def login(driver):
             log_message("Lỗi đăng nhập: Vẫn ở trang login")
             raise Exception("Login failed")
         log_message("Đăng nhập thành công")
+        session_cache.save_driver_session(driver, current_id)
     except Exception as e:
         log_message(f"Lỗi đăng nhập: {str(e)}")
         raise
 
-def get_google_sheet_data():
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, SCOPES)
-            client = gspread.authorize(creds)
-            sheet = client.open_by_key(SHEET_ID)
-            worksheet = sheet.worksheet(SHEET_NAME)
-            return worksheet.get_all_values()
-        except Exception as e:
-            log_message(f"Attempt {attempt+1}/{max_retries} failed to read Google Sheet: {str(e)}")
-            if attempt == max_retries - 1:
-                log_message(f"Error reading Google Sheet: {str(e)}")
-                return []
-            time.sleep(3)
-    return []
+def login_api():
+    session = cec_api.create_session()
+    current_id = os.getenv("CEC_USERNAME", "40183HN")
+    if session_cache.restore_requests_session(session, current_id):
+        log_message("Đăng nhập API bằng session đã lưu")
+        return session
+    try:
+        cec_api.login_session(session, current_id, os.getenv("CEC_PASSWORD", "1234567"))
+        session_cache.save_requests_session(session, current_id)
+        log_message("Đăng nhập API thành công")
+        return session
+    except cec_api.CecApiError as e:
+        log_message(f"Lỗi đăng nhập API, sẽ dùng Selenium: {str(e)}")
+        return None
+
+def check_webdriver(driver):
+    try:
+        driver.execute_script("return true;")
+        return True
+    except Exception as e:
+        log_message(f"WebDriver unresponsive: {str(e)}")
+        return False
 
-def update_google_sheet(row_data, class_id, lesson_number):
-    max_retries = 3
-    for attempt in range(max_retries):
+def start_driver():
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0.0.0")
+    options.add_argument("--disable-autofill")
+    if HOMEWORK_CAPTURE:
+        cec_network.enable_network_capture(options)
+    driver = webdriver.Chrome(service=webdriver.chrome.service.Service(ChromeDriverManager().install()), options=options)
+    try:
+        login(driver)
+    except Exception:
+        driver.quit()
+        raise
+    return driver
+
+def get_google_sheet_data(run):
+    try:
+        return run.sheets.call(f"read Google Sheet '{SHEET_NAME}'", lambda: run.sheets.worksheet(SHEET_NAME).get_all_values())
+    except Exception as e:
+        log_message(f"Error reading Google Sheet: {str(e)}")
+        return []
+
+# Bring the local key index up to date by reading only the rows appended since the last refresh
+def refresh_sheet_index(run):
+    new_rows = run.sheet_index.refresh(run.sheets.worksheet(SHEET_NAME), lambda read: run.sheets.call(f"read new rows of Google Sheet '{SHEET_NAME}'", read))
+    if new_rows is None:
+        log_message(f"Could not refresh Sheet index, using local index ({len(run.sheet_index)} keys)")
+        return []
+    run.sheet_index.save()
+    log_message(f"Sheet index refreshed: {len(new_rows)} new rows, {run.sheet_index.row_count} rows total")
+    return new_rows
+
+def update_google_sheet(run, row_data, class_id, lesson_number):
+    unique_id = row_key(row_data)
+    if run.sheet_index.refresh_due() and REFRESH_LOCK.acquire(blocking=False):
         try:
-            creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, SCOPES)
-            client = gspread.authorize(creds)
-            sheet = client.open_by_key(SHEET_ID)
-            worksheet = sheet.worksheet(SHEET_NAME)
-            existing_data = worksheet.get_all_values()
-            unique_id = f"{class_id}:{lesson_number}"
-            for row in existing_data:
-                if len(row) >= 4 and f"{row[0]}:{row[3]}" == unique_id:
-                    log_message(f"Lesson {lesson_number} of Class ID {class_id} already exists in Sheet")
-                    return True
-            worksheet.append_row(row_data)
-            log_message(f"Updated Google Sheet for Class ID {class_id}, Lesson {lesson_number}")
-            return True
+            refresh_sheet_index(run)
         except Exception as e:
-            log_message(f"Attempt {attempt+1}/{max_retries} failed to update Google Sheet for Class ID {class_id}, Lesson {lesson_number}: {str(e)}")
-            if attempt == max_retries - 1:
-                log_message(f"Error updating Google Sheet for Class ID {class_id}, Lesson {lesson_number}: {str(e)}")
-                return False
-            time.sleep(3)
-    return False
+            log_message(f"Could not refresh Sheet index, using local index: {str(e)}")
+        finally:
+            REFRESH_LOCK.release()
+    with STATE_LOCK:
+        if unique_id in run.sheet_index or unique_id in {row_key(row) for row in run.sheets.pending(SHEET_NAME)}:
+            log_message(f"Lesson {lesson_number} of Class ID {class_id} already exists in Sheet")
+            return True
+        run.sheets.append(SHEET_NAME, row_data, flush=False)
+    log_message(f"Queued Google Sheet row for Class ID {class_id}, Lesson {lesson_number}")
+    run.sheets.flush_if_due()
+    return True
 
-def save_processed(processed):
+# Write every class to the state store in one transaction and export the legacy processed.json
+def save_processed(run, processed):
+    with STATE_LOCK:
+        snapshot = [(course_name, class_id, dict(progress)) for course_name, classes in processed.items()
+                    for class_id, progress in classes.items()]
     try:
-        with open(PROCESSED_FILE, 'w', encoding='utf-8') as f:
-            json.dump(processed, f, indent=2)
+        with run.state.transaction() as conn:
+            for course_name, class_id, progress in snapshot:
+                run.state.save_class(course_name, class_id, progress, conn=conn)
+        run.state.export_processed_json(PROCESSED_FILE)
         log_message(f"Saved processed.json")
     except Exception as e:
         log_message(f"Error saving processed.json: {str(e)}")
 
-def is_git_repository():
+# Persist the progress of a single class; one row update instead of rewriting processed.json
+def save_class(run, processed, course_name, class_id):
+    with STATE_LOCK:
+        progress = dict(processed[course_name][class_id])
     try:
-        subprocess.run(["git", "rev-parse", "--is-inside-work-tree"], check=True, capture_output=True, text=True)
-        return True
-    except:
-        return False
+        run.state.save_class(course_name, class_id, progress)
+    except Exception as e:
+        log_message(f"Error saving progress for Class ID {class_id}: {str(e)}")
 
-def sync_processed_with_sheet(processed, sheet_data):
+def sync_processed_with_sheet(run, processed, sheet_data):
     processed_lessons = set()
     for row in sheet_data:
         if len(row) < 4:
@@ -150,13 +223,134 @@ def sync_processed_with_sheet(processed, sheet_data):
             lesson_number - 1
         )
         processed[course_name][class_id]['has_errors'] = False
-    save_processed(processed)
+    save_processed(run, processed)
     return processed_lessons
 
-def process_class_id(driver, class_id, course_name, processed, sheet_data, processed_lessons, csv_total_sessions):
+# A scraped lesson waiting for its links to be checked
+def pending_lesson(lesson_index, lesson_number, report_link, homework_links, homework_content, has_error):
+    links = [report_link] if "docs.google.com/document" in report_link else []
+    return {
+        'lesson_index': lesson_index,
+        'lesson_number': lesson_number,
+        'report_link': report_link,
+        'homework_content': homework_content,
+        'links': links + [href for _, href in homework_links if href],
+        'has_error': has_error
+    }
+
+# Check the links of every scraped lesson concurrently, then record the lessons in order. A lesson that
+# failed without a row stops last_lesson from moving past it, so the next run scrapes it again; the lessons
+# after it are still written and are skipped next time because they are in the Sheet.
+def finish_lessons(run, pending, class_id, class_code, course_name, processed, processed_lessons, has_errors):
+    urls = [url for lesson in pending for url in lesson.get('links', [])]
+    started = time.monotonic()
+    results = link_checker.check_links(urls, cache=run.link_cache, credentials_file=CREDENTIALS_FILE)
+    if urls:
+        log_message(f"Checked {len(results)} links for Class ID {class_id} in {time.monotonic() - started:.1f}s")
+    advance = True
+    for lesson in pending:
+        lesson_index = lesson['lesson_index']
+        if lesson.get('failed'):
+            has_errors = True
+            if advance:
+                log_message(f"Keeping Class ID {class_id} before lesson {lesson_index + 1} so it is retried next run")
+                advance = False
+        if lesson.get('skip') or lesson.get('failed'):
+            with STATE_LOCK:
+                if advance:
+                    processed[course_name][class_id]['last_lesson'] = lesson_index
+                processed[course_name][class_id]['has_errors'] = has_errors
+            save_class(run, processed, course_name, class_id)
+            continue
+        lesson_number = lesson['lesson_number']
+        lesson_has_error = lesson['has_error']
+        for url in lesson['links']:
+            is_accessible, result = results.get(url, (False, "Not checked"))
+            if not is_accessible:
+                kind = "report" if url == lesson['report_link'] else "homework"
+                log_message(f"Invalid {kind} link for lesson {lesson_number}: {result}")
+                lesson_has_error = True
+        has_errors = has_errors or lesson_has_error
+        row_data = [str(class_id), class_code, course_name, lesson_number, lesson['report_link'], lesson['homework_content'], "OK" if not lesson_has_error else "Has Errors"]
+        record_lesson(run, row_data, class_id, course_name, lesson_index, lesson_number, has_errors, processed, processed_lessons, advance)
+    return has_errors
+
+def record_lesson(run, row_data, class_id, course_name, lesson_index, lesson_number, has_errors, processed, processed_lessons, advance=True):
+    with STATE_LOCK:
+        if advance:
+            processed[course_name][class_id]['last_lesson'] = lesson_index
+        processed[course_name][class_id]['has_errors'] = has_errors
+        progress = dict(processed[course_name][class_id])
+        processed_lessons.add(f"{class_id}:{lesson_index + 1}")
+    try:
+        run.state.record_lesson(course_name, class_id, progress, lesson_number, lesson_index,
+                            status=row_data[6], report_link=row_data[4])
+    except Exception as e:
+        log_message(f"Error saving lesson {lesson_number} for Class ID {class_id}: {str(e)}")
+    if update_google_sheet(run, row_data, class_id, lesson_number):
+        run.git_sync.note(f"Class ID {class_id}, Lesson {lesson_number}")
+    run.git_sync.maybe_sync()
+
+def update_class_progress(run, class_id, course_name, total_lessons, processed, csv_total_sessions):
+    class_progress = processed.get(course_name, {}).get(class_id, {})
+    total_lessons_prev = class_progress.get('total_lessons', 0)
+    if total_lessons != total_lessons_prev:
+        log_message(f"Total lessons updated for Class ID {class_id}: {total_lessons_prev} -> {total_lessons}")
+    if total_lessons_prev == 0 and csv_total_sessions > 0:
+        log_message(f"Using total sessions from id.csv for Class ID {class_id}: {csv_total_sessions}")
+        total_lessons = max(total_lessons, csv_total_sessions)
+    with STATE_LOCK:
+        processed.setdefault(course_name, {})[class_id] = {
+            'last_lesson': class_progress.get('last_lesson', -1),
+            'total_lessons': total_lessons,
+            'has_errors': class_progress.get('has_errors', False)
+        }
+    save_class(run, processed, course_name, class_id)
+    return class_progress, total_lessons
+
+# Read the class straight from the portal's JSON endpoints; raises CecApiError so the caller can fall back to Selenium
+def process_class_id_api(run, session, class_id, course_name, processed, processed_lessons, csv_total_sessions):
+    log_message(f"Processing Class ID {class_id} for course {course_name} via API")
+    class_code, extracted_course_name = cec_api.get_class_detail(session, class_id)
+    if extracted_course_name != course_name:
+        log_message(f"Course name mismatch for Class ID {class_id}: expected {course_name}, got {extracted_course_name}")
+        return True
+    lessons = cec_api.get_lessons(session, class_id)
+    if not lessons:
+        raise cec_api.CecApiError(f"No lessons returned for Class ID {class_id}")
+    class_progress, total_lessons = update_class_progress(run, class_id, course_name, len(lessons), processed, csv_total_sessions)
+    pending = []
+    for lesson_index in range(class_progress.get('last_lesson', -1) + 1, min(total_lessons, len(lessons))):
+        unique_id = f"{class_id}:{lesson_index + 1}"
+        if unique_id in processed_lessons:
+            log_message(f"Skipping lesson {lesson_index + 1} for Class ID {class_id} - already in Sheet")
+            pending.append({'lesson_index': lesson_index, 'skip': True})
+            continue
+        lesson = lessons[lesson_index]
+        lesson_number = lesson['lesson_number']
+        log_message(f"Processing lesson {lesson_number} for Class ID {class_id}")
+        report_link = lesson['report_link'] or "No report available"
+        homework_content = "No homework available"
+        homework_links = []
+        if lesson['has_homework']:
+            header, text_actions, homework_links = cec_api.get_homework(session, class_id, lesson)
+            homework_content = cec_api.format_homework_content(header, text_actions, homework_links)
+            log_message(f"Got homework for lesson {lesson_number}: {homework_content}")
+        pending.append(pending_lesson(lesson_index, lesson_number, report_link, homework_links, homework_content, False))
+    has_errors = finish_lessons(run, pending, class_id, class_code, course_name, processed, processed_lessons, False)
+    log_message(f"Completed Class ID {class_id} for course {course_name}")
+    return has_errors
+
+def process_class_id(run, driver, class_id, course_name, processed, sheet_data, processed_lessons, csv_total_sessions, session=None):
+    pending = []
+    class_code = ""
+    has_errors = False
     try:
         url = f"https://apps.cec.com.vn/student-calendar/class-detail?classID={class_id}"
+        if HOMEWORK_CAPTURE:
+            cec_network.reset_capture(driver)
         driver.get(url)
+        cec_dom.install_window_open_shim(driver)
         log_message(f"Processing Class ID {class_id} for course {course_name}")
         time.sleep(5)
         driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
@@ -171,139 +365,117 @@ def process_class_id(driver, class_id, course_name, processed, sheet_data, proce
         if extracted_course_name != course_name:
             log_message(f"Course name mismatch for Class ID {class_id}: expected {course_name}, got {extracted_course_name}")
             return True
-        class_progress = processed.get(course_name, {}).get(class_id, {})
-        total_lessons_prev = class_progress.get('total_lessons', 0)
-        lesson_rows = WebDriverWait(driver, 20).until(EC.presence_of_all_elements_located((By.XPATH, "//tbody/tr")))
-        total_lessons = len(lesson_rows)
-        if total_lessons != total_lessons_prev:
-            log_message(f"Total lessons updated for Class ID {class_id}: {total_lessons_prev} -> {total_lessons}")
-        if total_lessons_prev == 0 and csv_total_sessions > 0:
-            log_message(f"Using total sessions from id.csv for Class ID {class_id}: {csv_total_sessions}")
-            total_lessons = max(total_lessons, csv_total_sessions)
-        processed.setdefault(course_name, {})[class_id] = {
-            'last_lesson': class_progress.get('last_lesson', -1),
-            'total_lessons': total_lessons,
-            'has_errors': class_progress.get('has_errors', False)
-        }
-        save_processed(processed)
-        has_errors = False
+        lesson_rows = cec_dom.snapshot_lesson_table(driver)
+        class_progress, total_lessons = update_class_progress(run, class_id, course_name, len(lesson_rows), processed, csv_total_sessions)
+        captured_homework, captured_lessons = cec_network.capture_homework(driver, lesson_rows) if HOMEWORK_CAPTURE else ({}, {})
+        if captured_homework:
+            log_message(f"Captured homework for {len(captured_homework)} lessons of Class ID {class_id} from network traffic")
         for lesson_index in range(class_progress.get('last_lesson', -1) + 1, total_lessons):
             unique_id = f"{class_id}:{lesson_index + 1}"  # lesson_number is 1-indexed
             if unique_id in processed_lessons:
                 log_message(f"Skipping lesson {lesson_index + 1} for Class ID {class_id} - already in Sheet")
-                processed[course_name][class_id]['last_lesson'] = lesson_index
-                save_processed(processed)
+                pending.append({'lesson_index': lesson_index, 'skip': True})
                 continue
+            if lesson_index >= len(lesson_rows):
+                log_message(f"Lesson {lesson_index + 1} for Class ID {class_id} is not in the lesson table yet")
+                has_errors = True
+                break
+            row = lesson_rows[lesson_index]
+            lesson_number = row['lesson_number']
             lesson_has_error = False
             retry_count = 0
             max_retries = 3
             while retry_count < max_retries:
                 try:
-                    lesson_rows = WebDriverWait(driver, 20).until(EC.presence_of_all_elements_located((By.XPATH, "//tbody/tr")))
-                    row = lesson_rows[lesson_index]
-                    lesson_number = row.find_element(By.XPATH, "./td[4]").text.strip()
                     log_message(f"Processing lesson {lesson_number} for Class ID {class_id}")
                     report_link = "No report available"
                     try:
-                        report_button = row.find_element(By.XPATH, ".//i[@data-v-50ef298c and contains(@class, 'isax-card-edit')]")
-                        driver.execute_script("arguments[0].scrollIntoView(true);", report_button)
-                        original_window = driver.current_window_handle
-                        driver.execute_script("arguments[0].click();", report_button)
-                        WebDriverWait(driver, 10).until(EC.number_of_windows_to_be(2))
-                        new_window = [window for window in driver.window_handles if window != original_window][0]
-                        driver.switch_to.window(new_window)
-                        report_link = driver.current_url
-                        if "docs.google.com/document" in report_link:
-                            is_accessible, result = check_doc_accessibility(report_link)
-                            if not is_accessible:
-                                log_message(f"Invalid report link for lesson {lesson_number}: {result}")
-                                lesson_has_error = True
-                                has_errors = True
-                        driver.close()
-                        driver.switch_to.window(original_window)
+                        if not row['has_report']:
+                            raise NoSuchElementException("No report icon in row")
+                        opened_url = cec_dom.capture_opened_url(driver, lambda: cec_dom.click_row_icon(driver, row, cec_dom.REPORT_ICON))
+                        if opened_url is None:
+                            raise NoSuchElementException("Report icon did not open a link")
+                        report_link = opened_url
+                    except StaleElementReferenceException:
+                        raise
                     except Exception as e:
                         log_message(f"Error getting report link for lesson {lesson_number}: {str(e)}")
                         lesson_has_error = True
                         has_errors = True
                     homework_content = "No homework available"
-                    try:
-                        homework_button = row.find_element(By.XPATH, ".//i[@data-v-50ef298c and contains(@class, 'isax-book-square')]")
-                        driver.execute_script("arguments[0].scrollIntoView(true);", homework_button)
-                        for attempt in range(3):
-                            try:
-                                driver.execute_script("arguments[0].click();", homework_button)
-                                popup = WebDriverWait(driver, 30).until(EC.visibility_of_element_located((By.CSS_SELECTOR, ".v-dialog--active")))
-                                header = popup.find_element(By.CSS_SELECTOR, ".v-toolbar__title").text.strip()
-                                text_actions = [elem.text.strip() for elem in popup.find_elements(By.CSS_SELECTOR, ".text-action")]
-                                link_actions = popup.find_elements(By.CSS_SELECTOR, ".link-action")
-                                homework_links = [f"{link.text.strip()}: {link.get_attribute('href')}" for link in link_actions]
-                                for href in [l.split(': ')[1] for l in homework_links]:
-                                    if 'docs.google.com' in href or 'drive.google.com' in href:
-                                        is_accessible, result = check_doc_accessibility(href)
-                                        if not is_accessible:
-                                            log_message(f"Invalid homework link for lesson {lesson_number}: {result}")
-                                            lesson_has_error = True
-                                            has_errors = True
-                                    else:
-                                        response = requests.head(href, allow_redirects=True, timeout=10)
-                                        if response.status_code != 200:
-                                            log_message(f"Invalid homework link for lesson {lesson_number}: HTTP {response.status_code}")
-                                            lesson_has_error = True
-                                            has_errors = True
-                                homework_content = f"Homework Header: {header}\n" + ("Text:\n" + "\n".join(text_actions) + "\n" if text_actions else "") + ("Links:\n" + "\n".join(homework_links) if homework_links else "")
-                                log_message(f"Got homework for lesson {lesson_number}: {homework_content}")
-                                try:
-                                    popup.find_element(By.XPATH, ".//button[.//span[contains(text(), 'Cancel')]]").click()
-                                except:
-                                    driver.find_element(By.TAG_NAME, "body").send_keys(Keys.ESCAPE)
-                                time.sleep(2)
-                                break
-                            except Exception as e:
-                                if attempt == 2:
-                                    log_message(f"Error opening homework popup for lesson {lesson_number}: {str(e)}")
-                                    lesson_has_error = True
-                                    has_errors = True
-                                time.sleep(2)
-                    except Exception as e:
-                        log_message(f"Error getting homework for lesson {lesson_number}: {str(e)}")
-                        lesson_has_error = True
-                        has_errors = True
-                    row_data = [str(class_id), class_code, course_name, lesson_number, report_link, homework_content, "OK" if not lesson_has_error else "Has Errors"]
-                    processed[course_name][class_id]['last_lesson'] = lesson_index
-                    processed[course_name][class_id]['has_errors'] = has_errors
-                    save_processed(processed)
-                    if update_google_sheet(row_data, class_id, lesson_number) and is_git_repository():
+                    homework_links = []
+                    homework = captured_homework.get(lesson_number)
+                    homework_source = "captured response"
+                    if homework is None and session is not None and row['has_homework'] and lesson_number in captured_lessons:
                         try:
-                            subprocess.run(["git", "config", "--global", "user.name", "GitHub Action"], check=True)
-                            subprocess.run(["git", "config", "--global", "user.email", "action@github.com"], check=True)
-                            subprocess.run(["git", "add", PROCESSED_FILE], check=True)
-                            subprocess.run(["git", "commit", "-m", f"Update processed.json for Class ID {class_id}, Lesson {lesson_number}"], check=True)
-                            subprocess.run(["git", "push"], check=True)
-                            log_message(f"Pushed processed.json for Class ID {class_id}, Lesson {lesson_number}")
+                            homework = cec_api.get_homework(session, class_id, captured_lessons[lesson_number])
+                            homework_source = "API"
+                        except cec_api.CecApiError as e:
+                            log_message(f"API homework request failed for lesson {lesson_number}, opening popup: {str(e)}")
+                    if homework is not None:
+                        header, text_actions, homework_links = homework
+                        homework_content = format_homework_content(header, text_actions, homework_links)
+                        log_message(f"Got homework for lesson {lesson_number} from {homework_source}: {homework_content}")
+                    else:
+                        try:
+                            if not row['has_homework']:
+                                raise NoSuchElementException("No homework icon in row")
+                            for attempt in range(3):
+                                try:
+                                    if not cec_dom.click_row_icon(driver, row, cec_dom.HOMEWORK_ICON):
+                                        raise NoSuchElementException("Homework icon not found in row")
+                                    popup = WebDriverWait(driver, 30).until(EC.visibility_of_element_located((By.CSS_SELECTOR, ".v-dialog--active")))
+                                    header = popup.find_element(By.CSS_SELECTOR, ".v-toolbar__title").text.strip()
+                                    text_actions = [elem.text.strip() for elem in popup.find_elements(By.CSS_SELECTOR, ".text-action")]
+                                    link_actions = popup.find_elements(By.CSS_SELECTOR, ".link-action")
+                                    homework_links = [(link.text.strip(), link.get_attribute('href')) for link in link_actions]
+                                    homework_content = format_homework_content(header, text_actions, homework_links)
+                                    log_message(f"Got homework for lesson {lesson_number}: {homework_content}")
+                                    try:
+                                        popup.find_element(By.XPATH, ".//button[.//span[contains(text(), 'Cancel')]]").click()
+                                    except:
+                                        driver.find_element(By.TAG_NAME, "body").send_keys(Keys.ESCAPE)
+                                    time.sleep(2)
+                                    break
+                                except Exception as e:
+                                    if attempt == 2:
+                                        log_message(f"Error opening homework popup for lesson {lesson_number}: {str(e)}")
+                                        lesson_has_error = True
+                                        has_errors = True
+                                    time.sleep(2)
                         except Exception as e:
-                            log_message(f"Error committing/pushing processed.json for Class ID {class_id}, Lesson {lesson_number}: {str(e)}")
-                    processed_lessons.add(unique_id)
+                            log_message(f"Error getting homework for lesson {lesson_number}: {str(e)}")
+                            lesson_has_error = True
+                            has_errors = True
+                    pending.append(pending_lesson(lesson_index, lesson_number, report_link, homework_links, homework_content, lesson_has_error))
                     break
                 except StaleElementReferenceException:
                     retry_count += 1
                     log_message(f"Stale element in lesson {lesson_number}, retry {retry_count}/{max_retries}")
                     if retry_count == max_retries:
                         log_message(f"Failed lesson {lesson_number} after {max_retries} retries")
-                        lesson_has_error = True
-                        has_errors = True
-                        processed[course_name][class_id]['last_lesson'] = lesson_index
-                        processed[course_name][class_id]['has_errors'] = has_errors
-                        save_processed(processed)
+                        pending.append({'lesson_index': lesson_index, 'failed': True})
                         break
+                    lesson_rows = cec_dom.snapshot_lesson_table(driver)
+                    if lesson_index < len(lesson_rows):
+                        row = lesson_rows[lesson_index]
+        has_errors = finish_lessons(run, pending, class_id, class_code, course_name, processed, processed_lessons, has_errors)
         log_message(f"Completed Class ID {class_id} for course {course_name}")
         return has_errors
     except Exception as e:
         log_message(f"Error processing Class ID {class_id}: {str(e)}")
-        processed[course_name][class_id]['has_errors'] = True
-        save_processed(processed)
+        if pending:
+            finish_lessons(run, pending, class_id, class_code, course_name, processed, processed_lessons, True)
+        with STATE_LOCK:
+            known = class_id in processed.get(course_name, {})
+            if known:
+                processed[course_name][class_id]['has_errors'] = True
+        if known:
+            save_class(run, processed, course_name, class_id)
         return True
 
 def main():
+    run = start_run()
     try:
         df = pd.read_csv(CSV_FILE)
         df['Start date'] = pd.to_datetime(df['Start date'], dayfirst=True, errors='coerce')
@@ -313,13 +485,13 @@ def main():
     except Exception as e:
         log_message(f"Error reading CSV: {str(e)}")
         return
-    processed = {}
-    if os.path.exists(PROCESSED_FILE):
-        try:
-            with open(PROCESSED_FILE, 'r', encoding='utf-8') as f:
-                processed = json.load(f)
-        except Exception as e:
-            log_message(f"Error reading processed.json: {str(e)}")
+    try:
+        imported = run.state.import_processed_json(PROCESSED_FILE)
+        if imported:
+            log_message(f"Imported {imported} classes from processed.json into {run.state.path}")
+    except Exception as e:
+        log_message(f"Error reading processed.json: {str(e)}")
+    processed = run.state.load_classes()
     if 'GOOGLE_CREDENTIALS' in os.environ:
         try:
             creds_content = os.environ['GOOGLE_CREDENTIALS'].strip().encode('utf-8').decode('utf-8-sig')
@@ -332,55 +504,84 @@ def main():
     else:
         log_message("GOOGLE_CREDENTIALS environment variable not set")
         return
-    sheet_data = get_google_sheet_data()
-    processed_lessons = sync_processed_with_sheet(processed, sheet_data) if sheet_data else set()
-    if not sheet_data:
+    if run.sheet_index.row_count == 0:
+        sheet_data = get_google_sheet_data(run)
+        if sheet_data:
+            run.sheet_index.seed(sheet_data)
+            run.sheet_index.save()
+            log_message(f"Seeded Sheet index with {len(run.sheet_index)} keys from {len(sheet_data)} rows")
+    else:
+        try:
+            sheet_data = refresh_sheet_index(run)
+        except Exception as e:
+            log_message(f"Could not refresh Sheet index, using local index: {str(e)}")
+            sheet_data = []
+    if sheet_data:
+        sync_processed_with_sheet(run, processed, sheet_data)
+    if not len(run.sheet_index):
         log_message("Failed to retrieve Google Sheet data, proceeding with processed.json only")
-    options = webdriver.ChromeOptions()
-    options.add_argument("--headless")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0.0.0")
-    options.add_argument("--disable-autofill")
-    driver = webdriver.Chrome(service=webdriver.chrome.service.Service(ChromeDriverManager().install()), options=options)
-    try:
-        login(driver)
-        course_names = df['Course name'].unique()
-        max_classes_per_run = 50
-        classes_processed = 0
-        for course_name in course_names:
-            course_progress = processed.get(course_name, {})
-            course_group = df[df['Course name'] == course_name]
-            sorted_group = course_group.sort_values(by=['Start date', 'Rate'], ascending=[False, False])
-            class_ids = sorted_group['Class ID'].unique().tolist()
-            if not class_ids:
-                log_message(f"No class IDs found for course {course_name}")
+    processed_lessons = set(run.sheet_index.keys)
+    api_session = login_api()
+    course_names = df['Course name'].unique()
+    jobs = []
+    for course_name in course_names:
+        course_progress = processed.get(course_name, {})
+        course_group = df[df['Course name'] == course_name]
+        sorted_group = course_group.sort_values(by=['Start date', 'Rate'], ascending=[False, False])
+        class_ids = sorted_group['Class ID'].unique().tolist()
+        if not class_ids:
+            log_message(f"No class IDs found for course {course_name}")
+            continue
+        for class_id in class_ids:
+            if len(jobs) >= MAX_CLASSES_PER_RUN:
+                log_message(f"Reached limit of {MAX_CLASSES_PER_RUN} classes processed this run, stopping")
+                break
+            class_progress = course_progress.get(class_id, {'last_lesson': -1, 'total_lessons': 0})
+            csv_total_sessions = int(df[df['Class ID'] == class_id]['Total Sessions'].iloc[0]) if not df[df['Class ID'] == class_id].empty else 0
+            log_message(f"Class ID {class_id}: CSV Total Sessions={csv_total_sessions}, Processed last_lesson={class_progress['last_lesson']}, total_lessons={class_progress['total_lessons']}, Lessons in Sheet={[f'{class_id}:{i}' for i in range(1, csv_total_sessions + 1) if f'{class_id}:{i}' in processed_lessons]}")
+            # Check if all lessons are in Google Sheet
+            all_lessons_processed = csv_total_sessions > 0
+            if csv_total_sessions > 0:
+                for lesson in range(1, csv_total_sessions + 1):
+                    if f"{class_id}:{lesson}" not in processed_lessons:
+                        all_lessons_processed = False
+                        break
+            if all_lessons_processed:
+                log_message(f"Class ID {class_id} fully processed in Google Sheet, skipping")
                 continue
-            for class_id in class_ids:
-                if classes_processed >= max_classes_per_run:
-                    log_message(f"Reached limit of {max_classes_per_run} classes processed this run, stopping")
-                    break
-                class_progress = course_progress.get(class_id, {'last_lesson': -1, 'total_lessons': 0})
-                csv_total_sessions = int(df[df['Class ID'] == class_id]['Total Sessions'].iloc[0]) if not df[df['Class ID'] == class_id].empty else 0
-                log_message(f"Class ID {class_id}: CSV Total Sessions={csv_total_sessions}, Processed last_lesson={class_progress['last_lesson']}, total_lessons={class_progress['total_lessons']}, Lessons in Sheet={[f'{class_id}:{i}' for i in range(1, csv_total_sessions + 1) if f'{class_id}:{i}' in processed_lessons]}")
-                # Check if all lessons are in Google Sheet
-                all_lessons_processed = csv_total_sessions > 0
-                if csv_total_sessions > 0:
-                    for lesson in range(1, csv_total_sessions + 1):
-                        if f"{class_id}:{lesson}" not in processed_lessons:
-                            all_lessons_processed = False
-                            break
-                if all_lessons_processed:
-                    log_message(f"Class ID {class_id} fully processed in Google Sheet, skipping")
-                    continue
-                has_errors = process_class_id(driver, class_id, course_name, processed, sheet_data, processed_lessons, csv_total_sessions)
-                classes_processed += 1
-                log_message(f"{'Success' if not has_errors else 'Has errors'} for Class ID {class_id} in course {course_name}")
-        save_processed(processed)
+            jobs.append((course_name, class_id, csv_total_sessions))
+
+    def run_job(pool, job):
+        course_name, class_id, csv_total_sessions = job
+        if api_session:
+            try:
+                return process_class_id_api(run, api_session, class_id, course_name, processed, processed_lessons, csv_total_sessions)
+            except cec_api.CecApiError as e:
+                log_message(f"API path failed for Class ID {class_id}, falling back to Selenium: {str(e)}")
+        driver = pool.get_driver()
+        if not check_webdriver(driver):
+            pool.discard_driver()
+            driver = pool.get_driver()
+        return process_class_id(run, driver, class_id, course_name, processed, sheet_data, processed_lessons, csv_total_sessions, api_session)
+
+    log_message(f"Processing {len(jobs)} classes with {MAX_WORKERS} workers")
+    pool = BrowserPool(MAX_WORKERS, start_driver, log=log_message)
+    try:
+        for (course_name, class_id, _), has_errors in pool.map(run_job, jobs):
+            if isinstance(has_errors, Exception):
+                log_message(f"Worker failed for Class ID {class_id}: {str(has_errors)}")
+                has_errors = True
+            log_message(f"{'Success' if not has_errors else 'Has errors'} for Class ID {class_id} in course {course_name}")
+        save_processed(run, processed)
         log_message("Run completed")
     finally:
-        driver.quit()
+        pool.close()
+        run.sheets.close()
+        run.sheet_index.save()
+        log_message(run.link_cache.summary())
+        run.link_cache.close()
+        run.git_sync.sync()
+        run.state.close()
 
 if __name__ == "__main__":
     main()
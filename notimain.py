@@ -1,31 +1,41 @@
 import json
 import time
 import os
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import requests
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
-import subprocess
 from datetime import datetime
 from zoneinfo import ZoneInfo
-import pdfplumber
 import google.generativeai as genai
 from urllib.parse import parse_qs, urlparse
 from telegram import Bot
 import asyncio
 import re
 import socket
+import hashlib
+import session_cache
+import cec_dom
+from sheets_sink import SheetsSink
+from state_store import StateStore
+from pdf_fetch import download_pdf, pdf_size, NotPdfError
+import export_cache
+import llm_cache
+from gemini_models import get_catalog
+from gemini_quota import is_quota_error, QUOTA_RETRIES
+from pdf_extract import extract_pages, page_text_and_uris
+from git_sync import GitSync
 
 # Configuration
 PROCESSED_FILE = "processed2.json"
 CREDENTIALS_FILE = "credentials.json"
 SHEET_ID = "1-MMsbAGlg7MNbBPAzioqARu6QLfry5mCrWJ-Q_aqmIM"
 SHEET_NAME = "Report"
-REPORT_CONTENT_SHEET = "ReportContent"
+REPORT_CONTENT_SHEET = "ReportContent"  # Newest-first view of the latest reports
+REPORT_CONTENT_LATEST_FILE = "report_content_latest.json"
+REPORT_CONTENT_LATEST_COUNT = 5
 VOCAB_SHEET = "vocab"
 SCOPES = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -34,6 +44,7 @@ TELEGRAM_CHAT_ID_2 = os.getenv("TELEGRAM_CHAT_ID_2")
 API_KEY = os.getenv("GEMINI_API_KEY")
 LOG_FILE = "class_info_log2.txt"
 VOCAB_FILE = "vocab_total.json"
+VOCAB_SHEET_INDEX_FILE = "vocab_sheet_index.json"
 TODAY = datetime.now(tz=ZoneInfo("Asia/Ho_Chi_Minh")).replace(hour=0, minute=0, second=0, microsecond=0)
 
 # Logging function
@@ -43,6 +54,17 @@ def log_message(message):
     with open(LOG_FILE, "a", encoding="utf-8") as f:
         f.write(f"[{timestamp}] {message}\n")
 
+# Model preference, best first; the catalog reorders it by each model's recent health
+MODEL_PRIORITY = ['gemini-2.5-flash', 'gemini-2.5-pro', 'gemini-pro']
+
+# Pull the state files from the state branch first, then open the Sheet writer and state store that read them
+def start_run():
+    git_sync = GitSync([PROCESSED_FILE, LOG_FILE, VOCAB_FILE, "Report/*", "sheet_pending2.json", "vocab_sheet_index.json", "report_content_latest.json"],
+                       "Update report and vocab", log=log_message)
+    git_sync.prepare()
+    sheets = SheetsSink(CREDENTIALS_FILE, SHEET_ID, SCOPES, pending_file="sheet_pending2.json", log=log_message)
+    return git_sync, sheets, StateStore()
+
 # Check network connectivity
 def check_network():
     try:
@@ -61,14 +83,18 @@ def check_webdriver(driver):
         log_message(f"WebDriver unresponsive: {str(e)}")
         return False
 
-# Restart WebDriver
+# Restart WebDriver and restore the login (from the session cache when it is still valid)
 def restart_webdriver(driver, options):
     log_message("Restarting WebDriver")
     try:
         driver.quit()
     except:
         pass
-    return webdriver.Chrome(service=webdriver.chrome.service.Service(ChromeDriverManager().install()), options=options)
+    new_driver = webdriver.Chrome(service=webdriver.chrome.service.Service(ChromeDriverManager().install()), options=options)
+    new_driver.set_page_load_timeout(60)
+    new_driver.set_script_timeout(60)
+    login(new_driver)
+    return new_driver
 
 # Send basic Telegram notification
 def send_basic_notification(subject, body, chat_ids=[TELEGRAM_CHAT_ID, TELEGRAM_CHAT_ID_2]):
@@ -98,13 +124,16 @@ def send_basic_notification(subject, body, chat_ids=[TELEGRAM_CHAT_ID, TELEGRAM_
 
 # Login to the website
 def login(driver, max_retries=3):
-    log_message("Navigating to login page: https://apps.cec.com.vn/login")
-    driver.get("https://apps.cec.com.vn/login")
     current_id = os.getenv("NEW_CEC_USER")
     password = os.getenv("NEW_CEC_PASS")
     if not current_id or not password:
         log_message(f"Credentials missing: Username={current_id[:3] if current_id else 'None'}***, Password={'*' * len(password) if password else 'None'}")
         raise Exception("Missing credentials")
+    if session_cache.restore_driver_session(driver, current_id):
+        log_message("Restored cached CEC session, skipping login form")
+        return True
+    log_message("Navigating to login page: https://apps.cec.com.vn/login")
+    driver.get("https://apps.cec.com.vn/login")
 
     for attempt in range(max_retries):
         try:
@@ -132,6 +161,7 @@ def login(driver, max_retries=3):
                 EC.url_contains("login")
             )
             log_message("Login successful")
+            session_cache.save_driver_session(driver, current_id)
             return True
 
         except Exception as e:
@@ -153,118 +183,175 @@ def login(driver, max_retries=3):
             time.sleep(3)
     return False
 
+# Re-open the calendar popup for an event after a driver restart and return its report button
+def reopen_report_popup(driver, event):
+    driver.get("https://apps.cec.com.vn/student-calendar/overview")
+    cec_dom.install_window_open_shim(driver)
+    time.sleep(7)
+    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+    cec_dom.snapshot_events(driver)
+    cec_dom.click_event(driver, event)
+    time.sleep(3)
+    popup = WebDriverWait(driver, 10).until(
+        EC.visibility_of_element_located((By.XPATH, "//div[contains(@class, 'v-menu__content') and contains(@class, 'menuable__content__active')]"))
+    )
+    return popup.find_element(By.XPATH, "//button[.//p[text()='Báo cáo bài học']]")
+
 # Update Google Sheet (Report sheet)
-def update_google_sheet(date, class_name, report_url, timestamp):
-    log_message(f"Updating Google Sheet '{SHEET_NAME}' with Date {date}, Class {class_name}, URL {report_url}")
-    max_retries = 3
-    for attempt in range(max_retries):
+def update_google_sheet(sheets, date, class_name, report_url, timestamp):
+    log_message(f"Queueing row for Google Sheet '{SHEET_NAME}': Date {date}, Class {class_name}, URL {report_url}")
+    sheets.append(SHEET_NAME, [date, class_name, report_url, timestamp])
+    return True
+
+# Monthly append-only archive worksheet for a report date, e.g. "ReportContent 2025-10"
+def report_content_archive_sheet(date_str):
+    return f"{REPORT_CONTENT_SHEET} {date_str[:7]}"
+
+# Rewrite the small ReportContent view with the latest few report blocks, newest first
+def rotate_report_content_view(sheets, rows):
+    latest = []
+    if os.path.exists(REPORT_CONTENT_LATEST_FILE):
         try:
-            creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, SCOPES)
-            client = gspread.authorize(creds)
-            sheet = client.open_by_key(SHEET_ID)
-            worksheet = sheet.worksheet(SHEET_NAME)
-            row_data = [date, class_name, report_url, timestamp]
-            worksheet.append_row(row_data)
-            log_message(f"Updated Google Sheet '{SHEET_NAME}' successfully: {date}, {class_name}, {report_url} at {timestamp}")
-            return True
+            with open(REPORT_CONTENT_LATEST_FILE, 'r', encoding='utf-8') as f:
+                latest = json.load(f)
         except Exception as e:
-            log_message(f"Attempt {attempt+1}/{max_retries} failed to update Google Sheet '{SHEET_NAME}': {str(e)}")
-            if attempt == max_retries - 1:
-                log_message(f"Error updating Google Sheet '{SHEET_NAME}': {str(e)}")
-                return False
-            time.sleep(3)
-    return False
-
-# Update ReportContent sheet
-def update_report_content_sheet(extracted_data, class_name, date_str, lesson_title):
-    log_message(f"Updating Google Sheet '{REPORT_CONTENT_SHEET}' with extracted data")
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, SCOPES)
-            client = gspread.authorize(creds)
-            sheet = client.open_by_key(SHEET_ID)
-            worksheet = sheet.worksheet(REPORT_CONTENT_SHEET)
-            check_time = datetime.now(tz=ZoneInfo("Asia/Ho_Chi_Minh")).strftime("%Y-%m-%d %H:%M:%S")
-            vocab_list = [(k, v) for k, v in extracted_data['new_vocabulary'].items()]
-            sentence_list = [(k, v if isinstance(v, str) else '; '.join(v)) for k, v in extracted_data['sentence_structures'].items() if v]
-            link_list = extracted_data['links']
-            comments = extracted_data['student_comments_minh_huy'] or 'Không có nhận xét'
-            rows = [
-                ["----------", "", "", "", ""],
-                [f"Class: {class_name}", "", f"Date: {date_str}", "", f"Lesson: {lesson_title}"]
+            log_message(f"Error reading {REPORT_CONTENT_LATEST_FILE}: {str(e)}")
+    else:
+        # First rotation: keep the old insert-at-top history before the view is cleared
+        legacy_sheet = f"{REPORT_CONTENT_SHEET} legacy"
+        worksheet = sheets.worksheet(REPORT_CONTENT_SHEET)
+        if legacy_sheet not in [ws.title for ws in sheets.spreadsheet().worksheets()]:
+            sheets.throttle()
+            sheets.spreadsheet().duplicate_sheet(worksheet.id, new_sheet_name=legacy_sheet)
+            log_message(f"Copied existing '{REPORT_CONTENT_SHEET}' history to '{legacy_sheet}'")
+    latest = ([rows] + latest)[:REPORT_CONTENT_LATEST_COUNT]
+    view_rows = [row for block in latest for row in block]
+    sheets.replace_range(REPORT_CONTENT_SHEET, "A2", view_rows, "E")
+    with open(REPORT_CONTENT_LATEST_FILE, 'w', encoding='utf-8') as f:
+        json.dump(latest, f, ensure_ascii=False)
+
+# Update ReportContent: append the block to the monthly archive, then rotate the latest view
+def update_report_content_sheet(sheets, extracted_data, class_name, date_str, lesson_title):
+    archive_sheet = report_content_archive_sheet(date_str)
+    log_message(f"Updating Google Sheet '{archive_sheet}' and '{REPORT_CONTENT_SHEET}' with extracted data")
+    try:
+        check_time = datetime.now(tz=ZoneInfo("Asia/Ho_Chi_Minh")).strftime("%Y-%m-%d %H:%M:%S")
+        vocab_list = [(k, v) for k, v in extracted_data['new_vocabulary'].items()]
+        sentence_list = [(k, v if isinstance(v, str) else '; '.join(v)) for k, v in extracted_data['sentence_structures'].items() if v]
+        link_list = extracted_data['links']
+        comments = extracted_data['student_comments_minh_huy'] or 'Không có nhận xét'
+        rows = [
+            ["----------", "", "", "", ""],
+            [f"Class: {class_name}", "", f"Date: {date_str}", "", f"Lesson: {lesson_title}"]
+        ]
+        if link_list:
+            rows.append([f"Links: {'; '.join(link_list)}", "", "", "", ""])
+        rows.append([f"Check Time: {check_time}", "", "", "", ""])
+        rows.append([f"Comments about Minh Huy: {comments}", "", "", "", ""])
+        num_rows = max(len(vocab_list), len(sentence_list), 1)
+        for i in range(num_rows):
+            row = [
+                vocab_list[i][0] if i < len(vocab_list) else "",
+                vocab_list[i][1] if i < len(vocab_list) else "",
+                f"{sentence_list[i][0]}:{sentence_list[i][1]}" if i < len(sentence_list) else "",
+                "",
+                ""
             ]
-            if link_list:
-                rows.append([f"Links: {'; '.join(link_list)}", "", "", "", ""])
-            rows.append([f"Check Time: {check_time}", "", "", "", ""])
-            rows.append([f"Comments about Minh Huy: {comments}", "", "", "", ""])
-            num_rows = max(len(vocab_list), len(sentence_list), 1)
-            for i in range(num_rows):
-                row = [
-                    vocab_list[i][0] if i < len(vocab_list) else "",
-                    vocab_list[i][1] if i < len(vocab_list) else "",
-                    f"{sentence_list[i][0]}:{sentence_list[i][1]}" if i < len(sentence_list) else "",
-                    "",
-                    ""
-                ]
-                rows.append(row)
-            worksheet.insert_rows(rows, row=2)
-            log_message(f"Inserted {len(rows)} rows to '{REPORT_CONTENT_SHEET}' after header")
-            return True
-        except Exception as e:
-            log_message(f"Attempt {attempt+1}/{max_retries} failed to update Google Sheet '{REPORT_CONTENT_SHEET}': {str(e)}")
-            if attempt == max_retries - 1:
-                log_message(f"Error updating Google Sheet '{REPORT_CONTENT_SHEET}': {str(e)}")
-                return False
-            time.sleep(3)
-    return False
+            rows.append(row)
+        sheets.ensure_worksheet(archive_sheet, cols=5)
+        sheets.append_rows(archive_sheet, rows)
+        log_message(f"Queued {len(rows)} rows for '{archive_sheet}'")
+        rotate_report_content_view(sheets, rows)
+        log_message(f"Rotated '{REPORT_CONTENT_SHEET}' view with the latest {REPORT_CONTENT_LATEST_COUNT} reports")
+        return True
+    except Exception as e:
+        log_message(f"Error updating Google Sheet '{REPORT_CONTENT_SHEET}': {str(e)}")
+        return False
 
-# Update vocab sheet
-def update_vocab_sheet(total_vocab):
-    log_message(f"Updating Google Sheet '{VOCAB_SHEET}' with total vocabulary")
-    max_retries = 3
-    for attempt in range(max_retries):
+# Hash of a vocab sheet row, used to tell whether a word's row needs rewriting
+def vocab_row_hash(word, meaning):
+    return hashlib.sha1(f"{word}\t{meaning}".encode('utf-8')).hexdigest()[:12]
+
+# Word -> {row, hash} of what is already in the vocab sheet; seeded from one read if the local copy is missing
+def load_vocab_sheet_index(sheets, worksheet):
+    if os.path.exists(VOCAB_SHEET_INDEX_FILE):
         try:
-            creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, SCOPES)
-            client = gspread.authorize(creds)
-            sheet = client.open_by_key(SHEET_ID)
-            worksheet = sheet.worksheet(VOCAB_SHEET)
-            worksheet.clear()
-            worksheet.append_row(["Word", "Meaning"])
-            vocab_rows = [[item['word'], item['meaning']] for item in total_vocab if isinstance(item, dict)]
-            if vocab_rows:
-                worksheet.append_rows(vocab_rows)
-            log_message(f"Updated Google Sheet '{VOCAB_SHEET}' successfully with {len(vocab_rows)} vocabulary entries")
-            return True
+            with open(VOCAB_SHEET_INDEX_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
         except Exception as e:
-            log_message(f"Attempt {attempt+1}/{max_retries} failed to update Google Sheet '{VOCAB_SHEET}': {str(e)}")
-            if attempt == max_retries - 1:
-                log_message(f"Error updating Google Sheet '{VOCAB_SHEET}': {str(e)}")
-                return False
-            time.sleep(3)
-    return False
+            log_message(f"Error reading {VOCAB_SHEET_INDEX_FILE}: {str(e)}. Re-reading '{VOCAB_SHEET}'")
+    values = sheets.call(f"read Google Sheet '{VOCAB_SHEET}'", lambda: worksheet.get_all_values())
+    index = {"row_count": len(values), "words": {}}
+    for row_number, row in enumerate(values[1:], start=2):
+        if row and row[0]:
+            index["words"][row[0].lower()] = {"row": row_number, "hash": vocab_row_hash(row[0], row[1] if len(row) > 1 else "")}
+    log_message(f"Seeded vocab sheet index from '{VOCAB_SHEET}': {len(index['words'])} words")
+    return index
+
+def save_vocab_sheet_index(index):
+    with open(VOCAB_SHEET_INDEX_FILE, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+
+# Update vocab sheet with only the words that are new or whose meaning changed
+def update_vocab_sheet(sheets, total_vocab):
+    log_message(f"Updating Google Sheet '{VOCAB_SHEET}' with changed vocabulary")
+    try:
+        worksheet = sheets.worksheet(VOCAB_SHEET)
+        index = load_vocab_sheet_index(sheets, worksheet)
+        wanted = {}
+        for item in total_vocab:
+            if isinstance(item, dict) and item.get('word'):
+                current = wanted.get(item['word'].lower())
+                if current is None or item.get('meaning') or not current[1]:
+                    wanted[item['word'].lower()] = (item['word'], item.get('meaning', ''))
+        updates = []
+        appends = []
+        for key, (word, meaning) in wanted.items():
+            known = index["words"].get(key)
+            if known is None:
+                appends.append((key, [word, meaning]))
+            elif known["hash"] != vocab_row_hash(word, meaning):
+                updates.append({"range": f"A{known['row']}:B{known['row']}", "values": [[word, meaning]]})
+                known["hash"] = vocab_row_hash(word, meaning)
+        if not updates and not appends:
+            log_message(f"Google Sheet '{VOCAB_SHEET}' already up to date")
+            return True
+        if updates:
+            sheets.batch_update(VOCAB_SHEET, updates)
+        if appends:
+            values = [row for _, row in appends]
+            if index["row_count"] == 0:
+                values = [["Word", "Meaning"]] + values
+            response = sheets.call(f"append {len(values)} rows to '{VOCAB_SHEET}'", lambda: sheets.spreadsheet().values_append(
+                f"'{VOCAB_SHEET}'!A1",
+                params={"valueInputOption": "RAW", "insertDataOption": "INSERT_ROWS"},
+                body={"values": values}
+            ))
+            updated_range = response.get("updates", {}).get("updatedRange", "")
+            match = re.search(r"!A(\d+)", updated_range)
+            first_row = int(match.group(1)) if match else index["row_count"] + 1
+            if index["row_count"] == 0:
+                first_row += 1
+            for offset, (key, (word, meaning)) in enumerate(appends):
+                index["words"][key] = {"row": first_row + offset, "hash": vocab_row_hash(word, meaning)}
+            index["row_count"] = first_row + len(appends) - 1
+        save_vocab_sheet_index(index)
+        log_message(f"Updated Google Sheet '{VOCAB_SHEET}': {len(appends)} new words, {len(updates)} changed meanings")
+        return True
+    except Exception as e:
+        log_message(f"Error updating Google Sheet '{VOCAB_SHEET}': {str(e)}")
+        return False
 
-# Save processed data
-def save_processed(date, class_name, report_url):
+# Save processed data: one row per report in the state store, latest report exported to the legacy file
+def save_processed(state, date, class_name, report_url, analysed=True):
     log_message(f"Saving processed data to {PROCESSED_FILE}")
-    processed = {"date": date, "class_name": class_name, "report_url": report_url}
     try:
-        with open(PROCESSED_FILE, 'w', encoding='utf-8') as f:
-            json.dump(processed, f, indent=2)
+        state.save_report(date, class_name, report_url, analysed)
+        state.export_report_json(PROCESSED_FILE)
         log_message(f"Saved {PROCESSED_FILE} successfully")
     except Exception as e:
         log_message(f"Error saving {PROCESSED_FILE}: {str(e)}")
 
-# Check if in a git repository
-def is_git_repository():
-    try:
-        subprocess.run(["git", "rev-parse", "--is-inside-work-tree"], check=True, capture_output=True, text=True)
-        log_message("Git repository detected")
-        return True
-    except Exception as e:
-        log_message(f"Not a git repository: {str(e)}")
-        return False
-
 # Escape MarkdownV2 characters
 def escape_markdown_v2(text):
     special_chars = r'([_*[\](){}~`>#+=|.!-])'
@@ -321,23 +408,10 @@ async def send_detailed_telegram_message(bot, chat_id, result_data):
         log_message(f"Failed to send detailed Telegram messages to chat_id {chat_id}: {str(e)}")
         raise
 
-# Get available Gemini model
-def get_available_model(attempt=0):
-    try:
-        models = genai.list_models()
-        available_models = [model.name for model in models if 'generateContent' in model.supported_generation_methods]
-        log_message(f"Available models: {available_models}")
-        for model in available_models:
-            if attempt == 0 and 'gemini-2.5-flash' in model:
-                return model
-            if attempt == 1 and 'gemini-2.5-pro' in model:
-                return model
-            if attempt == 2 and 'gemini-pro' in model:
-                return model
-        return available_models[0] if available_models else None
-    except Exception as e:
-        log_message(f"Failed to list models: {str(e)}")
-        return None
+# Available Gemini model not yet tried for this report that has quota budget soonest, healthiest first
+# (catalog fetched once per TTL)
+def get_available_model(tried=(), content=None):
+    return get_catalog(log=log_message).choose(MODEL_PRIORITY, tried, content)
 
 # Fix invalid report date
 def fix_report_date(date_str, fallback_date):
@@ -380,20 +454,19 @@ def clean_response_text(text):
     return text
 
 # Main processing function
-def process_report():
+def process_report(git_sync, sheets, state):
+    models = get_catalog(log=log_message)
     log_message("Starting report check for calendar overview")
     if not check_network():
         log_message("Network unavailable, aborting process")
         return
 
-    processed = {}
-    if os.path.exists(PROCESSED_FILE):
-        try:
-            with open(PROCESSED_FILE, 'r', encoding='utf-8') as f:
-                processed = json.load(f)
-            log_message(f"Loaded {PROCESSED_FILE}: {processed}")
-        except Exception as e:
-            log_message(f"Error reading {PROCESSED_FILE}: {str(e)}")
+    try:
+        if state.import_report_json(PROCESSED_FILE):
+            log_message(f"Imported {PROCESSED_FILE} into {state.path}")
+        log_message(f"Latest processed report: {state.latest_report()}")
+    except Exception as e:
+        log_message(f"Error reading {PROCESSED_FILE}: {str(e)}")
 
     if 'GOOGLE_CREDENTIALS' in os.environ:
         try:
@@ -427,21 +500,20 @@ def process_report():
 
         log_message("Navigating to calendar overview page: https://apps.cec.com.vn/student-calendar/overview")
         driver.get("https://apps.cec.com.vn/student-calendar/overview")
+        cec_dom.install_window_open_shim(driver)
         time.sleep(7)
         if not check_webdriver(driver):
             driver = restart_webdriver(driver, options)
         driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
         log_message("Scrolled to bottom of page")
 
-        class_events = WebDriverWait(driver, 30).until(
-            EC.presence_of_all_elements_located((By.XPATH, "//div[contains(@class, 'v-event') and @data-date]"))
-        )
+        class_events = cec_dom.snapshot_events(driver)
         log_message(f"Found {len(class_events)} class events")
 
         latest_date = None
         latest_event = None
         for event in class_events:
-            date_str = event.get_attribute("data-date")
+            date_str = event["date"]
             try:
                 event_date = datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=ZoneInfo("Asia/Ho_Chi_Minh"))
                 if event_date < TODAY and (latest_date is None or event_date > latest_date):
@@ -458,7 +530,7 @@ def process_report():
         date_str = latest_date.strftime("%Y-%m-%d")
         log_message(f"Latest class date before today: {date_str}")
 
-        driver.execute_script("arguments[0].click();", latest_event)
+        cec_dom.click_event(driver, latest_event)
         time.sleep(3)
 
         popup = WebDriverWait(driver, 10).until(
@@ -469,18 +541,22 @@ def process_report():
         class_name = title_text.split(" : ")[-1] if " : " in title_text else "Unknown"
         log_message(f"Class name from popup: {class_name}")
 
-        if (processed.get("date") == date_str and
-                processed.get("class_name") == class_name and
-                processed.get("report_url")):
-            log_message(f"Class {class_name} on {date_str} already processed with report URL: {processed['report_url']}")
+        report = state.get_report(date_str, class_name)
+        if report and report['analysed']:
+            log_message(f"Class {class_name} on {date_str} already processed with report URL: {report['report_url']}")
             return
 
-        report_button = popup.find_element(By.XPATH, "//button[.//p[text()='Báo cáo bài học']]")
-        is_enabled = "v-btn--disabled" not in report_button.get_attribute("class") and report_button.is_enabled()
-
-        if is_enabled:
+        if report:
+            # Notified and recorded by an earlier run whose analysis did not finish
+            report_url = report['report_url']
+            log_message(f"Report for {class_name} on {date_str} is not analysed yet, retrying with {report_url}")
+        else:
+            report_button = popup.find_element(By.XPATH, "//button[.//p[text()='Báo cáo bài học']]")
+            is_enabled = "v-btn--disabled" not in report_button.get_attribute("class") and report_button.is_enabled()
+            if not is_enabled:
+                log_message("Report button is disabled")
+                return
             log_message("Report button is enabled, clicking to get report URL")
-            original_window = driver.current_window_handle
             max_window_retries = 3
             report_url = None
         
@@ -489,291 +565,262 @@ def process_report():
                     if not check_webdriver(driver):
                         log_message("WebDriver unresponsive before clicking report button, restarting")
                         driver = restart_webdriver(driver, options)
-                        # Re-navigate to calendar page and re-open popup
-                        driver.get("https://apps.cec.com.vn/student-calendar/overview")
-                        time.sleep(7)
-                        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                        driver.execute_script("arguments[0].click();", latest_event)
-                        time.sleep(3)
-                        popup = WebDriverWait(driver, 10).until(
-                            EC.visibility_of_element_located((By.XPATH, "//div[contains(@class, 'v-menu__content') and contains(@class, 'menuable__content__active')]"))
-                        )
-                        report_button = popup.find_element(By.XPATH, "//button[.//p[text()='Báo cáo bài học']]")
+                        report_button = reopen_report_popup(driver, latest_event)
         
                     log_message(f"Attempt {attempt + 1}/{max_window_retries} to click report button")
-                    report_button.click()
-        
-                    # Wait for new window to open
-                    WebDriverWait(driver, 15).until(
-                        lambda d: len(d.window_handles) > len([original_window])
-                    )
-                    for window_handle in driver.window_handles:
-                        if window_handle != original_window:
-                            driver.switch_to.window(window_handle)
-                            break
-        
-                    # Wait for the new window to load
-                    WebDriverWait(driver, 60).until(
-                        EC.url_contains("docs.google.com")
-                    )
-                    report_url = driver.current_url
+                    report_url = cec_dom.capture_opened_url(driver, report_button.click, timeout=15)
+                    if not report_url:
+                        raise Exception("Report button did not open a link")
+                    if "docs.google.com" not in report_url:
+                        resolved_url = cec_dom.resolve_redirect(driver, report_url, "docs.google.com")
+                        if not resolved_url:
+                            raise Exception(f"Report link {report_url} did not lead to Google Docs")
+                        report_url = resolved_url
                     log_message(f"Report URL: {report_url}")
                     break
                 except Exception as e:
-                    log_message(f"Window switch attempt {attempt + 1}/{max_window_retries} failed: {str(e)}")
+                    log_message(f"Report URL attempt {attempt + 1}/{max_window_retries} failed: {str(e)}")
                     if attempt == max_window_retries - 1:
-                        log_message("Max retries reached for window switch")
+                        log_message("Max retries reached for report URL")
                         raise Exception(f"Failed to retrieve report URL after {max_window_retries} attempts: {str(e)}")
                     # Restart WebDriver if unresponsive
                     if "connection refused" in str(e).lower() or "timeout" in str(e).lower():
                         driver = restart_webdriver(driver, options)
-                        # Re-navigate to calendar page
-                        driver.get("https://apps.cec.com.vn/student-calendar/overview")
-                        time.sleep(7)
-                        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                        driver.execute_script("arguments[0].click();", latest_event)
-                        time.sleep(3)
-                        popup = WebDriverWait(driver, 10).until(
-                            EC.visibility_of_element_located((By.XPATH, "//div[contains(@class, 'v-menu__content') and contains(@class, 'menuable__content__active')]"))
-                        )
-                        report_button = popup.find_element(By.XPATH, "//button[.//p[text()='Báo cáo bài học']]")
+                        report_button = reopen_report_popup(driver, latest_event)
                     time.sleep(5)  # Wait longer before retrying
         
-            if report_url:
-                timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-                body = f"Báo cáo bài học mới cho lớp {class_name} ngày {date_str}\nLink: {report_url}"
-                send_basic_notification("Có Báo cáo bài học mới!", body)
-                update_google_sheet(date_str, class_name, report_url, timestamp)
-                save_processed(date_str, class_name, report_url)
-
-                if is_git_repository():
-                    log_message("Committing and pushing changes to GitHub")
-                    try:
-                        subprocess.run(["git", "config", "--global", "user.name", "GitHub Action"], check=True)
-                        subprocess.run(["git", "config", "--global", "user.email", "action@github.com"], check=True)
-                        subprocess.run(["git", "add", PROCESSED_FILE, LOG_FILE], check=True)
-                        subprocess.run(["git", "commit", "-m", f"Update {PROCESSED_FILE} and {LOG_FILE} for {date_str}"], check=True)
-                        subprocess.run(["git", "push"], check=True)
-                        log_message(f"Pushed {PROCESSED_FILE} and {LOG_FILE} successfully")
-                    except Exception as e:
-                        log_message(f"Error committing/pushing: {str(e)}")
-
-                driver.close()
-                driver.switch_to.window(original_window)
-
-                # Segment B: Process the report PDF
-                log_message("Starting PDF processing for report analysis")
-                if not API_KEY:
-                    log_message("Missing GEMINI_API_KEY, skipping PDF processing. Please set GEMINI_API_KEY in environment variables.")
-                    return
-
-                genai.configure(api_key=API_KEY)
-                log_message(f"Extracting direct PDF URL from {report_url}")
-                parsed_url = urlparse(report_url)
-                query_params = parse_qs(parsed_url.query)
-                direct_pdf_url = query_params.get('url', [None])[0]
-
-                if not direct_pdf_url:
-                    log_message("Could not extract direct PDF URL from Google Docs viewer")
-                    return
-
-                pdf_path = 'temp_report.pdf'
-                log_message(f"Downloading PDF from {direct_pdf_url}")
-                try:
-                    response = requests.get(direct_pdf_url, timeout=10)
-                    response.raise_for_status()
-                    content_type = response.headers.get('content-type', '')
-                    if 'application/pdf' not in content_type:
-                        log_message(f"Downloaded file is not a PDF (Content-Type: {content_type})")
-                        return
-                    with open(pdf_path, 'wb') as f:
-                        f.write(response.content)
-                    log_message(f"Successfully downloaded PDF to {pdf_path}")
-                except requests.RequestException as e:
-                    log_message(f"Failed to download PDF: {str(e)}")
-                    return
-
-                pdf_text = ''
-                pdf_links = []
-                log_message("Extracting text and links from PDF")
-                try:
-                    with pdfplumber.open(pdf_path) as pdf:
-                        for page in pdf.pages:
-                            text = page.extract_text()
-                            pdf_text += text or ''
-                            if page.annots:
-                                for annot in page.annots:
-                                    if 'uri' in annot:
-                                        pdf_links.append(annot['uri'])
-                    log_message(f"Extracted {len(pdf_text)} characters and {len(pdf_links)} links from PDF")
-                except Exception as e:
-                    log_message(f"Failed to extract text or links from PDF: {str(e)}")
-                    os.remove(pdf_path)
-                    return
-                finally:
-                    if os.path.exists(pdf_path):
-                        os.remove(pdf_path)
-                        log_message(f"Deleted temporary PDF file: {pdf_path}")
-
-                if not pdf_text:
-                    log_message("No text extracted from PDF")
-                    return
-
-                system_prompt = """
-                You are an AI extractor that **must** output in strict JSON format with no extra text, comments, or markdown. The output must be a valid JSON object. Do not wrap the JSON in code blocks or add any explanation. If you cannot extract information, return "cannot find info" for strings or {} or [] for objects/arrays.
-                Extract from the given text:
-                {
-                  "new_vocabulary": {},  // Dictionary of new English words/phrases (key: word/phrase in lowercase, value: meaning in Vietnamese, must not be empty)
-                  "sentence_structures": {},  // Dictionary of question-answer pairs (key: question, value: answer or list of answers if multiple, no null values)
-                  "report_date": "",  // Report date in YYYY-MM-DD (if not found, use date from input JSON)
-                  "lesson_title": "",  // Lesson title (if not found, "cannot find info")
-                  "homework": "",  // Homework description with any associated links (if not found, "cannot find info")
-                  "links": [],  // List of all URLs found in the content (e.g., homework links, YouTube videos)
-                  "student_comments_minh_huy": ""  // Comments about student Minh Huy (if not found, "cannot find info")
-                }
-                For new_vocabulary, provide meanings in Vietnamese (e.g., {"pen": "cái bút"}). Every word must have a non-empty meaning. For missing meanings, use a default dictionary (e.g., "pot": "cái nồi").
-                For sentence_structures, map questions to answers (e.g., {"What is this?": "It's a pen."} or {"What are they?": ["They are scissors.", "They are books."]}). If no sentence structures found, return {}.
-                Include all URLs (e.g., YouTube, Google Drive, Quizlet) in the links field, especially those related to homework.
-                Use date from input JSON if report_date is not found in text.
-                Ensure the output is a valid JSON object with all required fields.
-                """
-
-                max_attempts = 3
-                extracted_data = None
-                best_response = None
-                for attempt in range(max_attempts):
-                    log_message(f"Gemini API attempt {attempt + 1}/{max_attempts}")
-                    model_name = get_available_model(attempt)
-                    if not model_name:
-                        log_message("No suitable model found. Using default response.")
-                        break
-                    log_message(f"Using model: {model_name}")
-                    try:
-                        model = genai.GenerativeModel(model_name, system_instruction=system_prompt)
-                        response = model.generate_content(pdf_text)
-                        cleaned_text = clean_response_text(response.text)
-                        cleaned_text = fix_invalid_json(cleaned_text)
-                        log_message(f"Received API response (attempt {attempt + 1}): {cleaned_text[:100]}...")
-                        extracted_data = json.loads(cleaned_text)
-                        extracted_data['links'] = list(set(extracted_data.get('links', []) + pdf_links))
-                        extracted_data['report_date'] = fix_report_date(extracted_data.get('report_date', date_str), date_str)
-                        for word in extracted_data['new_vocabulary']:
-                            if not extracted_data['new_vocabulary'][word]:
-                                extracted_data['new_vocabulary'][word] = {
-                                    "pot": "cái nồi"
-                                }.get(word, "nghĩa không xác định")
-                        extracted_data['sentence_structures'] = {
-                            k: v for k, v in extracted_data['sentence_structures'].items()
-                            if v is not None and (isinstance(v, str) or (isinstance(v, list) and all(isinstance(x, str) for x in v)))
-                        }
-                        if best_response is None or len(extracted_data.get('new_vocabulary', {})) > len(best_response.get('new_vocabulary', {})):
-                            best_response = extracted_data
-                        log_message(f"API attempt {attempt + 1} successful")
-                        break
-                    except Exception as e:
-                        log_message(f"API attempt {attempt + 1}/{max_attempts} failed: {str(e)}")
-                        if attempt == max_attempts - 1:
-                            log_message("All API attempts failed. Using best response or default.")
-                            extracted_data = best_response or {
-                                "new_vocabulary": {"pot": "cái nồi"},
-                                "sentence_structures": {},
-                                "report_date": date_str,
-                                "lesson_title": "cannot find info",
-                                "homework": "cannot find info",
-                                "links": pdf_links,
-                                "student_comments_minh_huy": "cannot find info"
-                            }
-
-                update_report_content_sheet(extracted_data, class_name, date_str, extracted_data['lesson_title'])
-
-                log_message("Processing total vocabulary")
-                if os.path.exists(VOCAB_FILE):
-                    try:
-                        with open(VOCAB_FILE, 'r', encoding='utf-8') as f:
-                            vocab_data = json.load(f)
-                            if isinstance(vocab_data, dict) and 'vocabulary' in vocab_data:
-                                total_vocab = vocab_data['vocabulary']
-                            elif isinstance(vocab_data, list) and all(isinstance(item, str) for item in vocab_data):
-                                total_vocab = [{"word": word, "meaning": ""} for word in vocab_data]
-                            else:
-                                total_vocab = []
-                        log_message(f"Loaded existing vocabulary from {VOCAB_FILE}: {len(total_vocab)} entries")
-                    except Exception as e:
-                        log_message(f"Error reading {VOCAB_FILE}: {str(e)}. Starting with empty vocab.")
-                        total_vocab = []
-                else:
-                    log_message(f"{VOCAB_FILE} does not exist. Starting with empty vocab.")
-                    total_vocab = []
-
-                new_vocab = extracted_data['new_vocabulary']
-                new_vocab_lower = {k.lower(): v for k, v in new_vocab.items()}
-                total_vocab_lower = {item['word'].lower(): item['meaning'] for item in total_vocab if isinstance(item, dict)}
-                added_vocab = [
-                    {"word": k, "meaning": v}
-                    for k, v in new_vocab.items()
-                    if k.lower() not in total_vocab_lower or total_vocab_lower.get(k.lower(), '') == ''
-                ]
-                total_vocab.extend(added_vocab)
-                log_message(f"Added {len(added_vocab)} new vocabulary entries. Total vocabulary: {len(total_vocab)}")
-
-                log_message(f"Saving updated vocabulary to {VOCAB_FILE}")
-                with open(VOCAB_FILE, 'w', encoding='utf-8') as f:
-                    json.dump({'vocabulary': total_vocab}, f, ensure_ascii=False, indent=4)
-                log_message(f"Successfully saved {VOCAB_FILE}")
-
-                update_vocab_sheet(total_vocab)
-
-                log_message("Creating Report directory if not exists")
-                os.makedirs('Report', exist_ok=True)
-                title = extracted_data['lesson_title'].replace(' ', '_') if extracted_data['lesson_title'] else 'unknown'
-                result_filename = f"Report/{date_str}_{title}.json"
-
-                result_data = {
-                    **extracted_data,
-                    'class_name': class_name,
-                    'report_url': report_url,
-                    'total_vocabulary': total_vocab
-                }
+            timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+            body = f"Báo cáo bài học mới cho lớp {class_name} ngày {date_str}\nLink: {report_url}"
+            send_basic_notification("Có Báo cáo bài học mới!", body)
+            update_google_sheet(sheets, date_str, class_name, report_url, timestamp)
+            save_processed(state, date_str, class_name, report_url, analysed=False)
+            git_sync.note(f"Report URL for {class_name} on {date_str}")
+
+        # Segment B: Process the report PDF
+        log_message("Starting PDF processing for report analysis")
+        if not API_KEY:
+            log_message("Missing GEMINI_API_KEY, skipping PDF processing. Please set GEMINI_API_KEY in environment variables.")
+            return
 
-                log_message(f"Saving result to {result_filename}")
-                with open(result_filename, 'w', encoding='utf-8') as f:
-                    json.dump(result_data, f, ensure_ascii=False, indent=4)
-                log_message(f"Successfully saved: {result_filename}")
-
-                async def send_report_to_telegram():
-                    log_message("Initializing Telegram Bot for detailed messages")
-                    bot = Bot(token=TELEGRAM_BOT_TOKEN)
-                    for chat_id in [TELEGRAM_CHAT_ID, TELEGRAM_CHAT_ID_2]:
-                        if chat_id:
-                            log_message(f"Sending detailed Telegram messages to chat_id {chat_id}")
-                            await send_detailed_telegram_message(bot, chat_id, result_data)
-                            log_message(f"Completed sending detailed messages to chat_id {chat_id}")
-
-                log_message("Starting detailed Telegram notifications")
-                asyncio.run(send_report_to_telegram())
-                log_message("Completed detailed Telegram notifications")
-
-                if is_git_repository():
-                    log_message("Committing and pushing Report and vocab files to GitHub")
-                    try:
-                        subprocess.run(["git", "config", "--global", "user.name", "GitHub Action"], check=True)
-                        subprocess.run(["git", "config", "--global", "user.email", "action@github.com"], check=True)
-                        subprocess.run(["git", "add", PROCESSED_FILE, LOG_FILE, VOCAB_FILE, "Report/*"], check=True)
-                        subprocess.run(["git", "commit", "-m", f"Update report and vocab for {date_str}"], check=True)
-                        subprocess.run(["git", "push"], check=True)
-                        log_message(f"Pushed {PROCESSED_FILE}, {LOG_FILE}, {VOCAB_FILE}, and Report/* successfully")
-                    except Exception as e:
-                        log_message(f"Error committing/pushing Report and vocab files: {str(e)}")
+        genai.configure(api_key=API_KEY)
+        log_message(f"Extracting direct PDF URL from {report_url}")
+        parsed_url = urlparse(report_url)
+        query_params = parse_qs(parsed_url.query)
+        direct_pdf_url = query_params.get('url', [None])[0]
 
+        if not direct_pdf_url:
+            log_message("Could not extract direct PDF URL from Google Docs viewer")
+            return
+
+        log_message(f"Downloading PDF from {direct_pdf_url}")
+        try:
+            pdf_file = download_pdf(direct_pdf_url)
+            log_message(f"Successfully downloaded PDF ({pdf_size(pdf_file)} bytes)")
+        except NotPdfError as e:
+            log_message(str(e))
+            return
+        except requests.RequestException as e:
+            log_message(f"Failed to download PDF: {str(e)}")
+            return
+
+        pdf_text = ''
+        pdf_links = []
+        log_message("Extracting text and links from PDF")
+        try:
+            pages, errors, _ = extract_pages(pdf_file, page_text_and_uris, max_pages=0)
+            for number, error in errors:
+                log_message(f"Failed to process page {number + 1}: {error}")
+            for text, uris in filter(None, pages):
+                pdf_text += text
+                pdf_links.extend(uris)
+            log_message(f"Extracted {len(pdf_text)} characters and {len(pdf_links)} links from PDF")
+        except Exception as e:
+            log_message(f"Failed to extract text or links from PDF: {str(e)}")
+            return
+        finally:
+            pdf_file.close()
+
+        if not pdf_text:
+            log_message("No text extracted from PDF")
+            return
+
+        system_prompt = """
+        You are an AI extractor that **must** output in strict JSON format with no extra text, comments, or markdown. The output must be a valid JSON object. Do not wrap the JSON in code blocks or add any explanation. If you cannot extract information, return "cannot find info" for strings or {} or [] for objects/arrays.
+        Extract from the given text:
+        {
+          "new_vocabulary": {},  // Dictionary of new English words/phrases (key: word/phrase in lowercase, value: meaning in Vietnamese, must not be empty)
+          "sentence_structures": {},  // Dictionary of question-answer pairs (key: question, value: answer or list of answers if multiple, no null values)
+          "report_date": "",  // Report date in YYYY-MM-DD (if not found, use date from input JSON)
+          "lesson_title": "",  // Lesson title (if not found, "cannot find info")
+          "homework": "",  // Homework description with any associated links (if not found, "cannot find info")
+          "links": [],  // List of all URLs found in the content (e.g., homework links, YouTube videos)
+          "student_comments_minh_huy": ""  // Comments about student Minh Huy (if not found, "cannot find info")
+        }
+        For new_vocabulary, provide meanings in Vietnamese (e.g., {"pen": "cái bút"}). Every word must have a non-empty meaning. For missing meanings, use a default dictionary (e.g., "pot": "cái nồi").
+        For sentence_structures, map questions to answers (e.g., {"What is this?": "It's a pen."} or {"What are they?": ["They are scissors.", "They are books."]}). If no sentence structures found, return {}.
+        Include all URLs (e.g., YouTube, Google Drive, Quizlet) in the links field, especially those related to homework.
+        Use date from input JSON if report_date is not found in text.
+        Ensure the output is a valid JSON object with all required fields.
+        """
+        llm_cache.register_prompt("notimain", system_prompt)
+
+        def parse_response(text):
+            cleaned_text = fix_invalid_json(clean_response_text(text))
+            log_message(f"Received API response: {cleaned_text[:100]}...")
+            return json.loads(cleaned_text)
+
+        max_attempts = 3
+        extracted_data = None
+        best_response = None
+        tried = []
+        attempt = 0
+        throttled = 0  # Quota errors reroute to another model without using up an attempt
+        # Checked before any model is chosen, so a re-run is free whichever model would be picked now
+        cached = llm_cache.lookup_any(MODEL_PRIORITY, system_prompt, pdf_text)
+        while attempt < max_attempts:
+            log_message(f"Gemini API attempt {attempt + 1}/{max_attempts}")
+            model_name = cached[0] if cached else get_available_model(tried, pdf_text)
+            if not model_name:
+                log_message("No suitable model found")
+                attempt += 1
+                continue
+            tried.append(model_name)
+            log_message(f"Using model: {model_name}")
+            try:
+                if cached:
+                    extracted_data = cached[1]
+                    cached = None
+                    log_message(f"Gemini response of {model_name} served from cache")
+                else:
+                    extracted_data = models.generate_json(model_name, system_prompt, pdf_text, parse_response)
+                    llm_cache.store(model_name, system_prompt, pdf_text, extracted_data)
+                extracted_data['links'] = list(set(extracted_data.get('links', []) + pdf_links))
+                extracted_data['report_date'] = fix_report_date(extracted_data.get('report_date', date_str), date_str)
+                for word in extracted_data['new_vocabulary']:
+                    if not extracted_data['new_vocabulary'][word]:
+                        extracted_data['new_vocabulary'][word] = {
+                            "pot": "cái nồi"
+                        }.get(word, "nghĩa không xác định")
+                extracted_data['sentence_structures'] = {
+                    k: v for k, v in extracted_data['sentence_structures'].items()
+                    if v is not None and (isinstance(v, str) or (isinstance(v, list) and all(isinstance(x, str) for x in v)))
+                }
+                if best_response is None or len(extracted_data.get('new_vocabulary', {})) > len(best_response.get('new_vocabulary', {})):
+                    best_response = extracted_data
+                log_message(f"API attempt {attempt + 1} successful")
+                break
+            except Exception as e:
+                if is_quota_error(e):
+                    tried.remove(model_name)  # Throttled, not broken: the scheduler decides when it can be used again
+                    throttled += 1
+                    if throttled >= QUOTA_RETRIES:
+                        # No placeholder analysis goes to the sheets, vocab or Telegram for a report the model never saw
+                        log_message(f"Out of Gemini quota after {throttled} tries, leaving the analysis of {class_name} on {date_str} for the next run")
+                        return
+                    log_message(f"Quota exceeded for {model_name}, rerouting: {str(e)}")
+                    continue
+                log_message(f"API attempt {attempt + 1}/{max_attempts} failed: {str(e)}")
+                attempt += 1
+        else:
+            log_message("All API attempts failed. Using best response or default.")
+            extracted_data = best_response or {
+                "new_vocabulary": {"pot": "cái nồi"},
+                "sentence_structures": {},
+                "report_date": date_str,
+                "lesson_title": "cannot find info",
+                "homework": "cannot find info",
+                "links": pdf_links,
+                "student_comments_minh_huy": "cannot find info"
+            }
+
+        # Analysed: from here on the report is done, so the writes below are never repeated by a retry
+        save_processed(state, date_str, class_name, report_url)
+
+        update_report_content_sheet(sheets, extracted_data, class_name, date_str, extracted_data['lesson_title'])
+
+        log_message("Processing total vocabulary")
+        if os.path.exists(VOCAB_FILE):
+            try:
+                with open(VOCAB_FILE, 'r', encoding='utf-8') as f:
+                    vocab_data = json.load(f)
+                    if isinstance(vocab_data, dict) and 'vocabulary' in vocab_data:
+                        total_vocab = vocab_data['vocabulary']
+                    elif isinstance(vocab_data, list) and all(isinstance(item, str) for item in vocab_data):
+                        total_vocab = [{"word": word, "meaning": ""} for word in vocab_data]
+                    else:
+                        total_vocab = []
+                log_message(f"Loaded existing vocabulary from {VOCAB_FILE}: {len(total_vocab)} entries")
+            except Exception as e:
+                log_message(f"Error reading {VOCAB_FILE}: {str(e)}. Starting with empty vocab.")
+                total_vocab = []
         else:
-            log_message("Report button is disabled")
+            log_message(f"{VOCAB_FILE} does not exist. Starting with empty vocab.")
+            total_vocab = []
+
+        new_vocab = extracted_data['new_vocabulary']
+        new_vocab_lower = {k.lower(): v for k, v in new_vocab.items()}
+        total_vocab_lower = {item['word'].lower(): item['meaning'] for item in total_vocab if isinstance(item, dict)}
+        added_vocab = [
+            {"word": k, "meaning": v}
+            for k, v in new_vocab.items()
+            if k.lower() not in total_vocab_lower or total_vocab_lower.get(k.lower(), '') == ''
+        ]
+        total_vocab.extend(added_vocab)
+        log_message(f"Added {len(added_vocab)} new vocabulary entries. Total vocabulary: {len(total_vocab)}")
+
+        log_message(f"Saving updated vocabulary to {VOCAB_FILE}")
+        with open(VOCAB_FILE, 'w', encoding='utf-8') as f:
+            json.dump({'vocabulary': total_vocab}, f, ensure_ascii=False, indent=4)
+        log_message(f"Successfully saved {VOCAB_FILE}")
+
+        update_vocab_sheet(sheets, total_vocab)
+
+        log_message("Creating Report directory if not exists")
+        os.makedirs('Report', exist_ok=True)
+        title = extracted_data['lesson_title'].replace(' ', '_') if extracted_data['lesson_title'] else 'unknown'
+        result_filename = f"Report/{date_str}_{title}.json"
+
+        result_data = {
+            **extracted_data,
+            'class_name': class_name,
+            'report_url': report_url,
+            'total_vocabulary': total_vocab
+        }
+
+        log_message(f"Saving result to {result_filename}")
+        with open(result_filename, 'w', encoding='utf-8') as f:
+            json.dump(result_data, f, ensure_ascii=False, indent=4)
+        log_message(f"Successfully saved: {result_filename}")
+
+        async def send_report_to_telegram():
+            log_message("Initializing Telegram Bot for detailed messages")
+            bot = Bot(token=TELEGRAM_BOT_TOKEN)
+            for chat_id in [TELEGRAM_CHAT_ID, TELEGRAM_CHAT_ID_2]:
+                if chat_id:
+                    log_message(f"Sending detailed Telegram messages to chat_id {chat_id}")
+                    await send_detailed_telegram_message(bot, chat_id, result_data)
+                    log_message(f"Completed sending detailed messages to chat_id {chat_id}")
+
+        log_message("Starting detailed Telegram notifications")
+        asyncio.run(send_report_to_telegram())
+        log_message("Completed detailed Telegram notifications")
+
+        git_sync.note(f"Report analysis and vocab for {class_name} on {date_str}")
     except Exception as e:
         log_message(f"Error checking reports: {str(e)}")
     finally:
         log_message("Closing WebDriver")
         driver.quit()
+        sheets.close()
+        log_message(export_cache.summary())
+        log_message(llm_cache.summary())
+        log_message(models.summary())
+        models.save()
+        git_sync.sync()
+        state.close()
 
 if __name__ == "__main__":
+    git_sync, sheets, state = start_run()
     log_message("Starting script")
-    process_report()
+    process_report(git_sync, sheets, state)
     log_message("Script completed")
@@ -0,0 +1,148 @@
+import atexit
+import bisect
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import pdfplumber
+
+# Pages parsed per document; 0 means every page. Documents over budget are cut and the caller is told how many pages were skipped.
+MAX_PAGES = int(os.getenv("MAX_PAGES", "0"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+MIN_PAGES_PER_WORKER = 2  # Below this, handing the PDF to another process costs more than parsing it here
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Shared process pool, reused for every document. Workers are spawned rather than forked, so they never inherit
+# locks held by other threads and only import the module that defines the page function; call this from main()
+# before starting any threads so the pool is set up once, up front.
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_executor.shutdown)
+        return _executor
+
+# Text and hyperlink URIs of one page, for callers that need nothing more
+def page_text_and_uris(page):
+    return page.extract_text() or '', [annot['uri'] for annot in (page.annots or []) if 'uri' in annot]
+
+# Run page_fn over a run of pages; errors are returned per page instead of aborting the document
+def _run_pages(pdf, page_numbers, page_fn):
+    results = []
+    for number in page_numbers:
+        try:
+            results.append((number, page_fn(pdf.pages[number]), None))
+        except Exception as e:
+            results.append((number, None, str(e)))
+    return results
+
+# Worker: open the PDF from disk once per chunk of pages
+def _extract_chunk(pdf_path, page_numbers, page_fn):
+    with pdfplumber.open(pdf_path) as pdf:
+        return _run_pages(pdf, page_numbers, page_fn)
+
+# Path the workers can open: the caller's own path, or a temp copy of a file object that is removed afterwards,
+# so only the path is pickled to each worker instead of the whole document
+@contextmanager
+def _shared_path(pdf_file):
+    if isinstance(pdf_file, (str, os.PathLike)):
+        yield pdf_file
+        return
+    pdf_file.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        shutil.copyfileobj(pdf_file, tmp)
+    try:
+        yield tmp.name
+    finally:
+        os.remove(tmp.name)
+
+# Run page_fn (a module-level function, so it can be pickled) over the pages of a PDF path or file object.
+# Returns (results, errors, total_pages): results in page order with None for failed pages,
+# errors as [(page_number, message)], total_pages so the caller can report what the budget skipped.
+def extract_pages(pdf_file, page_fn, max_pages=MAX_PAGES, workers=PDF_WORKERS):
+    if not isinstance(pdf_file, (str, os.PathLike)):
+        pdf_file.seek(0)
+    with pdfplumber.open(pdf_file) as pdf:
+        total_pages = len(pdf.pages)
+        count = min(total_pages, max_pages) if max_pages else total_pages
+        chunks = max(1, min(workers, count // MIN_PAGES_PER_WORKER))
+        if chunks == 1:
+            outcomes = _run_pages(pdf, range(count), page_fn)
+    if chunks > 1:
+        size = -(-count // chunks)
+        with _shared_path(pdf_file) as pdf_path:
+            futures = [get_executor().submit(_extract_chunk, pdf_path, range(start, min(start + size, count)), page_fn)
+                       for start in range(0, count, size)]
+            outcomes = [outcome for future in futures for outcome in future.result()]
+    results = [None] * count
+    errors = []
+    for number, result, error in outcomes:
+        results[number] = result
+        if error is not None:
+            errors.append((number, error))
+    return results, errors, total_pages
+
+LINK_TOLERANCE = 10  # Max distance (pt) between a link's corner and the word that labels it
+GRID_CELL = 20  # Word index bucket size (pt); at least LINK_TOLERANCE so a lookup touches few buckets
+SECTION_KEYWORDS = [("phonics", "Phonics link"), ("letter", "Phonics link"), ("homework", "Homework link"),
+                    ("vocabulary", "Vocabulary link")]
+
+# Section a piece of text names, e.g. "Homework link", or None
+def section_context(text):
+    text = text.lower()
+    for keyword, context in SECTION_KEYWORDS:
+        if keyword in text:
+            return context
+    return None
+
+# Words of one page bucketed on a grid, built from a single extract_words pass, so each link annotation
+# looks at the few words around it instead of re-extracting and scanning the whole page
+class WordIndex:
+    def __init__(self, words, cell=GRID_CELL):
+        self.cell = cell
+        self.buckets = {}
+        for order, word in enumerate(words):
+            for key in self._cells(word['x0'], word['top'], word['x1'], word['bottom']):
+                self.buckets.setdefault(key, []).append((order, word))
+        # Section headings by position, for links whose own label does not name a section
+        self.headings = sorted((word['top'], word['x0'], section_context(word['text'])) for word in words
+                               if section_context(word['text']))
+        self.heading_tops = [top for top, _, _ in self.headings]
+
+    @classmethod
+    def from_page(cls, page):
+        return cls(page.extract_words(x_tolerance=5, y_tolerance=5))
+
+    def _cells(self, x0, top, x1, bottom):
+        for row in range(int(top // self.cell), int(bottom // self.cell) + 1):
+            for col in range(int(x0 // self.cell), int(x1 // self.cell) + 1):
+                yield col, row
+
+    # First word, in reading order, with its start or end corner within tolerance of the box's corresponding corner
+    def label(self, x0, top, x1, bottom, tolerance=LINK_TOLERANCE):
+        found = None
+        for corner_x, corner_y in ((x0, top), (x1, bottom)):
+            for key in self._cells(corner_x - tolerance, corner_y - tolerance, corner_x + tolerance, corner_y + tolerance):
+                for order, word in self.buckets.get(key, ()):
+                    if found is not None and order >= found[0]:
+                        continue
+                    if (abs(word['x0'] - x0) < tolerance and abs(word['top'] - top) < tolerance) or \
+                       (abs(word['x1'] - x1) < tolerance and abs(word['bottom'] - bottom) < tolerance):
+                        found = (order, word)
+        return found[1]['text'] if found else None
+
+    # Section named by the closest heading word at or above a vertical position
+    def heading(self, top):
+        index = bisect.bisect_right(self.heading_tops, top)
+        return self.headings[index - 1][2] if index else None
+
+    # Context for a link annotation: its label's section, else the enclosing heading's, else the label itself
+    def link_context(self, annot):
+        text = self.label(annot['x0'], annot['top'], annot['x1'], annot['bottom'])
+        return section_context(text or '') or self.heading(annot['top']) or text or "PDF link"
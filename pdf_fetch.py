@@ -0,0 +1,86 @@
+import os
+import tempfile
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import export_cache
+
+REQUEST_TIMEOUT = 30
+CHUNK_SIZE = 64 * 1024
+# PDFs up to this size stay in memory; larger ones spill to a temp file owned by the caller's task
+SPOOL_MAX_BYTES = int(os.getenv("PDF_SPOOL_MAX_BYTES", str(20 * 1024 * 1024)))
+RETRY = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET", "HEAD"])
+
+# The server answered with something other than the requested export, e.g. a sign-in page for a private doc
+class UnexpectedContentError(Exception):
+    pass
+
+class NotPdfError(UnexpectedContentError):
+    pass
+
+_session = None
+_session_lock = threading.Lock()
+
+# Process-wide keep-alive session with retries, shared by every download
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(max_retries=RETRY, pool_connections=8, pool_maxsize=16)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+# Stream a PDF into a seekable file object that pdfplumber.open accepts directly; the caller closes it.
+# Goes through the export cache when enabled: conditional GET, 304 served from disk, cached copy if the network fails.
+# Raises requests.RequestException on HTTP errors and NotPdfError when the response is not a PDF.
+def download_pdf(url, timeout=REQUEST_TIMEOUT):
+    return download_export(url, 'application/pdf', timeout)
+
+# Same as download_pdf for any export format; content_type is checked against the response
+def download_export(url, content_type, timeout=REQUEST_TIMEOUT):
+    cache = export_cache.get_cache()
+    if cache is not None and cache.offline:
+        cached = cache.open_cached(url)
+        if cached is not None:
+            return cached
+    headers = cache.conditional_headers(url) if cache is not None else {}
+    try:
+        response = get_session().get(url, timeout=timeout, stream=True, headers=headers)
+    except requests.RequestException:
+        cached = cache.open_cached(url, 'stale') if cache is not None else None
+        if cached is None:
+            raise
+        return cached
+    with response:
+        if response.status_code == 304 and cache is not None:
+            cached = cache.open_cached(url, 'revalidated')
+            if cached is not None:
+                return cached
+        response.raise_for_status()
+        received_type = response.headers.get('content-type', '')
+        if content_type == 'application/pdf' and content_type not in received_type:
+            raise NotPdfError(f"Downloaded file is not a PDF (Content-Type: {received_type})")
+        # Private docs redirect to an HTML sign-in page instead of failing
+        if content_type not in received_type or 'accounts.google.com' in response.url:
+            raise UnexpectedContentError(f"Expected {content_type}, got {received_type} from {response.url}")
+        if cache is not None:
+            return cache.store(url, response.headers, response.iter_content(CHUNK_SIZE))
+        pdf = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, prefix='report_')
+        try:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                pdf.write(chunk)
+        except Exception:
+            pdf.close()
+            raise
+    pdf.seek(0)
+    return pdf
+
+def pdf_size(pdf):
+    position = pdf.tell()
+    pdf.seek(0, os.SEEK_END)
+    size = pdf.tell()
+    pdf.seek(position)
+    return size
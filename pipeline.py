@@ -0,0 +1,99 @@
+import os
+import queue
+import threading
+import time
+from pdf_extract import get_executor
+
+# Stage concurrency of the report extractors
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "4"))
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "2"))
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "4"))  # The quota scheduler keeps concurrent calls within RPM/TPM
+
+_DONE = object()
+
+# One step of a pipeline: fn(item) returns the item for the next stage, or None to drop it
+class Stage:
+    def __init__(self, name, fn, workers=1, queue_size=4):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.queue_size = queue_size  # Items allowed to wait in front of this stage before upstream blocks
+
+# Streams items through stages connected by bounded queues. Each stage runs its own worker threads,
+# a full queue blocks the stage feeding it, and an exception only drops the item that raised it.
+class Pipeline:
+    def __init__(self, stages, log=print, describe=str):
+        self.stages = stages
+        self.log = log
+        self.describe = describe  # Short label for an item in log lines
+        self.stats = {stage.name: {'ok': 0, 'dropped': 0, 'failed': 0, 'busy': 0.0} for stage in stages}
+        self._lock = threading.Lock()
+
+    def _count(self, stage, outcome, busy):
+        with self._lock:
+            self.stats[stage.name][outcome] += 1
+            self.stats[stage.name]['busy'] += busy
+
+    def _worker(self, index, inbox, outbox, results):
+        stage = self.stages[index]
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                return
+            started = time.monotonic()
+            try:
+                result = stage.fn(item)
+            except Exception as e:
+                self._count(stage, 'failed', time.monotonic() - started)
+                self.log(f"Stage '{stage.name}' failed for {self.describe(item)}: {str(e)}")
+                continue
+            if result is None:
+                self._count(stage, 'dropped', time.monotonic() - started)
+                continue
+            self._count(stage, 'ok', time.monotonic() - started)
+            if outbox is not None:
+                outbox.put(result)
+            else:
+                with self._lock:
+                    results.append(result)
+
+    # Run every item through all stages; returns what the last stage produced, in completion order
+    def run(self, items):
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        results = []
+        threads = []
+        for index, stage in enumerate(self.stages):
+            outbox = queues[index + 1] if index + 1 < len(self.stages) else None
+            stage_threads = [threading.Thread(target=self._worker, args=(index, queues[index], outbox, results),
+                                              name=f"{stage.name}-{n}", daemon=True) for n in range(stage.workers)]
+            for thread in stage_threads:
+                thread.start()
+            threads.append(stage_threads)
+        started = time.monotonic()
+        for item in items:
+            queues[0].put(item)
+        # Shut stages down in order so each one drains before the next is told to stop
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                queues[index].put(_DONE)
+            for thread in threads[index]:
+                thread.join()
+        elapsed = time.monotonic() - started
+        for stage in self.stages:
+            stats = self.stats[stage.name]
+            self.log(f"Stage '{stage.name}' ({stage.workers} workers): {stats['ok']} ok, {stats['dropped']} dropped, "
+                     f"{stats['failed']} failed, {stats['busy']:.1f}s busy")
+        self.log(f"Pipeline finished {len(results)} items in {elapsed:.1f}s")
+        return results
+
+# fetch -> parse -> gemini -> store over report jobs ({'report_url': ...}), as every report extractor runs it:
+# downloads and parsing of later reports overlap with Gemini calls for earlier ones. The PDF worker pool is
+# started before any stage thread. Returns the jobs the store stage accepted.
+def run_report_pipeline(jobs, fetch, parse, extract, store, log=print):
+    get_executor()
+    return Pipeline([
+        Stage("fetch", fetch, workers=FETCH_WORKERS),
+        Stage("parse", parse, workers=PARSE_WORKERS),
+        Stage("gemini", extract, workers=LLM_WORKERS),
+        Stage("store", store)
+    ], log=log, describe=lambda job: job['report_url']).run(jobs)
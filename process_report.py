@@ -1,12 +1,19 @@
 import json
 import os
 import requests
-import pdfplumber
 import google.generativeai as genai
 import re
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import logging
+from pdf_fetch import download_pdf, pdf_size, NotPdfError, UnexpectedContentError
+from doc_export import DOC_EXPORT_FORMAT, doc_export_url, download_doc_export, parse_export
+import export_cache
+import llm_cache
+from gemini_models import get_catalog
+from gemini_quota import is_quota_error, QUOTA_RETRIES
+from pdf_extract import extract_pages, page_text_and_uris
+from pipeline import run_report_pipeline
 
 # Configuration
 LOG_FILE = "class_info_log3.txt"
@@ -15,17 +22,22 @@ LINK_FILE = "link.txt"
 API_KEY = os.getenv("GEMINI_API_KEY")
 TODAY = datetime.now(tz=ZoneInfo("Asia/Ho_Chi_Minh")).strftime("%Y-%m-%d")
 
-# Logging setup
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='[%(asctime)s] %(levelname)s: %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+# Logging setup; run from __main__ only, because the spawned PDF workers re-import this module
+def setup_logging():
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='[%(asctime)s] %(levelname)s: %(message)s',
+        handlers=[
+            logging.FileHandler(LOG_FILE, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+
+# Model preference, best first; the catalog reorders it by each model's recent health
+MODEL_PRIORITY = ['gemini-2.5-flash', 'gemini-2.5-pro', 'gemini-pro']
+
 # System prompt for Gemini API
 SYSTEM_PROMPT = """
 Extract structured data from the provided text (from a Google Docs lesson plan). Ignore the "Comments" section entirely to avoid storing personal student information. Output a JSON object with the following fields:
@@ -48,7 +60,7 @@ Extract structured data from the provided text (from a Google Docs lesson plan).
 For hyperlinks, extract URLs and their associated text (e.g., video titles) from the provided text. Ensure all text is preserved accurately, including Vietnamese translations. Return only the JSON output, no additional text.
 """
 
-# Clean and validate JSON response
+# Clean and validate JSON response; raises ValueError so the caller retries instead of keeping a placeholder
 def clean_json_response(text):
     logger.debug("Cleaning JSON response")
     text = text.strip()
@@ -64,50 +76,16 @@ def clean_json_response(text):
         logger.info("Successfully parsed JSON response")
         return parsed_json
     except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON response: {str(e)}")
         logger.debug(f"Failed JSON content: {text[:200]}...")  # Log first 200 chars
-        return {
-            "class_name": "cannot find info",
-            "lesson_unit": "cannot find info",
-            "lesson_date": TODAY,
-            "learning_objectives": {
-                "vocabulary_review": {"theme": "", "words": [], "count": 0},
-                "vocabulary_new": {"theme": "", "words": [], "count": 0},
-                "pronunciation": {"sound": "", "words": [], "count": 0},
-                "phonics": ""
-            },
-            "warm_up": {"description": "", "videos": []},
-            "homework_check": "cannot find info",
-            "running_content": {"theme": "", "review_vocabulary": {"link": "", "words": [], "structure": "", "examples": [], "activities": ""}},
-            "new_vocabulary": {"theme": "", "words": [], "link": "", "activities": ""},
-            "phonics": {"letter": "", "words": [], "link": "", "activities": "", "videos": []},
-            "homework": [],
-            "links_all": []
-        }
+        raise ValueError(f"Invalid JSON response: {str(e)}")
 
-# Get available Gemini model
-def get_gemini_model(attempt=0):
-    logger.debug(f"Fetching Gemini model, attempt {attempt + 1}")
-    try:
-        models = genai.list_models()
-        available_models = [model.name for model in models if 'generateContent' in model.supported_generation_methods]
-        logger.info(f"Available models: {available_models}")
-        for model in available_models:
-            if attempt == 0 and 'gemini-2.5-flash' in model:
-                logger.debug(f"Selected model: {model}")
-                return model
-            if attempt == 1 and 'gemini-2.5-pro' in model:
-                logger.debug(f"Selected model: {model}")
-                return model
-            if attempt == 2 and 'gemini-pro' in model:
-                logger.debug(f"Selected model: {model}")
-                return model
-        selected_model = available_models[0] if available_models else None
-        logger.info(f"Selected default model: {selected_model}")
-        return selected_model
-    except Exception as e:
-        logger.error(f"Failed to list models: {str(e)}")
-        return None
+# Available Gemini model not yet tried for this document that has quota budget soonest, healthiest first
+# (catalog fetched once per TTL)
+def get_gemini_model(tried=(), content=None):
+    model_name = get_catalog(log=logger.info).choose(MODEL_PRIORITY, tried, content)
+    if model_name:
+        logger.info(f"Selected model: {model_name}")
+    return model_name
 
 # Clean Google Docs URL and convert to PDF export URL
 def clean_google_docs_url(url):
@@ -123,8 +101,9 @@ def clean_google_docs_url(url):
     logger.info(f"Generated PDF export URL: {pdf_url}")
     return pdf_url
 
-# Process a single report link
-def process_report_link(report_url):
+# Pipeline stage: download the HTML/text export of a report, or its PDF
+def fetch_report(job):
+    report_url = job['report_url']
     logger.info(f"Starting processing for report URL: {report_url}")
     
     # Clean and convert URL to PDF export
@@ -134,101 +113,165 @@ def process_report_link(report_url):
         return None
     logger.debug(f"PDF export URL: {direct_pdf_url}")
 
-    # Download PDF from direct URL
-    pdf_path = 'temp_report.pdf'
-    logger.debug(f"Attempting to download PDF to {pdf_path}")
+    # Google Docs reports: read the native export and skip PDF rendering; fall back to the PDF on failure
+    if doc_export_url(report_url):
+        try:
+            job['export'] = download_doc_export(report_url)
+            job['pdf_export_url'] = direct_pdf_url
+            logger.info(f"Downloaded {DOC_EXPORT_FORMAT} export ({pdf_size(job['export'])} bytes)")
+            return job
+        except (requests.RequestException, UnexpectedContentError) as e:
+            logger.warning(f"Failed to download {DOC_EXPORT_FORMAT} export, falling back to PDF: {str(e)}")
+
+    pdf = fetch_pdf(direct_pdf_url)
+    if pdf is None:
+        return None
+    job['pdf_export_url'] = direct_pdf_url
+    job['pdf'] = pdf
+    return job
+
+# Download PDF from direct URL over the shared session, in memory unless it is large; None on failure
+def fetch_pdf(direct_pdf_url):
+    logger.debug(f"Attempting to download PDF from {direct_pdf_url}")
     try:
-        response = requests.get(direct_pdf_url, timeout=10)
-        response.raise_for_status()
-        content_type = response.headers.get('content-type', '')
-        logger.debug(f"Response content-type: {content_type}")
-        if 'application/pdf' not in content_type:
-            logger.error(f"Downloaded file is not a PDF (Content-Type: {content_type})")
-            return None
-        with open(pdf_path, 'wb') as f:
-            f.write(response.content)
-        logger.info(f"Successfully downloaded PDF to {pdf_path}")
+        pdf = download_pdf(direct_pdf_url)
+    except NotPdfError as e:
+        logger.error(str(e))
+        return None
     except requests.RequestException as e:
         logger.error(f"Failed to download PDF from {direct_pdf_url}: {str(e)}")
         return None
+    logger.info(f"Successfully downloaded PDF ({pdf_size(pdf)} bytes)")
+    return pdf
 
-    # Extract text and links from PDF
+# Pipeline stage: extract text and links from the downloaded export or PDF; an export that cannot be
+# parsed or has no text falls back to the PDF, as a failed export download does
+def parse_report(job):
+    if 'export' in job:
+        export_file = job.pop('export')
+        pdf_text = ''
+        try:
+            pdf_text, doc_links = parse_export(export_file)
+            logger.info(f"Extracted {len(pdf_text)} characters and {len(doc_links)} links from {DOC_EXPORT_FORMAT} export")
+        except Exception as e:
+            logger.warning(f"Failed to parse {DOC_EXPORT_FORMAT} export, falling back to PDF: {str(e)}")
+        finally:
+            export_file.close()
+        if pdf_text:
+            job['pdf_text'] = pdf_text
+            job['pdf_links'] = [link['url'] for link in doc_links]
+            return job
+        job['pdf'] = fetch_pdf(job['pdf_export_url'])
+        if job['pdf'] is None:
+            return None
+
+    pdf_file = job.pop('pdf')
     pdf_text = ''
     pdf_links = []
     logger.debug("Extracting text and links from PDF")
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text()
-                pdf_text += text or ''
-                logger.debug(f"Extracted text from page: {text[:100] if text else 'None'}...")
-                if page.annots:
-                    for annot in page.annots:
-                        if 'uri' in annot:
-                            pdf_links.append(annot['uri'])
-                            logger.debug(f"Found PDF link: {annot['uri']}")
+        pages, errors, _ = extract_pages(pdf_file, page_text_and_uris, max_pages=0)
+        for number, error in errors:
+            logger.error(f"Failed to process page {number + 1}: {error}")
+        for text, uris in filter(None, pages):
+            pdf_text += text
+            logger.debug(f"Extracted text from page: {text[:100] if text else 'None'}...")
+            for uri in uris:
+                pdf_links.append(uri)
+                logger.debug(f"Found PDF link: {uri}")
         logger.info(f"Extracted {len(pdf_text)} characters and {len(pdf_links)} links from PDF")
     except Exception as e:
         logger.error(f"Failed to extract text or links from PDF: {str(e)}")
         return None
     finally:
-        if os.path.exists(pdf_path):
-            os.remove(pdf_path)
-            logger.info(f"Deleted temporary PDF file: {pdf_path}")
+        pdf_file.close()
 
     if not pdf_text:
         logger.error("No text extracted from PDF")
         return None
+    job['pdf_text'] = pdf_text
+    job['pdf_links'] = pdf_links
+    return job
+
+# Pipeline stage: structure the extracted text with Gemini
+def extract_report_data(job):
+    report_url = job['report_url']
+    direct_pdf_url = job['pdf_export_url']
+    pdf_text = job.pop('pdf_text')
+    pdf_links = job.pop('pdf_links')
 
     # Call Gemini API
     max_attempts = 3
     extracted_data = None
     logger.debug(f"Starting Gemini API calls, max attempts: {max_attempts}")
-    for attempt in range(max_attempts):
+    tried = []
+    attempt = 0
+    throttled = 0  # Quota errors reroute to another model without using up an attempt
+    # Checked before any model is chosen, so a re-run is free whichever model would be picked now
+    cached = llm_cache.lookup_any(MODEL_PRIORITY, SYSTEM_PROMPT, pdf_text)
+    while attempt < max_attempts:
         logger.info(f"Gemini API attempt {attempt + 1}/{max_attempts}")
-        model_name = get_gemini_model(attempt)
+        model_name = cached[0] if cached else get_gemini_model(tried, pdf_text)
         if not model_name:
             logger.error("No suitable model found")
+            attempt += 1
             continue
+        tried.append(model_name)
         logger.info(f"Using model: {model_name}")
         try:
-            model = genai.GenerativeModel(model_name, system_instruction=SYSTEM_PROMPT)
-            response = model.generate_content(pdf_text)
-            logger.debug(f"Gemini API response: {response.text[:100]}...")
-            cleaned_text = clean_json_response(response.text)
-            extracted_data = json.loads(cleaned_text)
-            extracted_data['links_all'] = list(set(extracted_data.get('links_all', []) + [{"context": "PDF link", "url": link, "type": "other"} for link in pdf_links]))
+            if cached:
+                extracted_data = cached[1]
+                cached = None
+                logger.info(f"Gemini response of {model_name} served from cache")
+            else:
+                extracted_data = get_catalog(log=logger.info).generate_json(model_name, SYSTEM_PROMPT, pdf_text, clean_json_response)
+                llm_cache.store(model_name, SYSTEM_PROMPT, pdf_text, extracted_data)
+            # PDF links the model did not already list (links are dicts, so dedupe by URL rather than with set())
+            listed_urls = {link.get('url') for link in extracted_data.get('links_all', []) if isinstance(link, dict)}
+            extracted_data['links_all'] = extracted_data.get('links_all', []) + [
+                {"context": "PDF link", "url": link, "type": "other"} for link in dict.fromkeys(pdf_links) if link not in listed_urls]
             extracted_data['report_url'] = report_url
             extracted_data['pdf_export_url'] = direct_pdf_url
             logger.info(f"API attempt {attempt + 1} successful, extracted data: {json.dumps(extracted_data, ensure_ascii=False)[:200]}...")
             break
         except Exception as e:
+            if is_quota_error(e):
+                tried.remove(model_name)  # Throttled, not broken: the scheduler decides when it can be used again
+                throttled += 1
+                if throttled >= QUOTA_RETRIES:
+                    # Left out of homework data, so the next run picks it up again instead of keeping a placeholder
+                    logger.warning(f"Out of Gemini quota after {throttled} tries, leaving {report_url} for the next run")
+                    return None
+                logger.warning(f"Quota exceeded for {model_name}, rerouting: {str(e)}")
+                continue
             logger.error(f"API attempt {attempt + 1}/{max_attempts} failed: {str(e)}")
-            if attempt == max_attempts - 1:
-                logger.error("All API attempts failed, using default response")
-                extracted_data = {
-                    "class_name": "cannot find info",
-                    "lesson_unit": "cannot find info",
-                    "lesson_date": TODAY,
-                    "learning_objectives": {
-                        "vocabulary_review": {"theme": "", "words": [], "count": 0},
-                        "vocabulary_new": {"theme": "", "words": [], "count": 0},
-                        "pronunciation": {"sound": "", "words": [], "count": 0},
-                        "phonics": ""
-                    },
-                    "warm_up": {"description": "", "videos": []},
-                    "homework_check": "cannot find info",
-                    "running_content": {"theme": "", "review_vocabulary": {"link": "", "words": [], "structure": "", "examples": [], "activities": ""}},
-                    "new_vocabulary": {"theme": "", "words": [], "link": "", "activities": ""},
-                    "phonics": {"letter": "", "words": [], "link": "", "activities": "", "videos": []},
-                    "homework": [],
-                    "links_all": [{"context": "PDF link", "url": link, "type": "other"} for link in pdf_links],
-                    "report_url": report_url,
-                    "pdf_export_url": direct_pdf_url
-                }
+            attempt += 1
+    else:
+        logger.error("All API attempts failed, using default response")
+        extracted_data = {
+            "class_name": "cannot find info",
+            "lesson_unit": "cannot find info",
+            "lesson_date": TODAY,
+            "learning_objectives": {
+                "vocabulary_review": {"theme": "", "words": [], "count": 0},
+                "vocabulary_new": {"theme": "", "words": [], "count": 0},
+                "pronunciation": {"sound": "", "words": [], "count": 0},
+                "phonics": ""
+            },
+            "warm_up": {"description": "", "videos": []},
+            "homework_check": "cannot find info",
+            "running_content": {"theme": "", "review_vocabulary": {"link": "", "words": [], "structure": "", "examples": [], "activities": ""}},
+            "new_vocabulary": {"theme": "", "words": [], "link": "", "activities": ""},
+            "phonics": {"letter": "", "words": [], "link": "", "activities": "", "videos": []},
+            "homework": [],
+            "links_all": [{"context": "PDF link", "url": link, "type": "other"} for link in pdf_links],
+            "report_url": report_url,
+            "pdf_export_url": direct_pdf_url
+        }
 
     logger.info(f"Completed processing for {report_url}")
-    return extracted_data
+    job['data'] = extracted_data
+    return job
 
 # Main function
 def main():
@@ -239,6 +282,7 @@ def main():
         return
 
     genai.configure(api_key=API_KEY)
+    llm_cache.register_prompt("process_report", SYSTEM_PROMPT)
     logger.debug("Configured Gemini API with provided API key")
 
     # Read links from link.txt
@@ -264,16 +308,27 @@ def main():
     # Process each report URL
     processed_urls = {entry.get('report_url') for entry in homework_data}
     logger.debug(f"Processed URLs: {processed_urls}")
+    jobs = []
     for report_url in report_urls:
         if report_url in processed_urls:
             logger.info(f"Skipping already processed URL: {report_url}")
             continue
-        logger.debug(f"Processing new URL: {report_url}")
-        data = process_report_link(report_url)
-        if data:
-            homework_data.append(data)
-            logger.info(f"Processed and added report: {report_url}")
-            logger.debug(f"Added data: {json.dumps(data, ensure_ascii=False)[:200]}...")
+        logger.debug(f"Queueing new URL: {report_url}")
+        jobs.append({'report_url': report_url})
+
+    def store_report(job):
+        homework_data.append(job['data'])
+        logger.info(f"Processed and added report: {job['report_url']}")
+        logger.debug(f"Added data: {json.dumps(job['data'], ensure_ascii=False)[:200]}...")
+        return job
+
+    run_report_pipeline(jobs, fetch_report, parse_report, extract_report_data, store_report, log=logger.info)
+
+    logger.info(export_cache.summary())
+    logger.info(llm_cache.summary())
+    models = get_catalog(log=logger.info)
+    logger.info(models.summary())
+    models.save()
 
     # Save to homework.json
     try:
@@ -284,6 +339,7 @@ def main():
         logger.error(f"Error saving {HOMEWORK_FILE}: {str(e)}")
 
 if __name__ == "__main__":
+    setup_logging()
     logger.debug("Initializing script")
     main()
     logger.debug("Script terminated")
@@ -1,6 +1,5 @@
 import json
 import os
-import requests
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
@@ -9,6 +8,9 @@ import time
 from webdriver_manager.chrome import ChromeDriverManager
 from urllib.parse import parse_qs, urlparse
 import pdfplumber
+import session_cache
+import cec_dom
+from pdf_fetch import download_pdf
 
 # Config
 PROCESSED_FILE = "processed2.json"
@@ -21,12 +23,15 @@ def log_message(message):
         f.write(f"[{timestamp}] {message}\n")
 
 def login(driver):
-    driver.get("https://apps.cec.com.vn/login")
     username = os.getenv("NEW_CEC_USER")
     password = os.getenv("NEW_CEC_PASS")
     if not username or not password:
         log_message("Missing NEW_CEC_USER or NEW_CEC_PASS")
         raise Exception("Missing credentials")
+    if session_cache.restore_driver_session(driver, username):
+        log_message("Login restored from cache")
+        return
+    driver.get("https://apps.cec.com.vn/login")
     try:
         username_field = WebDriverWait(driver, 30).until(
             EC.visibility_of_element_located((By.ID, "input-14"))
@@ -47,6 +52,7 @@ def login(driver):
             log_message("Login failed")
             raise Exception("Login failed")
         log_message("Login successful")
+        session_cache.save_driver_session(driver, username)
     except Exception as e:
         log_message(f"Login error: {str(e)}")
         raise
@@ -63,17 +69,16 @@ def main():
     try:
         login(driver)
         driver.get("https://apps.cec.com.vn/student-calendar/overview")
+        cec_dom.install_window_open_shim(driver)
         time.sleep(5)
         driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        class_events = WebDriverWait(driver, 30).until(
-            EC.presence_of_all_elements_located((By.XPATH, "//div[contains(@class, 'v-event') and @data-date]"))
-        )
+        class_events = cec_dom.snapshot_events(driver)
         log_message(f"Found {len(class_events)} class events")
 
         latest_date = None
         latest_event = None
         for event in class_events:
-            date_str = event.get_attribute("data-date")
+            date_str = event["date"]
             try:
                 event_date = datetime.strptime(date_str, "%Y-%m-%d")
                 if event_date.date() < datetime.now().date() and (latest_date is None or event_date > latest_date):
@@ -88,7 +93,7 @@ def main():
             return
 
         date_str = latest_date.strftime("%Y-%m-%d")
-        driver.execute_script("arguments[0].click();", latest_event)
+        cec_dom.click_event(driver, latest_event)
         time.sleep(3)
 
         popup = WebDriverWait(driver, 10).until(
@@ -98,29 +103,18 @@ def main():
 
         report_button = popup.find_element(By.XPATH, "//button[.//p[text()='Báo cáo bài học']]")
         if "v-btn--disabled" not in report_button.get_attribute("class"):
-            original_window = driver.current_window_handle
-            report_button.click()
-            time.sleep(3)
-            for window_handle in driver.window_handles:
-                if window_handle != original_window:
-                    driver.switch_to.window(window_handle)
-                    break
-            report_url = driver.current_url
-            driver.close()
-            driver.switch_to.window(original_window)
+            report_url = cec_dom.capture_opened_url(driver, report_button.click)
+            if not report_url:
+                log_message("Report button did not open a link")
+                return
 
             parsed_url = urlparse(report_url)
             query_params = parse_qs(parsed_url.query)
             pdf_url = query_params.get('url', [None])[0]
             if pdf_url:
-                pdf_response = requests.get(pdf_url)
-                pdf_path = "temp_report.pdf"
-                with open(pdf_path, "wb") as f:
-                    f.write(pdf_response.content)
-                with pdfplumber.open(pdf_path) as pdf:
+                with download_pdf(pdf_url) as pdf_file, pdfplumber.open(pdf_file) as pdf:
                     text = "".join(page.extract_text() or "" for page in pdf.pages)
                     links = [annot["uri"] for page in pdf.pages for annot in (page.annots or []) if "uri" in annot]
-                os.remove(pdf_path)
 
                 data = {
                     "date": date_str,
@@ -0,0 +1,163 @@
+import base64
+import hashlib
+import json
+import os
+import time
+import threading
+from cryptography.fernet import Fernet, InvalidToken
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException
+import cec_api
+
+# Configuration
+SESSION_CACHE_FILE = os.getenv("CEC_SESSION_CACHE", ".cec_session.json")
+SESSION_KEY = os.getenv("CEC_SESSION_KEY", "")  # Secret the cache is encrypted with; no key, no cache
+DEFAULT_TTL = 12 * 3600  # Used when the portal only sets session cookies
+SESSION_CHECK_TIMEOUT = 20  # Upper bound only: the check returns as soon as either page shows up
+CHECK_URL = f"{cec_api.CEC_BASE_URL}/student-calendar/overview"
+LOGGED_IN_MARKER = "div.v-calendar"  # The overview calendar, only rendered for a logged-in user
+
+_lock = threading.Lock()
+
+def _fernet():
+    if not SESSION_KEY:
+        return None
+    return Fernet(base64.urlsafe_b64encode(hashlib.sha256(SESSION_KEY.encode('utf-8')).digest()))
+
+# Decrypted cache, or {} if there is no key, no file, or it was written with another key
+def _read_cache():
+    fernet = _fernet()
+    if fernet is None or not os.path.exists(SESSION_CACHE_FILE):
+        return {}
+    try:
+        with open(SESSION_CACHE_FILE, 'rb') as f:
+            return json.loads(fernet.decrypt(f.read()))
+    except (InvalidToken, ValueError, OSError):
+        return {}
+
+# Cookies and tokens are credentials, so they only ever reach disk (and actions/cache) encrypted
+def _write_cache(cache):
+    fernet = _fernet()
+    if fernet is None:
+        return
+    tmp_path = f"{SESSION_CACHE_FILE}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(fernet.encrypt(json.dumps(cache).encode('utf-8')))
+    os.replace(tmp_path, SESSION_CACHE_FILE)
+
+# Earliest expiry among persistent cookies, or DEFAULT_TTL from now
+def _expires_at(cookies):
+    expiries = [c['expiry'] for c in cookies if isinstance(c.get('expiry'), (int, float))]
+    return min(expiries) if expiries else time.time() + DEFAULT_TTL
+
+def _token_from_storage(local_storage):
+    for key, value in local_storage.items():
+        if 'token' in key.lower() and value:
+            return value.strip('"')
+    return None
+
+# Cached entry for this account, or None if missing or expired
+def load_session(username):
+    with _lock:
+        entry = _read_cache().get(username)
+    if not entry or entry.get('expires_at', 0) <= time.time():
+        return None
+    return entry
+
+def save_session(username, cookies, local_storage=None, token=None):
+    local_storage = local_storage or {}
+    entry = {
+        'saved_at': time.time(),
+        'expires_at': _expires_at(cookies),
+        'cookies': cookies,
+        'local_storage': local_storage,
+        'token': token or _token_from_storage(local_storage)
+    }
+    with _lock:
+        cache = _read_cache()
+        cache[username] = entry
+        _write_cache(cache)
+
+def invalidate_session(username):
+    with _lock:
+        cache = _read_cache()
+        if cache.pop(username, None) is not None:
+            _write_cache(cache)
+
+# Save the cookies and localStorage of a logged-in driver
+def save_driver_session(driver, username):
+    cookies = driver.get_cookies()
+    local_storage = driver.execute_script("return Object.assign({}, window.localStorage);") or {}
+    save_session(username, cookies, local_storage)
+
+# Save the cookies and bearer token of a logged-in requests session
+def save_requests_session(session, username):
+    cookies = [{
+        'name': c.name,
+        'value': c.value,
+        'domain': c.domain,
+        'path': c.path,
+        **({'expiry': c.expires} if c.expires else {})
+    } for c in session.cookies]
+    save_session(username, cookies, token=cec_api.get_token(session))
+
+def _apply_to_requests(session, entry):
+    for c in entry['cookies']:
+        session.cookies.set(c['name'], c['value'], domain=c.get('domain'), path=c.get('path', '/'))
+    if entry.get('token'):
+        cec_api.set_token(session, entry['token'])
+
+# Inject the cached session into a requests session; True if the cheap check accepts it
+def restore_requests_session(session, username):
+    entry = load_session(username)
+    if not entry:
+        return False
+    _apply_to_requests(session, entry)
+    if cec_api.check_session(session) is False:
+        invalidate_session(username)
+        session.cookies.clear()
+        session.headers.pop("Authorization", None)
+        return False
+    return True
+
+# "logged_in" once the overview calendar renders, "login" if the SPA bounced us to /login, False while neither
+def _session_outcome(driver):
+    if "login" in driver.current_url:
+        return "login"
+    if driver.find_elements(By.CSS_SELECTOR, LOGGED_IN_MARKER):
+        return "logged_in"
+    return False
+
+# Inject the cached session into a fresh driver; True as soon as the overview calendar renders for it
+def restore_driver_session(driver, username):
+    entry = load_session(username)
+    if not entry:
+        return False
+    try:
+        probe = cec_api.create_session()
+        _apply_to_requests(probe, entry)
+        if cec_api.check_session(probe) is False:
+            invalidate_session(username)
+            return False
+        driver.get(f"{cec_api.CEC_BASE_URL}/login")
+        for c in entry['cookies']:
+            cookie = {k: v for k, v in c.items() if k in ('name', 'value', 'path', 'domain', 'secure', 'httpOnly', 'expiry', 'sameSite')}
+            try:
+                driver.add_cookie(cookie)
+            except Exception:
+                cookie.pop('domain', None)
+                driver.add_cookie(cookie)
+        for key, value in entry.get('local_storage', {}).items():
+            driver.execute_script("window.localStorage.setItem(arguments[0], arguments[1]);", key, value)
+        driver.get(CHECK_URL)
+        try:
+            outcome = WebDriverWait(driver, SESSION_CHECK_TIMEOUT).until(_session_outcome)
+        except TimeoutException:
+            return False  # Neither page rendered: log in with the form, but keep the cache
+        if outcome == "login":
+            invalidate_session(username)
+            return False
+        return True
+    except Exception:
+        return False
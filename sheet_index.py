@@ -0,0 +1,90 @@
+import json
+import os
+import time
+import threading
+
+# Key for a "Trang tính3" row: class_id:lesson_number, with the lesson number normalised like sync_processed_with_sheet does
+def row_key(row):
+    if len(row) < 4:
+        return None
+    lesson = str(row[3]).strip()
+    try:
+        lesson = str(int(lesson))
+    except ValueError:
+        pass
+    return f"{str(row[0]).strip()}:{lesson}"
+
+# Persistent set of Sheet keys plus the number of Sheet rows already folded into it
+class SheetKeyIndex:
+    def __init__(self, path, refresh_interval=300):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.row_count = 0
+        self.keys = set()
+        self.last_refresh = 0.0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.row_count = int(data.get('row_count', 0))
+            self.keys = set(data.get('keys', []))
+        except Exception:
+            self.row_count = 0
+            self.keys = set()
+
+    def save(self):
+        with self._lock:
+            data = {'row_count': self.row_count, 'keys': sorted(self.keys)}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key):
+        with self._lock:
+            self.keys.add(key)
+
+    # Fold Sheet rows into the index; rows_are_new means they were read from the Sheet right after row_count
+    def add_rows(self, rows, rows_are_new=True):
+        with self._lock:
+            for row in rows:
+                key = row_key(row)
+                if key:
+                    self.keys.add(key)
+            if rows_are_new:
+                self.row_count += len(rows)
+
+    # Replace the index with a full Sheet read
+    def seed(self, rows):
+        with self._lock:
+            self.keys = set()
+            self.row_count = 0
+        self.add_rows(rows)
+        self.last_refresh = time.monotonic()
+
+    # Read only the rows after row_count; returns them, or None if the read failed and the index is used as-is
+    def refresh(self, worksheet, call=None):
+        start = self.row_count + 1
+        read = lambda: worksheet.get(f"A{start}:G")
+        try:
+            rows = call(read) if call else read()
+        except Exception:
+            return None
+        rows = [list(row) for row in rows or []]
+        self.add_rows(rows)
+        self.last_refresh = time.monotonic()
+        return rows
+
+    def refresh_due(self):
+        return time.monotonic() - self.last_refresh >= self.refresh_interval
@@ -0,0 +1,222 @@
+import json
+import os
+import time
+import threading
+from collections import deque
+import gspread
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+from oauth2client.service_account import ServiceAccountCredentials
+
+# Google's default write quota is 60 requests per minute per user; stay below it
+DEFAULT_WRITES_PER_MINUTE = 50
+
+# Run-scoped Google Sheets writer: authorizes once, buffers appended rows per worksheet and flushes them in batches
+class SheetsSink:
+    def __init__(self, credentials_file, sheet_id, scopes, flush_rows=100, flush_interval=60,
+                 writes_per_minute=DEFAULT_WRITES_PER_MINUTE, pending_file=None, on_flush=None, log=print):
+        self.credentials_file = credentials_file
+        self.sheet_id = sheet_id
+        self.scopes = scopes
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.writes_per_minute = writes_per_minute
+        self.pending_file = pending_file
+        self.on_flush = on_flush  # Called as on_flush(worksheet_name, rows) after rows reach the Sheet
+        self.log = log
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._buffers = {}
+        self._write_times = deque()
+        self._last_flush = time.monotonic()
+        self.api_calls = 0
+        self._load_pending()
+
+    # Spreadsheet handle, authorized on first use and reused for the rest of the run
+    def spreadsheet(self):
+        with self._lock:
+            if self._spreadsheet is None:
+                creds = ServiceAccountCredentials.from_json_keyfile_name(self.credentials_file, self.scopes)
+                client = gspread.authorize(creds)
+                self._spreadsheet = client.open_by_key(self.sheet_id)
+                self.api_calls += 1
+            return self._spreadsheet
+
+    def worksheet(self, name):
+        with self._lock:
+            if name not in self._worksheets:
+                self._worksheets[name] = self.spreadsheet().worksheet(name)
+                self.api_calls += 1
+            return self._worksheets[name]
+
+    # Worksheet handle, creating the worksheet first if it does not exist yet; the quota wait before the
+    # create happens outside the lock, so it does not hold up threads that are appending rows
+    def ensure_worksheet(self, name, rows=1000, cols=10):
+        try:
+            return self.worksheet(name)
+        except gspread.exceptions.WorksheetNotFound:
+            pass
+        self.throttle()
+        with self._lock:
+            if name not in self._worksheets:
+                self._worksheets[name] = self.spreadsheet().add_worksheet(title=name, rows=rows, cols=cols)
+                self.log(f"Created worksheet '{name}'")
+            return self._worksheets[name]
+
+    # Replace a view in place: overwrite it from its top-left cell, then clear only the rows below the new values
+    # up to last_column, so readers never see the view empty between the two calls
+    def replace_range(self, name, start_cell, values, last_column):
+        row, col = a1_to_rowcol(start_cell)
+        tail_range = f"{rowcol_to_a1(row + len(values), col)}:{last_column}"
+        self.batch_update(name, [{"range": start_cell, "values": values}])
+        self.call(f"clear '{name}'!{tail_range}", lambda: self.spreadsheet().values_clear(f"'{name}'!{tail_range}"))
+
+    # Block until another write fits in the per-minute quota; the wait happens outside the lock so other
+    # threads can keep buffering rows, and the quota is checked again afterwards
+    def throttle(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._write_times and now - self._write_times[0] >= 60:
+                    self._write_times.popleft()
+                if len(self._write_times) < self.writes_per_minute:
+                    self._write_times.append(now)
+                    self.api_calls += 1
+                    return
+                wait = 60 - (now - self._write_times[0])
+            self.log(f"Sheets write quota reached, waiting {wait:.1f}s")
+            time.sleep(max(wait, 0))
+
+    # Run a Sheets call with quota throttling and retries
+    def call(self, description, fn, max_retries=3):
+        for attempt in range(max_retries):
+            try:
+                self.throttle()
+                return fn()
+            except Exception as e:
+                self.log(f"Attempt {attempt+1}/{max_retries} failed to {description}: {str(e)}")
+                if attempt == max_retries - 1:
+                    raise
+                time.sleep(3 * (attempt + 1))
+
+    def pending(self, name):
+        with self._lock:
+            return list(self._buffers.get(name, []))
+
+    def append(self, name, row, flush=True):
+        self.append_rows(name, [row], flush=flush)
+
+    # Buffer rows and flush when enough are waiting; flush=False only buffers them, for callers that hold
+    # their own lock and call flush_if_due() once it is released
+    def append_rows(self, name, rows, flush=True):
+        with self._lock:
+            self._buffers.setdefault(name, []).extend(rows)
+            self._journal_pending(name, rows)
+        if flush:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        with self._lock:
+            buffered = sum(len(b) for b in self._buffers.values())
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if buffered >= self.flush_rows or due:
+            self.flush()
+
+    # Write every buffered worksheet with one values.append call each; failed rows stay buffered and on disk.
+    # Only one flush runs at a time, and the buffer lock is not held during the network calls, so other
+    # threads keep appending; the rows sent stay buffered (and visible to pending()) until they are written.
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                self._last_flush = time.monotonic()
+                batches = [(name, list(rows)) for name, rows in self._buffers.items() if rows]
+            all_ok = True
+            for name, rows in batches:
+                try:
+                    self.call(f"append {len(rows)} rows to '{name}'", lambda: self.spreadsheet().values_append(
+                        f"'{name}'!A1",
+                        params={"valueInputOption": "RAW", "insertDataOption": "INSERT_ROWS"},
+                        body={"values": rows}
+                    ))
+                except Exception as e:
+                    self.log(f"Error flushing rows to Google Sheet '{name}': {str(e)}")
+                    all_ok = False
+                    continue
+                self.log(f"Flushed {len(rows)} rows to Google Sheet '{name}'")
+                with self._lock:
+                    del self._buffers[name][:len(rows)]
+                    if not self._buffers[name]:
+                        del self._buffers[name]
+                    self._save_pending()
+                    if self.on_flush:
+                        self.on_flush(name, rows)
+            return all_ok
+
+    # Values update for several ranges of one worksheet in a single request
+    def batch_update(self, name, data):
+        if not data:
+            return
+        ranges = [{"range": f"'{name}'!{item['range']}", "values": item["values"]} for item in data]
+        self.call(f"update {len(ranges)} ranges in '{name}'", lambda: self.spreadsheet().values_batch_update(
+            body={"valueInputOption": "RAW", "data": ranges}
+        ))
+
+    # Flush what is left; anything that still fails is kept on disk for the next run
+    def close(self):
+        self.flush()
+        with self._lock:
+            unflushed = sum(len(rows) for rows in self._buffers.values())
+        if unflushed and self.pending_file:
+            self.log(f"Kept {unflushed} unflushed rows in {self.pending_file}")
+        self.log(f"Google Sheets API calls this run: {self.api_calls}")
+
+    # The pending file is a journal of {"name", "rows"} lines; a line cut short by a crash is skipped,
+    # and a file from older runs holding one {name: rows} object is still read
+    def _load_pending(self):
+        if not self.pending_file or not os.path.exists(self.pending_file):
+            return
+        try:
+            with open(self.pending_file, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+            try:
+                legacy = json.loads("".join(lines))  # Older runs wrote one {name: rows} object
+            except ValueError:
+                legacy = None
+            if isinstance(legacy, dict) and 'rows' not in legacy:
+                lines = [json.dumps({'name': name, 'rows': rows}) for name, rows in legacy.items()]
+            for line in lines:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(entry, dict) and entry.get('rows'):
+                    self._buffers.setdefault(entry['name'], []).extend(entry['rows'])
+            self._save_pending()  # Rewrite as a clean journal before new lines are appended to it
+            self.log(f"Re-queued {sum(len(r) for r in self._buffers.values())} unflushed rows from {self.pending_file}")
+        except Exception as e:
+            self.log(f"Error reading {self.pending_file}: {str(e)}")
+
+    # Append newly buffered rows to the journal, so rows already counted as processed survive a crash before
+    # they reach the Sheet without rewriting the whole file on every append. Caller holds the lock.
+    def _journal_pending(self, name, rows):
+        if not self.pending_file:
+            return
+        with open(self.pending_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'name': name, 'rows': rows}, ensure_ascii=False) + "\n")
+
+    # Compact the journal to what is still buffered after a flush; the file is removed once everything has
+    # been flushed. Caller holds the lock.
+    def _save_pending(self):
+        if not self.pending_file:
+            return
+        buffers = {name: rows for name, rows in self._buffers.items() if rows}
+        if not buffers:
+            if os.path.exists(self.pending_file):
+                os.remove(self.pending_file)
+            return
+        tmp_path = f"{self.pending_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for name, rows in buffers.items():
+                f.write(json.dumps({'name': name, 'rows': rows}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.pending_file)
@@ -0,0 +1,196 @@
+import json
+import os
+import sqlite3
+import time
+import threading
+from contextlib import contextmanager
+
+STATE_DB_FILE = os.getenv("STATE_DB_FILE", "state.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS classes (
+    course_name TEXT NOT NULL,
+    class_id TEXT NOT NULL,
+    last_lesson INTEGER NOT NULL DEFAULT -1,
+    total_lessons INTEGER NOT NULL DEFAULT 0,
+    has_errors INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (course_name, class_id)
+);
+CREATE TABLE IF NOT EXISTS lessons (
+    class_id TEXT NOT NULL,
+    lesson_number TEXT NOT NULL,
+    course_name TEXT NOT NULL,
+    lesson_index INTEGER NOT NULL,
+    status TEXT,
+    report_link TEXT,
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (class_id, lesson_number)
+);
+CREATE TABLE IF NOT EXISTS reports (
+    date TEXT NOT NULL,
+    class_name TEXT NOT NULL,
+    report_url TEXT,
+    analysed INTEGER NOT NULL DEFAULT 1,
+    processed_at REAL NOT NULL,
+    PRIMARY KEY (date, class_name)
+);
+"""
+
+# Write JSON next to the target and rename it over, so readers never see a half-written file
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+# WAL-mode SQLite store for class progress, recorded lessons and processed reports.
+# Each thread gets its own connection; writers are serialised by SQLite's lock with a busy timeout.
+# Every connection is also tracked so close() can shut down those opened by worker threads.
+class StateStore:
+    def __init__(self, path=STATE_DB_FILE, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self.connection().executescript(SCHEMA)
+        self._migrate()
+
+    # Databases created before reports tracked their analysis get the column; their rows count as analysed
+    def _migrate(self):
+        columns = {row[1] for row in self.connection().execute("PRAGMA table_info(reports)")}
+        if "analysed" not in columns:
+            self.connection().execute("ALTER TABLE reports ADD COLUMN analysed INTEGER NOT NULL DEFAULT 1")
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # check_same_thread=False only so close() can close it; it is still used by this thread alone
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    # BEGIN IMMEDIATE so concurrent writers queue up instead of failing on lock upgrade
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # Fold the WAL back into the database file and truncate it, so state.sqlite alone holds every write
+    # when it is copied (actions/cache) while connections are still open
+    def checkpoint(self):
+        self.connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    # Checkpoint, then close the connections of every thread; call once the workers have finished
+    def close(self):
+        try:
+            self.checkpoint()
+        finally:
+            with self._connections_lock:
+                connections, self._connections = self._connections, []
+            for conn in connections:
+                conn.close()
+            self._local = threading.local()
+
+    # Classes
+
+    def save_class(self, course_name, class_id, progress, conn=None):
+        row = (course_name, str(class_id), int(progress.get('last_lesson', -1)), int(progress.get('total_lessons', 0) or 0),
+               int(bool(progress.get('has_errors', False))), time.time())
+        sql = ("INSERT INTO classes (course_name, class_id, last_lesson, total_lessons, has_errors, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+               "ON CONFLICT (course_name, class_id) DO UPDATE SET last_lesson = MAX(last_lesson, excluded.last_lesson), "
+               "total_lessons = excluded.total_lessons, has_errors = excluded.has_errors, updated_at = excluded.updated_at")
+        if conn is not None:
+            conn.execute(sql, row)
+            return
+        with self.transaction() as conn:
+            conn.execute(sql, row)
+
+    # Progress of a finished lesson and its row, in one transaction
+    def record_lesson(self, course_name, class_id, progress, lesson_number, lesson_index, status=None, report_link=None):
+        with self.transaction() as conn:
+            self.save_class(course_name, class_id, progress, conn=conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO lessons (class_id, lesson_number, course_name, lesson_index, status, report_link, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(class_id), str(lesson_number), course_name, lesson_index, status, report_link, time.time())
+            )
+
+    # Every class as the legacy processed.json shape: {course: {class_id: {last_lesson, total_lessons, has_errors}}}
+    def load_classes(self):
+        processed = {}
+        for course_name, class_id, last_lesson, total_lessons, has_errors in self.connection().execute(
+                "SELECT course_name, class_id, last_lesson, total_lessons, has_errors FROM classes ORDER BY rowid"):
+            processed.setdefault(course_name, {})[class_id] = {
+                'last_lesson': last_lesson,
+                'total_lessons': total_lessons,
+                'has_errors': bool(has_errors)
+            }
+        return processed
+
+    def lesson_keys(self):
+        return {f"{class_id}:{lesson_number}" for class_id, lesson_number in
+                self.connection().execute("SELECT class_id, lesson_number FROM lessons")}
+
+    # Merge a legacy processed.json into the store; a class keeps whichever side got further
+    def import_processed_json(self, path):
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        current = self.load_classes()
+        imported = 0
+        with self.transaction() as conn:
+            for course_name, classes in data.items():
+                for class_id, progress in classes.items():
+                    existing = current.get(course_name, {}).get(str(class_id))
+                    if existing and existing['last_lesson'] >= progress.get('last_lesson', -1):
+                        continue
+                    self.save_class(course_name, class_id, progress, conn=conn)
+                    imported += 1
+        return imported
+
+    def export_processed_json(self, path):
+        write_json_atomic(path, self.load_classes())
+
+    # Reports
+
+    # analysed=False records a report whose analysis has not finished yet, so the next run retries it
+    def save_report(self, date, class_name, report_url, analysed=True):
+        with self.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO reports (date, class_name, report_url, analysed, processed_at) VALUES (?, ?, ?, ?, ?)",
+                         (date, class_name, report_url, int(bool(analysed)), time.time()))
+
+    def get_report(self, date, class_name):
+        row = self.connection().execute("SELECT report_url, analysed FROM reports WHERE date = ? AND class_name = ?", (date, class_name)).fetchone()
+        return {"report_url": row[0], "analysed": bool(row[1])} if row else None
+
+    def latest_report(self):
+        row = self.connection().execute("SELECT date, class_name, report_url FROM reports ORDER BY processed_at DESC LIMIT 1").fetchone()
+        return {"date": row[0], "class_name": row[1], "report_url": row[2]} if row else {}
+
+    # The legacy processed2.json holds only the latest report
+    def import_report_json(self, path):
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not data.get("date") or not data.get("class_name") or self.get_report(data["date"], data["class_name"]):
+            return 0
+        self.save_report(data["date"], data["class_name"], data.get("report_url"))
+        return 1
+
+    def export_report_json(self, path):
+        write_json_atomic(path, self.latest_report())